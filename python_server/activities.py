@@ -0,0 +1,107 @@
+import base64
+import csv
+import io
+import json
+from datetime import datetime
+from sqlalchemy import and_, desc, literal_column, or_, select, union_all
+from models import ArchivedTicket, Ticket, DEFAULT_GARAGE_ID
+
+# Columns selected for the activity feed; plain rows (not ORM objects) keep
+# streamed exports out of the session's identity map
+ACTIVITY_COLUMNS = (
+    Ticket.id,
+    Ticket.ticket_number,
+    Ticket.license_plate,
+    Ticket.entry_time,
+    Ticket.exit_time,
+    Ticket.duration_minutes,
+    Ticket.amount_paid,
+    Ticket.status,
+)
+
+CSV_FIELDS = [
+    'id', 'ticketNumber', 'licensePlate', 'entryTime', 'exitTime',
+    'durationMinutes', 'amount', 'status'
+]
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def encode_cursor(entry_time, ticket_id):
+    """Build the opaque cursor pointing just past (entry_time, id)."""
+    raw = f"{entry_time.isoformat()}|{ticket_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the (entry_time, id) position stored in a cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        entry_time, ticket_id = raw.split('|')
+        return datetime.fromisoformat(entry_time), int(ticket_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(str(e)) from e
+
+
+def _activities_select(source, position, garage_id):
+    query = select(*(getattr(source, column.key) for column in ACTIVITY_COLUMNS)).where(
+        source.garage_id == garage_id
+    )
+    if position:
+        entry_time, ticket_id = position
+        # Keyset condition on the (garage_id, entry_time, id) index
+        query = query.where(or_(
+            source.entry_time < entry_time,
+            and_(source.entry_time == entry_time, source.id < ticket_id)
+        ))
+    return query
+
+
+def activities_query(cursor=None, garage_id=DEFAULT_GARAGE_ID):
+    """A garage's activities newest first, optionally starting after a cursor position.
+
+    Live and archived tickets are read with one UNION ALL ordered on the
+    (garage_id, entry_time, id) indexes of both tables, so the database
+    merges the two index scans and stops at the LIMIT.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    return union_all(
+        _activities_select(Ticket, position, garage_id),
+        _activities_select(ArchivedTicket, position, garage_id)
+    ).order_by(desc(literal_column('entry_time')), desc(literal_column('id')))
+
+
+def activity_to_dict(row):
+    """JSON-ready ActivityResponse payload for one activity row."""
+    return {
+        'id': row.id,
+        'ticketNumber': row.ticket_number,
+        'licensePlate': row.license_plate,
+        'entryTime': row.entry_time.isoformat(),
+        'exitTime': row.exit_time.isoformat() if row.exit_time else None,
+        'durationMinutes': row.duration_minutes,
+        'amount': row.amount_paid / 100 if row.amount_paid else None,  # Convert to dollars
+        'status': row.status
+    }
+
+
+def rows_to_ndjson(rows):
+    """Encode a chunk of activity rows as newline-delimited JSON."""
+    return ''.join(
+        json.dumps(activity_to_dict(row), separators=(',', ':')) + '\n'
+        for row in rows
+    )
+
+
+def rows_to_csv(rows, header=False):
+    """Encode a chunk of activity rows as CSV."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(CSV_FIELDS)
+    for row in rows:
+        activity = activity_to_dict(row)
+        writer.writerow(activity[field] for field in CSV_FIELDS)
+    return buffer.getvalue()
@@ -0,0 +1,328 @@
+"""Occupancy analytics over a garage's ticket history.
+
+The entry and exit times of every stay overlapping the requested window are
+streamed from `tickets` and `tickets_archive` as epoch seconds into NumPy
+arrays, without building a datetime or ORM object per row. Everything else
+is vectorized over those arrays:
+
+- occupancy is a sweep over the sorted entry (+1) and exit (-1) events; its
+  running area gives the average occupancy of any bucket and the event
+  levels give the peak
+- dwell times of the stays that entered in the window, as a histogram
+- day-of-week x hour heatmaps of the average occupancy and entries
+- a seasonal forecast: each coming hour is the average of the same hour of
+  the week over the last FORECAST_WEEKS weeks of the window
+
+Vehicles still parked count until the end of the window, which never goes
+past the current time. Each worker keeps the results per garage and window
+(see `OccupancyAnalytics`), so dashboards polling the same window share one
+computation.
+"""
+import asyncio
+import itertools
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import Float, cast, func, or_, select
+from models import Ticket, ArchivedTicket, DEFAULT_GARAGE_ID
+
+# Seconds a result is reused for the same garage and window
+ANALYTICS_CACHE_TTL = float(os.getenv('ANALYTICS_CACHE_TTL', 300))
+# Windows kept per garage in each worker
+ANALYTICS_CACHE_SIZE = int(os.getenv('ANALYTICS_CACHE_SIZE', 32))
+# Rows fetched from the database per round-trip
+ANALYTICS_BATCH_SIZE = int(os.getenv('ANALYTICS_BATCH_SIZE', 50_000))
+# Weeks of history averaged into each forecast hour
+FORECAST_WEEKS = int(os.getenv('FORECAST_WEEKS', 4))
+# Days analysed when a request gives no start
+ANALYTICS_DEFAULT_DAYS = int(os.getenv('ANALYTICS_DEFAULT_DAYS', 28))
+# Most buckets in one response (a year of hourly buckets is 8760)
+ANALYTICS_MAX_BUCKETS = 20_000
+
+# Upper edges of the dwell-time histogram bins in minutes; the last bin is open
+DWELL_BINS = (15, 30, 60, 120, 180, 240, 360, 480, 720, 1440)
+HOURS_PER_WEEK = 168
+EPOCH = datetime(1970, 1, 1)
+# Julian day number of the Unix epoch (SQLite's julianday)
+UNIX_EPOCH_JULIAN_DAY = 2440587.5
+
+
+def to_epoch(value):
+    """Seconds since 1970 of a naive datetime, as stored on tickets."""
+    return (value - EPOCH).total_seconds()
+
+
+def from_epoch(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+
+class InvalidWindow(ValueError):
+    """Raised when an analytics window or bucket size cannot be served."""
+
+
+def naive_local(value):
+    """A query datetime as the naive local time tickets are stored in."""
+    if value and value.tzinfo:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def analytics_window(start, end, bucket_minutes, now=None):
+    """The (start, end) to analyse: whole buckets, ending no later than now."""
+    if 1440 % bucket_minutes:
+        raise InvalidWindow("bucketMinutes must divide a day")
+    bucket_seconds = bucket_minutes * 60
+    start, end = naive_local(start), naive_local(end)
+    now = now or datetime.now()
+    end = min(end or now, now)
+    start = start or end - timedelta(days=ANALYTICS_DEFAULT_DAYS)
+    # Buckets are aligned to midnight, so a cached window serves every
+    # request until the next bucket completes
+    end = from_epoch(to_epoch(end) // bucket_seconds * bucket_seconds)
+    start = from_epoch(to_epoch(start) // bucket_seconds * bucket_seconds)
+    if start >= end:
+        raise InvalidWindow("start must be at least one bucket before end")
+    if (end - start).total_seconds() / bucket_seconds > ANALYTICS_MAX_BUCKETS:
+        raise InvalidWindow(f"Window is longer than {ANALYTICS_MAX_BUCKETS} buckets")
+    return start, end
+
+
+def _epoch_seconds(column, dialect_name):
+    # Convert in SQL so rows arrive as plain floats instead of datetimes
+    # parsed one by one
+    if dialect_name == 'postgresql':
+        return cast(func.extract('epoch', column), Float)
+    # julianday is only good to ~50 microseconds; rounded to milliseconds so
+    # a time on a bucket boundary stays in its bucket
+    return func.round((func.julianday(column) - UNIX_EPOCH_JULIAN_DAY) * 86_400_000) / 1000.0
+
+
+def stays_query(source, dialect_name, start, end, garage_id=DEFAULT_GARAGE_ID):
+    """Entry and exit times (epoch seconds, exit NULL while parked) of the stays overlapping [start, end)."""
+    return select(
+        _epoch_seconds(source.entry_time, dialect_name),
+        _epoch_seconds(source.exit_time, dialect_name)
+    ).where(
+        source.garage_id == garage_id,
+        source.entry_time < end,
+        or_(source.exit_time.is_(None), source.exit_time > start)
+    )
+
+
+async def load_stays(session, start, end, garage_id=DEFAULT_GARAGE_ID, batch_size=ANALYTICS_BATCH_SIZE):
+    """Stream a garage's stays overlapping [start, end) into (entries, exits) float64 arrays."""
+    import numpy as np
+    # Core rows straight off the connection; the ORM adds nothing for two floats
+    connection = await session.connection()
+    chunks = []
+    # Archived tickets are completed stays too; a year of history is mostly archived
+    for source in (Ticket, ArchivedTicket):
+        result = await connection.stream(
+            stays_query(source, connection.dialect.name, start, end, garage_id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for rows in result.partitions():
+            # Flattened rather than np.array(rows), which probes every Row as
+            # a mapping; NULL exit times become NaN
+            chunks.append(np.fromiter(
+                itertools.chain.from_iterable(rows), dtype=np.float64, count=2 * len(rows)
+            ).reshape(-1, 2))
+    stays = np.concatenate(chunks) if chunks else np.empty((0, 2))
+    return stays[:, 0], stays[:, 1]
+
+
+class Occupancy:
+    """Occupancy over [start, end] as a step function of the sorted events."""
+
+    def __init__(self, entries, exits, start, end):
+        import numpy as np
+        # Stays are clipped to the window; vehicles still parked stay until its end
+        entered = np.maximum(entries, start)
+        exited = np.minimum(np.where(np.isnan(exits), end, exits), end)
+        times = np.concatenate((entered, exited))
+        deltas = np.concatenate((np.ones(len(entered), np.int64), np.full(len(exited), -1, np.int64)))
+        # Exits before entries at the same instant, so a space changing hands
+        # never shows as a momentary peak
+        order = np.lexsort((deltas, times))
+        # Starts empty at `start`, so every time in the window has a last event
+        self.times = np.concatenate(([start], times[order]))
+        self.levels = np.concatenate(([0], np.cumsum(deltas[order])))
+        # Space-seconds up to each event
+        self.area = np.concatenate(([0.0], np.cumsum(self.levels[:-1] * np.diff(self.times))))
+
+    def _last_event(self, times):
+        import numpy as np
+        return np.searchsorted(self.times, times, side='right') - 1
+
+    def level_at(self, times):
+        """Vehicles parked at each of `times`."""
+        return self.levels[self._last_event(times)]
+
+    def area_at(self, times):
+        """Space-seconds from the window start to each of `times`."""
+        index = self._last_event(times)
+        return self.area[index] + self.levels[index] * (times - self.times[index])
+
+    def averages(self, edges):
+        """Average occupancy between consecutive `edges`."""
+        import numpy as np
+        return np.diff(self.area_at(edges)) / np.diff(edges)
+
+    def peaks(self, edges):
+        """Highest occupancy between consecutive `edges` (sorted, evenly spaced)."""
+        import numpy as np
+        peaks = self.level_at(edges[:-1]).copy()
+        inside = (self.times >= edges[0]) & (self.times < edges[-1])
+        times, levels = self.times[inside], self.levels[inside]
+        if len(times):
+            buckets = ((times - edges[0]) // (edges[1] - edges[0])).astype(np.int64)
+            # Events are sorted, so each bucket's events are one contiguous run
+            starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+            peaks[buckets[starts]] = np.maximum(peaks[buckets[starts]], np.maximum.reduceat(levels, starts))
+        return peaks
+
+
+def _counts(times, start, end, step):
+    """How many of `times` fall in each `step`-second bucket of [start, end)."""
+    import numpy as np
+    times = times[(times >= start) & (times < end)]
+    return np.bincount(((times - start) // step).astype(np.int64), minlength=int((end - start) // step))
+
+
+def _hours_of_week(hour_starts):
+    # Monday 00:00 is hour 0; 1970-01-01 was a Thursday
+    import numpy as np
+    hours = (hour_starts // 3600).astype(np.int64)
+    return ((hours // 24 + 3) % 7) * 24 + hours % 24
+
+
+def _round(values, digits=2):
+    """JSON-ready list, with None where there is no data."""
+    import numpy as np
+    return [None if value != value else value for value in np.round(values, digits).tolist()]
+
+
+def dwell_summary(entries, exits, start, end):
+    """Dwell-time histogram and percentiles of the stays that entered in [start, end) and have left."""
+    import numpy as np
+    completed = (entries >= start) & (entries < end) & ~np.isnan(exits)
+    minutes = (exits[completed] - entries[completed]) / 60
+    counts, _ = np.histogram(minutes, bins=(0, *DWELL_BINS, np.inf))
+    lower = (0, *DWELL_BINS)
+    upper = (*DWELL_BINS, None)
+    has_stays = len(minutes) > 0
+    p50, p90 = np.percentile(minutes, (50, 90)) if has_stays else (None, None)
+    return {
+        'count': len(minutes),
+        'averageMinutes': round(float(minutes.mean()), 1) if has_stays else None,
+        'p50Minutes': round(float(p50), 1) if has_stays else None,
+        'p90Minutes': round(float(p90), 1) if has_stays else None,
+        'histogram': [
+            {'minMinutes': low, 'maxMinutes': high, 'count': count}
+            for low, high, count in zip(lower, upper, counts.tolist())
+        ]
+    }
+
+
+def analyze(entries, exits, start, end, bucket_seconds, horizon_hours, forecast_weeks=FORECAST_WEEKS):
+    """Occupancy series, dwell times, heatmaps and forecast for [start, end) in epoch seconds.
+
+    `start` and `end` must be multiples of `bucket_seconds`.
+    """
+    import numpy as np
+    occupancy = Occupancy(entries, exits, start, end)
+
+    edges = np.arange(start, end + bucket_seconds, bucket_seconds, dtype=np.float64)
+    bucket_starts = edges[:-1].astype('datetime64[s]').astype(str).tolist()
+    series = [
+        {'bucketStart': bucket_start, 'averageOccupancy': average, 'peakOccupancy': peak,
+         'entries': entered, 'exits': exited}
+        for bucket_start, average, peak, entered, exited in zip(
+            bucket_starts,
+            _round(occupancy.averages(edges)),
+            occupancy.peaks(edges).tolist(),
+            _counts(entries, start, end, bucket_seconds).tolist(),
+            _counts(exits[~np.isnan(exits)], start, end, bucket_seconds).tolist()
+        )
+    ]
+
+    # Whole hours of the window, for the heatmaps and the forecast
+    hour_start = -(-start // 3600) * 3600
+    hour_end = end // 3600 * 3600
+    hours = np.arange(hour_start, max(hour_end, hour_start) + 3600, 3600, dtype=np.float64)
+    hourly = occupancy.averages(hours) if len(hours) > 1 else np.empty(0)
+    slots = _hours_of_week(hours[:-1])
+    samples = np.bincount(slots, minlength=HOURS_PER_WEEK)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        occupancy_heatmap = np.bincount(slots, weights=hourly, minlength=HOURS_PER_WEEK) / samples
+        entries_heatmap = np.bincount(
+            slots, weights=_counts(entries, hour_start, hour_end, 3600) if len(slots) else None,
+            minlength=HOURS_PER_WEEK
+        ) / samples
+
+    # Same hour of the week, 1..forecast_weeks weeks back
+    future = hour_end + 3600 * np.arange(horizon_hours, dtype=np.float64)
+    lags = ((future - hour_start) // 3600).astype(np.int64)[None, :] \
+        - HOURS_PER_WEEK * np.arange(1, forecast_weeks + 1)[:, None]
+    valid = (lags >= 0) & (lags < len(hourly))
+    history = np.where(valid, hourly[np.clip(lags, 0, max(len(hourly) - 1, 0))] if len(hourly) else 0.0, 0.0)
+    used = valid.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        forecast = history.sum(axis=0) / used
+    forecast_starts = future.astype('datetime64[s]').astype(str).tolist()
+
+    return {
+        'start': from_epoch(start).isoformat(),
+        'end': from_epoch(end).isoformat(),
+        'bucketMinutes': int(bucket_seconds // 60),
+        'stays': len(entries),
+        'occupancy': series,
+        'dwell': dwell_summary(entries, exits, start, end),
+        # Rows are days of the week (Monday first), columns hours of the day
+        'heatmap': {
+            'averageOccupancy': [_round(row) for row in occupancy_heatmap.reshape(7, 24)],
+            'averageEntries': [_round(row) for row in entries_heatmap.reshape(7, 24)]
+        },
+        'forecast': [
+            {'hourStart': hour, 'averageOccupancy': average, 'weeks': weeks}
+            for hour, average, weeks in zip(forecast_starts, _round(forecast), used.tolist())
+        ]
+    }
+
+
+class OccupancyAnalytics:
+    """Per-worker cache of one garage's analytics, per window."""
+
+    def __init__(self, garage_id=DEFAULT_GARAGE_ID, ttl=ANALYTICS_CACHE_TTL, size=ANALYTICS_CACHE_SIZE):
+        self.garage_id = garage_id
+        self.ttl = ttl
+        self.size = size
+        self._results = OrderedDict()  # (start, end, bucket, horizon) -> (computed at, result)
+        self._lock = asyncio.Lock()
+
+    def _cached(self, key):
+        entry = self._results.get(key)
+        if entry is None or (self.ttl > 0 and time.monotonic() - entry[0] >= self.ttl):
+            return None
+        self._results.move_to_end(key)
+        return entry[1]
+
+    async def get(self, session, start, end, bucket_seconds, horizon_hours):
+        """Analytics for [start, end) (datetimes on bucket boundaries), computed once per TTL."""
+        key = (start, end, bucket_seconds, horizon_hours)
+        result = self._cached(key)
+        if result is None:
+            # One computation per window, however many requests ask for it
+            async with self._lock:
+                result = self._cached(key)
+                if result is None:
+                    entries, exits = await load_stays(session, start, end, self.garage_id)
+                    # Keep the event loop free for the gates while NumPy works
+                    result = await asyncio.to_thread(
+                        analyze, entries, exits, to_epoch(start), to_epoch(end), bucket_seconds, horizon_hours
+                    )
+                    self._results[key] = (time.monotonic(), result)
+                    while len(self._results) > self.size:
+                        self._results.popitem(last=False)
+        return result
@@ -1,15 +1,36 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
-from fastapi.responses import JSONResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import APIRouter, FastAPI, Depends, Header, HTTPException, Path, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
+import json
+import math
+import asyncio
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from datetime import datetime
-import math
-from database import init_db, db_session, shutdown_session
-from models import Ticket, GarageSetting
-from sqlalchemy import func, desc
-import random
+from database import (
+    DB_PREPARED_ENV, DB_REPLICA_LAG_SECONDS, DB_SKIP_SCHEMA_CHECK, READ_PRIMARY_COOKIE,
+    dispose_engines, garage_sessionmaker, get_async_engine, get_replica_engine, open_read_session,
+    prepare_database, shard_engines, shutdown_session
+)
+from models import Ticket, ArchivedTicket, GarageSetting, DEFAULT_GARAGE_ID, TICKET_IS_ACTIVE, normalize_plate
+from settings_cache import SettingsSnapshot
+from garages import Garage, create_garage_settings, garages
+from events import broker
+import metrics
+from serializers import FastJSONResponse, batch_result
+from idempotency import idempotent
+from entry_journal import entry_journal
+from static_assets import static_assets
+from plates import latest_tickets_query, plate_search_query, PLATE_SEARCH_MAX_LIMIT
+from tariffs import tariff_for_settings
+from rollups import record_entries, record_exits, report_query, report_row_to_dict
+from archive import find_ticket
+from analytics import InvalidWindow, analytics_window, naive_local
+from activities import activities_query, activity_to_dict, encode_cursor, InvalidCursor, rows_to_csv, rows_to_ndjson
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 from schemas import (
     TicketCreate, 
@@ -17,18 +38,67 @@ from schemas import (
     ExitRequest, 
     ActivityResponse, 
     GarageStatsResponse,
+    GarageSettingsUpdate,
+    BatchTicketCreate,
+    BatchExitRequest,
+    BatchResponse,
+    GarageSettingsResponse,
+    ReportRow,
+    AnalyticsResponse,
+    SpaceSectionResponse,
     StatusResponse,
     ErrorResponse
 )
-import uvicorn
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.requests import HTTPConnection
 from fastapi.exceptions import RequestValidationError
 from starlette import status
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="Parking Garage System")
+@asynccontextmanager
+async def lifespan(app):
+    """Per-worker startup and shutdown; importing the app touches no database."""
+    # Time every SQL statement for the per-request metrics
+    metrics.instrument_engine(get_async_engine().sync_engine)
+    if get_replica_engine() is not None:
+        metrics.instrument_engine(get_replica_engine().sync_engine)
+    for engine in shard_engines():
+        metrics.instrument_engine(engine.sync_engine)
+    # Index the built frontend once; requests never touch the filesystem
+    static_assets.load()
+    
+    if not DB_SKIP_SCHEMA_CHECK:
+        # Create tables and default settings, unless the launcher already did
+        # so once before starting the workers
+        if not os.getenv(DB_PREPARED_ENV):
+            prepare_database()
+    
+    # Replay entries journaled by stopped workers before anything is loaded
+    # from the tickets table; open this worker's journal when write-behind
+    # is enabled
+    await entry_journal.start(garage_sessionmaker)
+    
+    if not DB_SKIP_SCHEMA_CHECK:
+        # Load the default garage's in-memory state once per worker (other
+        # garages, and otherwise this one, load on first use)
+        garage = garages.get(DEFAULT_GARAGE_ID)
+        async with garage.session_factory() as session:
+            await garage.stats.load(session)
+            await garage.plates.load(session)
+            settings = await garage.settings.get(session)
+            if settings:
+                await garage.spaces.load(session, settings)
+    await broker.start()
+    try:
+        yield
+    finally:
+        await broker.stop()
+        await entry_journal.stop()
+        await dispose_engines()
+
+app = FastAPI(title="Parking Garage System", default_response_class=metrics.TimedJSONResponse, lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -37,24 +107,71 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets browser clients read the cursor for the next page of tickets
+    expose_headers=["X-Next-Cursor"],
 )
 
-# Initialize database
-init_db()
+# Largest page served by GET /api/activities; bigger exports should stream
+ACTIVITIES_MAX_LIMIT = 1000
+# Seconds between keepalive comments on idle event streams
+EVENTS_KEEPALIVE_SECONDS = 15
+# Rows fetched from the database per round-trip when streaming an export
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+# Entries retried when the assigned space was just taken through another worker
+SPACE_ASSIGN_ATTEMPTS = 3
+# Requests after which the client's reads stay on the primary for a while
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
 
-# Create default garage settings if none exist
-def initialize_garage_settings():
-    settings = db_session.query(GarageSetting).first()
-    if not settings:
-        new_settings = GarageSetting(
-            total_spaces=140,
-            hourly_rate=1000  # $10.00 in cents
-        )
-        db_session.add(new_settings)
-        db_session.commit()
+# Garage-wide routes (stats, settings, spaces, analytics, live events) and
+# ticket routes. Both are served for the default garage under /api/garage and
+# /api, and for any garage under /api/garages/{garage_id} (included after the
+# routes)
+garage_router = APIRouter()
+ticket_router = APIRouter()
+
+def garage_path(garage_id: int = Path(ge=1)):
+    """Validates (and documents) the garage id of the /api/garages/{garage_id} routes."""
+
+def current_garage_id(connection: HTTPConnection) -> int:
+    """The garage id a request is for: from its path, else the default garage."""
+    try:
+        garage_id = int(connection.path_params.get('garage_id', DEFAULT_GARAGE_ID))
+    except ValueError:
+        garage_id = 0
+    if garage_id < 1:
+        raise HTTPException(status_code=400, detail="Invalid garage id")
+    return garage_id
 
-# Run initialization
-initialize_garage_settings()
+async def current_garage(garage_id: int = Depends(current_garage_id)) -> Garage:
+    """The garage a request is for; 404 unless its settings exist."""
+    garage = await garages.find(garage_id)
+    if garage is None:
+        raise HTTPException(status_code=404, detail="Garage not found")
+    return garage
+
+async def get_garage_db(garage_id: int = Depends(current_garage_id)):
+    """Yield a session on the database holding the request's garage."""
+    async with garage_sessionmaker(garage_id)() as session:
+        yield session
+
+async def get_garage_read_db(request: Request, garage_id: int = Depends(current_garage_id)):
+    """Yield a session for a read that tolerates replica lag."""
+    session = await open_read_session(READ_PRIMARY_COOKIE in request.cookies, garage_sessionmaker(garage_id))
+    async with session:
+        yield session
+
+async def publish_garage_event(garage, db, event, delta):
+    """Push a stats change to the garage's live subscribers (SSE and WebSocket).
+
+    Best effort: the change is already committed, so a failure (e.g. Redis
+    unreachable) is logged and the request still succeeds.
+    """
+    try:
+        settings = await garage.settings.get(db)
+        if settings:
+            await broker.publish(event, delta, garage.stats.to_response(settings), garage.id)
+    except Exception as e:
+        print(f"Error publishing garage event: {e}")
 
 # Custom exception handlers
 @app.exception_handler(StarletteHTTPException)
@@ -71,111 +188,584 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content={"message": "Validation error", "errors": str(exc)},
     )
 
-# Mount static files
-try:
-    app.mount("/assets", StaticFiles(directory="../client/dist/assets"), name="assets")
-except:
-    pass
 
 # API endpoints
 @app.get("/api/status", response_model=StatusResponse)
 async def get_status():
     return {"status": "ok"}
 
-@app.get("/api/garage/stats", response_model=GarageStatsResponse)
-async def get_garage_stats():
+@garage_router.get("/stats", response_model=GarageStatsResponse)
+async def get_garage_stats(
+    reconcile: bool = False,
+    garage: Garage = Depends(current_garage),
+    db: AsyncSession = Depends(get_garage_db)
+):
     try:
-        # Get garage settings
-        settings = db_session.query(GarageSetting).first()
+        # Answer from the garage's in-memory counters, reloading them from
+        # the database when asked to (or when they are due for reconciliation)
+        if reconcile or garage.stats.needs_reconcile():
+            await garage.stats.load(db)
+        
+        settings = await garage.settings.get(db)
         if not settings:
-            raise HTTPException(status_code=404, detail="Garage settings not found")
-        
-        # Count active tickets for occupied spaces
-        occupied_spaces = db_session.query(Ticket).filter_by(status='active').count()
-        available_spaces = settings.total_spaces - occupied_spaces
-        
-        # Calculate occupancy percentages
-        occupied_percentage = math.floor((occupied_spaces / settings.total_spaces) * 100)
-        available_percentage = 100 - occupied_percentage
-        
-        # Calculate today's revenue
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_revenue = db_session.query(func.sum(Ticket.amount_paid)).filter(
-            Ticket.status == 'completed',
-            Ticket.exit_time >= today
-        ).scalar() or 0
-        
-        # Count vehicles processed today
-        vehicles_processed = db_session.query(Ticket).filter(
-            Ticket.status == 'completed',
-            Ticket.exit_time >= today
-        ).count()
-        
-        # Calculate average stay time
-        avg_stay = db_session.query(func.avg(Ticket.duration_minutes)).filter(
-            Ticket.status == 'completed'
-        ).scalar() or 0
-        
-        return {
-            'totalSpaces': settings.total_spaces,
-            'occupiedSpaces': occupied_spaces,
-            'availableSpaces': available_spaces,
-            'occupiedSpacesPercentage': occupied_percentage,
-            'availableSpacesPercentage': available_percentage,
-            'hourlyRate': settings.hourly_rate / 100,  # Convert to dollars
-            'todaysRevenue': today_revenue / 100,  # Convert to dollars
-            'vehiclesProcessedToday': vehicles_processed,
-            'averageStayTime': round(avg_stay / 60, 1) if avg_stay else 0  # Convert to hours and round to 1 decimal place
-        }
+            raise HTTPException(status_code=404, detail="Garage not found")
+        
+        return FastJSONResponse(garage.stats.to_response(settings))
     except HTTPException:
         raise
     except Exception as e:
         print(f"Error getting garage stats: {e}")
         raise HTTPException(status_code=500, detail="Error retrieving garage statistics")
 
-@app.post("/api/tickets", response_model=TicketResponse, status_code=status.HTTP_201_CREATED)
-async def create_ticket(ticket_data: TicketCreate):
+@garage_router.get("/settings", response_model=GarageSettingsResponse)
+async def get_garage_settings(garage: Garage = Depends(current_garage), db: AsyncSession = Depends(get_garage_db)):
+    try:
+        settings = await garage.settings.get(db)
+        if not settings:
+            raise HTTPException(status_code=404, detail="Garage not found")
+        
+        return settings.to_dict()
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error getting garage settings: {e}")
+        raise HTTPException(status_code=500, detail="Error retrieving garage settings")
+
+@garage_router.put("/settings", response_model=GarageSettingsResponse)
+async def update_garage_settings(
+    settings_data: GarageSettingsUpdate,
+    garage_id: int = Depends(current_garage_id),
+    db: AsyncSession = Depends(get_garage_db)
+):
     try:
+        values = {}
+        if settings_data.totalSpaces is not None:
+            values['total_spaces'] = settings_data.totalSpaces
+        if settings_data.hourlyRate is not None:
+            values['hourly_rate'] = settings_data.hourlyRate
+        
+        settings_id = (await db.execute(
+            select(GarageSetting.id).where(GarageSetting.garage_id == garage_id)
+        )).scalar()
+        if settings_id is None:
+            if garage_id == DEFAULT_GARAGE_ID:
+                raise HTTPException(status_code=404, detail="Garage not found")
+            # The first update of another garage creates it
+            settings_id = await create_garage_settings(db, garage_id)
+        
+        # Bump the version so other workers notice the change on their next check
+        settings = (await db.execute(
+            update(GarageSetting)
+            .where(GarageSetting.id == settings_id)
+            .values(version=GarageSetting.version + 1, **values)
+            .returning(GarageSetting)
+        )).scalar()
+        await db.commit()
+        
+        snapshot = SettingsSnapshot.from_model(settings)
+        garage = garages.get(garage_id)
+        garage.settings.set(snapshot)
+        await publish_garage_event(garage, db, 'settings', {})
+        
+        return snapshot.to_dict()
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        print(f"Error updating garage settings: {e}")
+        raise HTTPException(status_code=500, detail="Error updating garage settings")
+
+@garage_router.get("/spaces", response_model=List[SpaceSectionResponse])
+async def get_garage_spaces(garage: Garage = Depends(current_garage), db: AsyncSession = Depends(get_garage_db)):
+    try:
+        settings = await garage.settings.get(db)
+        if not settings:
+            raise HTTPException(status_code=404, detail="Garage not found")
+        
+        await garage.spaces.ensure_loaded(db, settings)
+        return FastJSONResponse(garage.spaces.summary())
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error getting garage spaces: {e}")
+        raise HTTPException(status_code=500, detail="Error retrieving garage spaces")
+
+@garage_router.get("/analytics", response_model=AnalyticsResponse)
+async def get_garage_analytics(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucketMinutes: int = Query(60, ge=5, le=1440),
+    horizonHours: int = Query(24, ge=0, le=168),
+    garage: Garage = Depends(current_garage),
+    db: AsyncSession = Depends(get_garage_read_db)
+):
+    try:
+        start, end = analytics_window(start, end, bucketMinutes)
+        # Computed from the ticket history once per window and cached per worker
+        result = await garage.analytics.get(db, start, end, bucketMinutes * 60, horizonHours)
+        return FastJSONResponse(result)
+    except HTTPException:
+        raise
+    except InvalidWindow as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error computing garage analytics: {e}")
+        raise HTTPException(status_code=500, detail="Error computing garage analytics")
+
+async def current_stats_message(garage):
+    # Initial snapshot for a new subscriber
+    async with garage.session_factory() as session:
+        settings = await garage.settings.get(session)
+    stats = garage.stats.to_response(settings) if settings else None
+    return json.dumps(
+        {'seq': 0, 'garageId': garage.id, 'event': 'snapshot', 'delta': {}, 'stats': stats},
+        separators=(',', ':')
+    )
+
+@garage_router.get("/events")
+async def garage_events(request: Request, garage: Garage = Depends(current_garage)):
+    """Server-sent events stream of the garage's occupancy and revenue changes."""
+    subscription = broker.subscribe(garage.id)
+    initial = await current_stats_message(garage)
+    
+    async def stream():
+        try:
+            yield f"data: {initial}\n\n"
+            while True:
+                message = await subscription.get(timeout=EVENTS_KEEPALIVE_SECONDS)
+                if message is None:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"id: {message.data['seq']}\ndata: {message.encoded}\n\n"
+        finally:
+            subscription.close()
+    
+    return StreamingResponse(
+        stream(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@garage_router.websocket("/ws")
+async def garage_events_websocket(websocket: WebSocket, garage: Garage = Depends(current_garage)):
+    """WebSocket stream of the garage's occupancy and revenue changes."""
+    await websocket.accept()
+    subscription = broker.subscribe(garage.id)
+    
+    async def wait_for_disconnect():
+        while (await websocket.receive())['type'] != 'websocket.disconnect':
+            pass
+    
+    disconnected = asyncio.create_task(wait_for_disconnect())
+    try:
+        await websocket.send_text(await current_stats_message(garage))
+        while True:
+            next_message = asyncio.ensure_future(subscription.get())
+            await asyncio.wait({next_message, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                next_message.cancel()
+                break
+            await websocket.send_text(next_message.result().encoded)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        disconnected.cancel()
+        subscription.close()
+
+@ticket_router.post("/tickets", response_model=TicketResponse, status_code=status.HTTP_201_CREATED)
+async def create_ticket(
+    ticket_data: TicketCreate,
+    garage: Garage = Depends(current_garage),
+    db: AsyncSession = Depends(get_garage_db)
+):
+    try:
+        plate = normalize_plate(ticket_data.licensePlate)
+        if not plate:
+            raise HTTPException(status_code=400, detail="Invalid license plate")
+        
+        # Reject a second entry for a vehicle that is already parked
+        await garage.plates.ensure_loaded(db)
+        parked = entry_journal.parked_ticket(plate, garage.id) or await garage.plates.parked_ticket(db, plate)
+        if parked:
+            raise HTTPException(status_code=409, detail=f"Vehicle is already parked (ticket {parked})")
+        
+        settings = await garage.settings.get(db)
+        if not settings:
+            raise HTTPException(status_code=404, detail="Garage not found")
+        
         # Generate ticket number
-        ticket_number = f"PS-{1000 + random.randint(0, 8999)}"
-        
-        # Create new ticket
-        new_ticket = Ticket(
-            ticket_number=ticket_number,
-            license_plate=ticket_data.licensePlate,
-            vehicle_type=ticket_data.vehicleType,
-            entry_time=datetime.now(),
-            status='active'
-        )
+        ticket_number = await garage.ticket_numbers.next_number()
         
-        db_session.add(new_ticket)
-        db_session.commit()
+        if entry_journal.enabled:
+            # Write-behind: acknowledge once the entry is journaled; the
+            # journal's flusher inserts it with the next group commit
+            space = await garage.spaces.assign(db, settings, ticket_data.vehicleType)
+            if space is None:
+                raise HTTPException(status_code=409, detail=f"No free space for {ticket_data.vehicleType}")
+            new_ticket = Ticket(
+                garage_id=garage.id,
+                ticket_number=ticket_number,
+                license_plate=ticket_data.licensePlate,
+                normalized_plate=plate,
+                vehicle_type=ticket_data.vehicleType,
+                entry_time=datetime.now(),
+                status='active',
+                space=space
+            )
+            await entry_journal.append(new_ticket)
+            garage.spaces.settle(space)
+        else:
+            for attempt in range(SPACE_ASSIGN_ATTEMPTS):
+                # Reserve the nearest free space for this vehicle type
+                space = await garage.spaces.assign(db, settings, ticket_data.vehicleType)
+                if space is None:
+                    raise HTTPException(status_code=409, detail=f"No free space for {ticket_data.vehicleType}")
+                
+                # Create new ticket
+                new_ticket = Ticket(
+                    garage_id=garage.id,
+                    ticket_number=ticket_number,
+                    license_plate=ticket_data.licensePlate,
+                    normalized_plate=plate,
+                    vehicle_type=ticket_data.vehicleType,
+                    entry_time=datetime.now(),
+                    status='active',
+                    space=space
+                )
+                
+                db.add(new_ticket)
+                record_entries(db, [new_ticket])
+                try:
+                    await db.commit()
+                    garage.spaces.settle(space)
+                    break
+                except IntegrityError:
+                    # The plate or the space was taken through another worker
+                    await db.rollback()
+                    parked = (await db.execute(
+                        plate_search_query(plate, active_only=True, garage_id=garage.id)
+                        .with_only_columns(Ticket.ticket_number)
+                    )).scalar()
+                    if parked:
+                        garage.spaces.release(space)
+                        garage.plates.record_entry(plate, parked)
+                        raise HTTPException(status_code=409, detail=f"Vehicle is already parked (ticket {parked})")
+                    garage.spaces.settle(space)
+                    garage.spaces.invalidate()
+            else:
+                raise HTTPException(status_code=409, detail="Could not reserve a space, please retry")
+        garage.plates.record_entry(plate, ticket_number)
+        garage.stats.record_entry()
+        await publish_garage_event(garage, db, 'entry', {'occupiedSpaces': 1})
         
-        return new_ticket.to_dict()
+        return FastJSONResponse(new_ticket.to_dict(), status_code=status.HTTP_201_CREATED)
+    except HTTPException:
+        raise
     except Exception as e:
-        db_session.rollback()
+        await db.rollback()
+        garage.spaces.invalidate()
         print(f"Error creating ticket: {e}")
         raise HTTPException(status_code=500, detail="Error creating parking ticket")
 
-@app.get("/api/tickets/{ticket_number}", response_model=TicketResponse)
-async def get_ticket(ticket_number: str):
+async def insert_entries_one_by_one(garage, db, settings, accepted, rows, outcomes):
+    """Insert batch entries in their own transactions after the batch INSERT hit a conflict.
+
+    Entries for vehicles parked in the meantime fail in `outcomes`; an entry
+    whose space was taken gets another one. Returns (index, plate, ticket)
+    for the inserted entries.
+    """
+    inserted = []
+    for (index, plate, space, ticket_data), row in zip(accepted, rows):
+        for attempt in range(SPACE_ASSIGN_ATTEMPTS):
+            try:
+                ticket = (await db.scalars(insert(Ticket).returning(Ticket), [row])).one()
+                record_entries(db, [ticket])
+                await db.commit()
+                # Detached, so a later rollback cannot expire it
+                db.expunge(ticket)
+                inserted.append((index, plate, ticket))
+                break
+            except IntegrityError:
+                await db.rollback()
+            parked = (await db.execute(
+                plate_search_query(plate, active_only=True, garage_id=garage.id)
+                .with_only_columns(Ticket.ticket_number)
+            )).scalar()
+            if parked:
+                garage.spaces.release(row['space'])
+                garage.plates.record_entry(plate, parked)
+                outcomes[index] = batch_result(index, message="Vehicle is already parked")
+                break
+            # The space was taken through another worker; it stays marked
+            # occupied here, so the next one is different
+            garage.spaces.settle(row['space'])
+            space = await garage.spaces.assign(db, settings, ticket_data.vehicleType)
+            if space is None:
+                outcomes[index] = batch_result(index, message=f"No free space for {ticket_data.vehicleType}")
+                break
+            row = {**row, 'space': space}
+        else:
+            garage.spaces.release(row['space'])
+            outcomes[index] = batch_result(index, message="Could not reserve a space, please retry")
+    return inserted
+
+@ticket_router.post("/tickets/batch", response_model=BatchResponse, status_code=status.HTTP_201_CREATED)
+async def create_tickets_batch(
+    batch: BatchTicketCreate,
+    garage: Garage = Depends(current_garage),
+    db: AsyncSession = Depends(get_garage_db)
+):
+    try:
+        settings = await garage.settings.get(db)
+        if not settings:
+            raise HTTPException(status_code=404, detail="Garage not found")
+        await garage.plates.ensure_loaded(db)
+        await garage.spaces.ensure_loaded(db, settings)
+        
+        # Vehicles that are already parked (or listed twice), or for which
+        # no space is free, fail individually
+        outcomes = {}
+        accepted = []
+        plates = set()
+        for index, ticket_data in enumerate(batch.tickets):
+            plate = normalize_plate(ticket_data.licensePlate)
+            if not plate:
+                outcomes[index] = batch_result(index, message="Invalid license plate")
+            elif plate in plates or entry_journal.parked_ticket(plate, garage.id) or await garage.plates.parked_ticket(db, plate):
+                outcomes[index] = batch_result(index, message="Vehicle is already parked")
+            else:
+                # Same path as a single entry; a rebuild keeps the spaces
+                # already handed out to this batch
+                space = await garage.spaces.assign(db, settings, ticket_data.vehicleType)
+                if space is None:
+                    outcomes[index] = batch_result(index, message=f"No free space for {ticket_data.vehicleType}")
+                    continue
+                plates.add(plate)
+                accepted.append((index, plate, space, ticket_data))
+        
+        inserted = []
+        if accepted:
+            ticket_numbers_batch = await garage.ticket_numbers.allocate(len(accepted))
+            entry_time = datetime.now()
+            rows = [
+                {
+                    'garage_id': garage.id,
+                    'ticket_number': ticket_number,
+                    'license_plate': ticket_data.licensePlate,
+                    'normalized_plate': plate,
+                    'vehicle_type': ticket_data.vehicleType,
+                    'entry_time': entry_time,
+                    'status': 'active',
+                    'space': space
+                }
+                for ticket_number, (_, plate, space, ticket_data) in zip(ticket_numbers_batch, accepted)
+            ]
+            try:
+                # Insert every ticket with a single multi-row INSERT
+                tickets = (await db.scalars(insert(Ticket).returning(Ticket, sort_by_parameter_order=True), rows)).all()
+                record_entries(db, tickets)
+                await db.commit()
+                inserted = [(index, plate, ticket) for (index, plate, _, _), ticket in zip(accepted, tickets)]
+            except IntegrityError:
+                # A vehicle was parked, or a space taken, through another
+                # worker in the meantime; insert one at a time so only those
+                # entries fail
+                await db.rollback()
+                inserted = await insert_entries_one_by_one(garage, db, settings, accepted, rows, outcomes)
+        
+        for index, plate, ticket in inserted:
+            garage.spaces.settle(ticket.space)
+            garage.plates.record_entry(plate, ticket.ticket_number)
+            garage.stats.record_entry()
+            outcomes[index] = batch_result(index, ticket)
+        tickets = [ticket for _, _, ticket in inserted]
+        if tickets:
+            await publish_garage_event(garage, db, 'entry', {'occupiedSpaces': len(tickets)})
+        
+        results = [outcomes[index] for index in range(len(batch.tickets))]
+        return FastJSONResponse(
+            {'results': results, 'succeeded': len(tickets), 'failed': len(results) - len(tickets)},
+            status_code=status.HTTP_201_CREATED
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        garage.spaces.invalidate()
+        print(f"Error creating ticket batch: {e}")
+        raise HTTPException(status_code=500, detail="Error creating parking tickets")
+
+@ticket_router.put("/tickets/batch/exit", response_model=BatchResponse)
+async def process_exits_batch(
+    batch: BatchExitRequest,
+    garage: Garage = Depends(current_garage),
+    db: AsyncSession = Depends(get_garage_db)
+):
+    try:
+        settings = await garage.settings.get(db)
+        if not settings:
+            raise HTTPException(status_code=404, detail="Garage not found")
+        
+        # Load every ticket in the batch with a single query
+        numbers = {item.ticketNumber for item in batch.exits}
+        await entry_journal.ensure_flushed(numbers)
+        tickets = {
+            ticket.ticket_number: ticket
+            for ticket in (await db.scalars(
+                select(Ticket).where(Ticket.garage_id == garage.id, Ticket.ticket_number.in_(numbers))
+            )).all()
+        }
+        # Tickets missing from the live table may have been archived
+        missing = numbers - tickets.keys()
+        archived = set((await db.scalars(
+            select(ArchivedTicket.ticket_number)
+            .where(ArchivedTicket.garage_id == garage.id, ArchivedTicket.ticket_number.in_(missing))
+        )).all()) if missing else set()
+        
+        # Claim the tickets that are still active with one conditional UPDATE;
+        # any completed by a concurrent exit in the meantime match no row
+        candidates = {
+            ticket.id for ticket in tickets.values() if ticket.status == 'active'
+        }
+        claimed = set((await db.scalars(
+            update(Ticket)
+            .where(Ticket.id.in_(candidates), TICKET_IS_ACTIVE)
+            .values(status='completed')
+            .returning(Ticket.id)
+            .execution_options(synchronize_session=False)
+        )).all()) if candidates else set()
+        
+        tariff = tariff_for_settings(settings)
+        exit_time = datetime.now()
+        outcomes = []
+        updates = []
+        for index, item in enumerate(batch.exits):
+            ticket = tickets.get(item.ticketNumber)
+            if not ticket and item.ticketNumber not in archived:
+                outcomes.append((index, None, "Ticket not found"))
+                continue
+            if not ticket or ticket.id not in claimed:
+                outcomes.append((index, None, "Ticket has already been processed"))
+                continue
+            # The same ticket listed twice is only charged once
+            claimed.discard(ticket.id)
+            
+            duration_minutes, amount_paid = tariff.price(
+                ticket.entry_time, exit_time, ticket.vehicle_type
+            )
+            ticket.exit_time = exit_time
+            ticket.duration_minutes = duration_minutes
+            ticket.amount_paid = amount_paid
+            ticket.payment_method = item.paymentMethod
+            ticket.status = 'completed'
+            updates.append(ticket)
+            outcomes.append((index, ticket, None))
+        
+        # Queues the exits for the rollups; the commit then flushes the
+        # claimed tickets' fees as one executemany UPDATE
+        record_exits(db, updates)
+        await db.commit()
+        
+        for ticket in updates:
+            garage.plates.record_exit(ticket.normalized_plate)
+            garage.spaces.release(ticket.space)
+            garage.stats.record_exit(ticket.amount_paid, ticket.duration_minutes, ticket.exit_time)
+        if updates:
+            await publish_garage_event(garage, db, 'exit', {
+                'occupiedSpaces': -len(updates),
+                'todaysRevenue': sum(ticket.amount_paid for ticket in updates) / 100,
+                'vehiclesProcessedToday': len(updates)
+            })
+        # Completed tickets are serialized after the commit, with their final values
+        results = [batch_result(*outcome) for outcome in outcomes]
+        return FastJSONResponse(
+            {'results': results, 'succeeded': len(updates), 'failed': len(results) - len(updates)}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        print(f"Error processing exit batch: {e}")
+        raise HTTPException(status_code=500, detail="Error processing exits")
+
+@ticket_router.get("/tickets/search", response_model=List[TicketResponse])
+async def search_tickets(
+    plate: str = Query(..., min_length=1),
+    match: str = Query("exact", pattern="^(exact|prefix|fuzzy)$"),
+    active: bool = False,
+    limit: int = Query(20, ge=1, le=PLATE_SEARCH_MAX_LIMIT),
+    garage: Garage = Depends(current_garage),
+    db: AsyncSession = Depends(get_garage_db)
+):
+    try:
+        normalized = normalize_plate(plate)
+        if not normalized:
+            raise HTTPException(status_code=400, detail="Invalid license plate")
+        
+        if match != 'fuzzy':
+            tickets = (await db.scalars(
+                plate_search_query(normalized, match, active, garage.id).limit(limit)
+            )).all()
+            return FastJSONResponse([ticket.to_dict() for ticket in tickets])
+        
+        # Fuzzy: rank known plates by trigram similarity in memory, then
+        # return the latest ticket of each, best match first
+        await garage.plates.ensure_loaded(db)
+        matches = garage.plates.fuzzy(normalized, limit)
+        rank = {candidate: position for position, (_, candidate) in enumerate(matches)}
+        latest = {}
+        if rank:
+            for ticket in (await db.scalars(latest_tickets_query(list(rank), active, garage.id))).all():
+                latest.setdefault(ticket.normalized_plate, ticket)
+        tickets = sorted(latest.values(), key=lambda ticket: rank[ticket.normalized_plate])
+        return FastJSONResponse([ticket.to_dict() for ticket in tickets])
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error searching tickets: {e}")
+        raise HTTPException(status_code=500, detail="Error searching tickets")
+
+@ticket_router.get("/tickets/{ticket_number}", response_model=TicketResponse)
+async def get_ticket(
+    ticket_number: str,
+    garage: Garage = Depends(current_garage),
+    db: AsyncSession = Depends(get_garage_db)
+):
     try:
-        ticket = db_session.query(Ticket).filter_by(ticket_number=ticket_number).first()
+        # Entries not yet flushed by the write-behind journal come first
+        ticket = entry_journal.get(ticket_number, garage.id) or await find_ticket(db, ticket_number, garage.id)
         
         if not ticket:
             raise HTTPException(status_code=404, detail="Ticket not found")
         
-        return ticket.to_dict()
+        return FastJSONResponse(ticket.to_dict())
     except HTTPException:
         raise
     except Exception as e:
         print(f"Error retrieving ticket: {e}")
         raise HTTPException(status_code=500, detail="Error retrieving ticket information")
 
-@app.put("/api/tickets/{ticket_number}/exit", response_model=TicketResponse)
-async def process_exit(ticket_number: str, exit_data: ExitRequest):
+@ticket_router.put("/tickets/{ticket_number}/exit", response_model=TicketResponse)
+async def process_exit(
+    ticket_number: str,
+    exit_data: ExitRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    garage: Garage = Depends(current_garage),
+    db: AsyncSession = Depends(get_garage_db)
+):
+    # Gate retries that reuse an Idempotency-Key get the original response
+    return await idempotent(
+        idempotency_key, f"exit {garage.id} {ticket_number}",
+        lambda: complete_exit(garage, ticket_number, exit_data.paymentMethod, db)
+    )
+
+async def complete_exit(garage, ticket_number, payment_method, db):
     try:
-        ticket = db_session.query(Ticket).filter_by(ticket_number=ticket_number).first()
+        await entry_journal.ensure_flushed([ticket_number])
+        # Archived tickets are completed, so they are rejected below
+        ticket = await find_ticket(db, ticket_number, garage.id)
         
         if not ticket:
             raise HTTPException(status_code=404, detail="Ticket not found")
@@ -183,93 +773,172 @@ async def process_exit(ticket_number: str, exit_data: ExitRequest):
         if ticket.status != 'active':
             raise HTTPException(status_code=400, detail="Ticket has already been processed")
         
-        # Calculate duration and amount
-        exit_time = datetime.now()
-        entry_time = ticket.entry_time
-        
-        # Calculate duration in minutes
-        duration_minutes = math.ceil((exit_time - entry_time).total_seconds() / 60)
-        
-        # Get hourly rate from settings
-        settings = db_session.query(GarageSetting).first()
+        # Get hourly rate from the cached settings
+        settings = await garage.settings.get(db)
         if not settings:
-            raise HTTPException(status_code=500, detail="Garage settings not found")
+            raise HTTPException(status_code=404, detail="Garage not found")
         
-        # Calculate payment amount (rounded up to the next hour)
-        hours = math.ceil(duration_minutes / 60)
-        amount_paid = hours * settings.hourly_rate
+        # Calculate duration and amount
+        exit_time = datetime.now()
+        duration_minutes, amount_paid = tariff_for_settings(settings).price(
+            ticket.entry_time, exit_time, ticket.vehicle_type
+        )
         
-        # Update ticket
-        ticket.exit_time = exit_time
-        ticket.duration_minutes = duration_minutes
-        ticket.amount_paid = amount_paid
-        ticket.payment_method = exit_data.paymentMethod
-        ticket.status = 'completed'
+        # Update ticket only if it is still active, so of two concurrent
+        # exits for the same ticket exactly one charges it
+        ticket = (await db.execute(
+            update(Ticket)
+            .where(Ticket.id == ticket.id, TICKET_IS_ACTIVE)
+            .values(
+                exit_time=exit_time,
+                duration_minutes=duration_minutes,
+                amount_paid=amount_paid,
+                payment_method=payment_method,
+                status='completed'
+            )
+            .returning(Ticket)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )).scalar()
+        if not ticket:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="Ticket has already been processed")
         
-        db_session.commit()
+        record_exits(db, [ticket])
+        await db.commit()
+        garage.plates.record_exit(ticket.normalized_plate)
+        garage.spaces.release(ticket.space)
+        garage.stats.record_exit(amount_paid, duration_minutes, exit_time)
+        await publish_garage_event(garage, db, 'exit', {
+            'occupiedSpaces': -1,
+            'todaysRevenue': amount_paid / 100,
+            'vehiclesProcessedToday': 1
+        })
         
-        return ticket.to_dict()
+        return FastJSONResponse(ticket.to_dict())
     except HTTPException:
         raise
     except Exception as e:
-        db_session.rollback()
+        await db.rollback()
         print(f"Error processing exit: {e}")
         raise HTTPException(status_code=500, detail="Error processing exit")
 
-@app.get("/api/activities", response_model=List[ActivityResponse])
-async def get_activities(limit: int = 10):
+@ticket_router.get("/activities", response_model=List[ActivityResponse])
+async def get_activities(
+    limit: int = Query(10, ge=1, le=ACTIVITIES_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    garage: Garage = Depends(current_garage),
+    db: AsyncSession = Depends(get_garage_read_db)
+):
     try:
-        tickets = db_session.query(Ticket).order_by(desc(Ticket.entry_time)).limit(limit).all()
+        rows = (await db.execute(activities_query(cursor, garage.id).limit(limit + 1))).all()
+        
+        # Hand out a cursor for the next page when there is one
+        headers = {}
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers['X-Next-Cursor'] = encode_cursor(rows[-1].entry_time, rows[-1].id)
         
         # Format activities for the response
-        activities = [
-            {
-                'id': ticket.id,
-                'ticketNumber': ticket.ticket_number,
-                'licensePlate': ticket.license_plate,
-                'entryTime': ticket.entry_time,
-                'exitTime': ticket.exit_time,
-                'durationMinutes': ticket.duration_minutes,
-                'amount': ticket.amount_paid / 100 if ticket.amount_paid else None,  # Convert to dollars
-                'status': ticket.status
-            }
-            for ticket in tickets
-        ]
-        
-        return activities
+        return FastJSONResponse([activity_to_dict(row) for row in rows], headers=headers)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except Exception as e:
         print(f"Error retrieving activities: {e}")
         raise HTTPException(status_code=500, detail="Error retrieving recent activities")
 
-# Serve frontend static assets (catch-all route for SPA)
-@app.get("/{full_path:path}")
-async def serve_frontend(full_path: str):
-    # First check if the file exists in the static directory
-    static_dir = "../client/dist"
-    requested_path = os.path.join(static_dir, full_path)
-    
-    # If the file exists, serve it
-    if os.path.exists(requested_path) and os.path.isfile(requested_path):
-        return FileResponse(requested_path)
+@ticket_router.get("/activities/export")
+async def export_activities(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    cursor: Optional[str] = None,
+    garage: Garage = Depends(current_garage)
+):
+    try:
+        query = activities_query(cursor, garage.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    # Otherwise, serve the index.html for client-side routing
-    index_path = os.path.join(static_dir, "index.html")
-    if os.path.exists(index_path):
-        return FileResponse(index_path)
+    async def generate():
+        # The session lives as long as the stream; rows are fetched and
+        # encoded one batch at a time so memory stays flat
+        async with await open_read_session(READ_PRIMARY_COOKIE in request.cookies, garage.session_factory) as session:
+            result = await session.stream(query)
+            first = True
+            async for rows in result.partitions():
+                if format == 'csv':
+                    yield rows_to_csv(rows, header=first)
+                else:
+                    yield rows_to_ndjson(rows)
+                first = False
+            if first and format == 'csv':
+                yield rows_to_csv([], header=True)
     
-    # If index.html doesn't exist either, return a 404
-    raise HTTPException(status_code=404, detail="File not found")
+    media_type = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    return StreamingResponse(
+        generate(),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="activities.{format}"'}
+    )
+
+@ticket_router.get("/reports/{period}", response_model=List[ReportRow])
+async def get_report(
+    period: str = Path(pattern="^(hourly|daily)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    groupBy: Optional[str] = Query(None, pattern="^(vehicleType|paymentMethod)$"),
+    garage: Garage = Depends(current_garage),
+    db: AsyncSession = Depends(get_garage_read_db)
+):
+    try:
+        # Buckets are naive local times, like the tickets they count
+        start, end = naive_local(start), naive_local(end)
+        rows = (await db.execute(report_query(period, start, end, groupBy, garage.id))).all()
+        return [report_row_to_dict(row) for row in rows]
+    except Exception as e:
+        print(f"Error retrieving report: {e}")
+        raise HTTPException(status_code=500, detail="Error retrieving report")
+
+# Routes of the default garage, then the same routes for every garage
+GARAGE_PREFIX = "/api/garages/{garage_id}"
+app.include_router(garage_router, prefix="/api/garage")
+app.include_router(ticket_router, prefix="/api")
+app.include_router(garage_router, prefix=GARAGE_PREFIX, dependencies=[Depends(garage_path)])
+app.include_router(ticket_router, prefix=GARAGE_PREFIX, dependencies=[Depends(garage_path)])
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+# Serve frontend static assets (catch-all route for SPA)
+@app.get("/{full_path:path}")
+async def serve_frontend(full_path: str, request: Request):
+    # Files come from the table indexed at startup, never from disk
+    asset = static_assets.get(full_path)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return static_assets.response(
+        asset, request.headers.get('accept-encoding'), request.headers.get('if-none-match')
+    )
 
-# Clean up database session
+# Clean up database session and record request metrics
 @app.middleware("http")
 async def db_session_middleware(request: Request, call_next):
+    request_metrics = metrics.start_request()
+    status_code = 500
     try:
         response = await call_next(request)
+        status_code = response.status_code
+        # Keep this client's reads on the primary until the replica has
+        # caught up with its entry or exit
+        if (request.method in WRITE_METHODS and status_code < 400 and get_replica_engine() is not None
+                and request.url.path.startswith('/api/')):
+            response.set_cookie(READ_PRIMARY_COOKIE, '1', max_age=math.ceil(DB_REPLICA_LAG_SECONDS),
+                                httponly=True, samesite='lax')
     finally:
         shutdown_session()
+        metrics.finish_request(request, status_code, request_metrics)
     return response
 
 if __name__ == '__main__':
-    host = os.getenv('HOST', '0.0.0.0')
-    port = int(os.getenv('PORT', 5001))  # Using 5001 to avoid conflict with existing server
-    uvicorn.run("app:app", host=host, port=port, reload=True)
\ No newline at end of file
+    import run
+    run.main()
\ No newline at end of file
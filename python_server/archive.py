@@ -0,0 +1,93 @@
+"""Archiving of completed tickets.
+
+Tickets completed more than ARCHIVE_AFTER_DAYS ago are moved from `tickets`
+to `tickets_archive` in batches of ARCHIVE_BATCH_SIZE, each copied and
+deleted in its own short transaction, so the live table and its indexes stay
+small. Gates only ever update active tickets, so they never wait on the
+archiver for more than one batch. Rollups already count archived tickets;
+ticket lookups and the activity feed read both tables.
+
+    python archive.py                 # archive tickets older than ARCHIVE_AFTER_DAYS
+    python archive.py --days 30       # or older than 30 days
+"""
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, select
+from models import ArchivedTicket, Ticket, DEFAULT_GARAGE_ID, TICKET_IS_COMPLETED
+
+# Age (days since exit) at which completed tickets are archived
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+# Tickets moved per transaction
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 5000))
+# Seconds to pause between batches, leaving the database to gate traffic
+ARCHIVE_PAUSE_SECONDS = float(os.getenv('ARCHIVE_PAUSE_SECONDS', 0.05))
+
+TICKET_COLUMNS = [column.name for column in Ticket.__table__.columns]
+
+
+def archive_batch(connection, cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move up to `batch_size` tickets completed before `cutoff`; returns how many moved."""
+    # Oldest exits first, from the completed-tickets partial index; rows
+    # locked by a concurrent archiver are skipped (Postgres only)
+    ids = connection.execute(
+        select(Ticket.id)
+        .where(TICKET_IS_COMPLETED, Ticket.exit_time < cutoff)
+        .order_by(Ticket.exit_time)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not ids:
+        return 0
+
+    connection.execute(ArchivedTicket.__table__.insert().from_select(
+        TICKET_COLUMNS,
+        select(*(Ticket.__table__.c[name] for name in TICKET_COLUMNS)).where(Ticket.id.in_(ids))
+    ))
+    connection.execute(delete(Ticket).where(Ticket.id.in_(ids), TICKET_IS_COMPLETED))
+    return len(ids)
+
+
+def archive_completed(engine, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE,
+                      pause=ARCHIVE_PAUSE_SECONDS):
+    """Archive every ticket completed more than `older_than_days` ago; returns the count."""
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    archived = 0
+    while True:
+        with engine.begin() as connection:
+            moved = archive_batch(connection, cutoff, batch_size)
+        archived += moved
+        if moved < batch_size:
+            return archived
+        time.sleep(pause)
+
+
+async def find_ticket(db, ticket_number, garage_id=DEFAULT_GARAGE_ID):
+    """A garage's ticket by number from the live table, falling back to the archive."""
+    ticket = (await db.execute(
+        select(Ticket).filter_by(ticket_number=ticket_number, garage_id=garage_id)
+    )).scalar()
+    if ticket is None:
+        ticket = (await db.execute(
+            select(ArchivedTicket).filter_by(ticket_number=ticket_number, garage_id=garage_id)
+        )).scalar()
+    return ticket
+
+
+if __name__ == '__main__':
+    import argparse
+    from database import each_database, init_db
+
+    parser = argparse.ArgumentParser(description='Move old completed tickets to tickets_archive.')
+    parser.add_argument('--days', type=float, default=ARCHIVE_AFTER_DAYS,
+                        help='archive tickets that exited more than this many days ago')
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    started = datetime.now()
+    archived = 0
+    # Every garage, on DATABASE_URL and on each shard
+    for engine in each_database():
+        init_db(engine)
+        archived += archive_completed(engine, args.days, args.batch_size)
+    print(f"Archived {archived} tickets in {(datetime.now() - started).total_seconds():.1f}s")
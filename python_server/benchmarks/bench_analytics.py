@@ -0,0 +1,115 @@
+"""Time the occupancy analytics over a year of history.
+
+Seeds the tickets table up to BENCH_TICKETS rows spread over the last year
+(default 300,000, about 820 a day), then computes hourly average occupancy
+for the whole year two ways: a per-row Python loop over the tickets (each
+stay adding its overlap to every hour it spans), and `analytics.py`
+(streamed epoch seconds, NumPy sweep). Fails if the two disagree. Also
+times GET /api/garage/analytics for the same window, cold and cached.
+
+    DATABASE_URL=sqlite:///analytics.db python benchmarks/bench_analytics.py
+"""
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from sqlalchemy import or_, select
+
+from analytics import analytics_window, analyze, load_stays, to_epoch
+from database import engine, garage_sessionmaker, init_db
+from models import ArchivedTicket, Ticket, DEFAULT_GARAGE_ID
+from seed import seed_tickets
+
+TICKETS = int(os.getenv('BENCH_TICKETS', 300_000))
+
+
+def python_hourly_occupancy(start, end):
+    """Hourly average occupancy the way it would be written without NumPy."""
+    hours = int((end - start).total_seconds() // 3600)
+    occupied = [0.0] * hours
+    with engine.connect() as connection:
+        for source in (Ticket, ArchivedTicket):
+            rows = connection.execute(
+                select(source.entry_time, source.exit_time).where(
+                    source.garage_id == DEFAULT_GARAGE_ID, source.entry_time < end,
+                    or_(source.exit_time.is_(None), source.exit_time > start)
+                )
+            )
+            for entry_time, exit_time in rows:
+                entered = max(entry_time, start)
+                exited = min(exit_time or end, end)
+                hour = int((entered - start).total_seconds() // 3600)
+                while hour < hours:
+                    hour_start = start + timedelta(hours=hour)
+                    hour_end = hour_start + timedelta(hours=1)
+                    if hour_start >= exited:
+                        break
+                    overlap = (min(exited, hour_end) - max(entered, hour_start)).total_seconds()
+                    occupied[hour] += overlap / 3600
+                    hour += 1
+    return occupied
+
+
+async def vectorized(start, end):
+    async with garage_sessionmaker(DEFAULT_GARAGE_ID)() as session:
+        started = time.perf_counter()
+        entries, exits = await load_stays(session, start, end)
+        loaded = time.perf_counter()
+        result = analyze(entries, exits, to_epoch(start), to_epoch(end), 3600, 24)
+        return result, loaded - started, time.perf_counter() - loaded
+
+
+async def endpoint(start, end):
+    import httpx
+    from app import app
+
+    timings = []
+    params = {'start': start.isoformat(), 'end': end.isoformat()}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            for _ in range(3):
+                started = time.perf_counter()
+                response = await client.get('/api/garage/analytics', params=params)
+                timings.append(time.perf_counter() - started)
+                response.raise_for_status()
+    return timings
+
+
+def main():
+    init_db()
+    with engine.begin() as connection:
+        seeded = seed_tickets(connection, TICKETS)
+        if seeded:
+            print(f'Seeded {seeded:,} tickets')
+
+    start, end = analytics_window(datetime.now() - timedelta(days=365), None, 60)
+    print(f'Window {start} .. {end}, hourly buckets')
+
+    started = time.perf_counter()
+    expected = python_hourly_occupancy(start, end)
+    python_seconds = time.perf_counter() - started
+
+    result, load_seconds, analyze_seconds = asyncio.run(vectorized(start, end))
+    actual = [bucket['averageOccupancy'] for bucket in result['occupancy']]
+    if not np.allclose(actual, expected, atol=0.01):
+        worst = int(np.argmax(np.abs(np.array(actual) - np.array(expected))))
+        print(f"Mismatch at {result['occupancy'][worst]['bucketStart']}: {actual[worst]} != {expected[worst]}")
+        sys.exit(1)
+
+    cold, *cached = asyncio.run(endpoint(start, end))
+    print(f"{result['stays']:,} stays")
+    print(f'python loop          {python_seconds * 1000:8.0f} ms')
+    print(f'numpy load           {load_seconds * 1000:8.0f} ms')
+    print(f'numpy analyze        {analyze_seconds * 1000:8.0f} ms')
+    print(f'endpoint (cold)      {cold * 1000:8.0f} ms')
+    print(f'endpoint (cached)    {min(cached) * 1000:8.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Compare single-ticket calls with the batch entry/exit endpoints.
+
+Runs the app in-process against a scratch SQLite database (or DATABASE_URL)
+and times BENCH_ITEMS entries and exits made one request at a time versus
+in batches of BENCH_BATCH_SIZE.
+
+    python benchmarks/bench_batch.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+import httpx
+
+from seed import make_room
+
+ITEMS = int(os.getenv('BENCH_ITEMS', 10_000))
+BATCH_SIZE = int(os.getenv('BENCH_BATCH_SIZE', 500))
+CONCURRENCY = int(os.getenv('BENCH_CONCURRENCY', 20))
+
+
+async def single_calls(client):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def enter(i):
+        async with semaphore:
+            response = await client.post('/api/tickets', json={'licensePlate': f'S{i}', 'vehicleType': 'Standard Vehicle'})
+            return response.json()['ticketNumber']
+
+    async def leave(number):
+        async with semaphore:
+            response = await client.put(f'/api/tickets/{number}/exit', json={'paymentMethod': 'Credit Card'})
+            response.raise_for_status()
+
+    started = time.perf_counter()
+    numbers = await asyncio.gather(*(enter(i) for i in range(ITEMS)))
+    entered = time.perf_counter()
+    await asyncio.gather(*(leave(number) for number in numbers))
+    return entered - started, time.perf_counter() - entered
+
+
+async def batched_calls(client):
+    started = time.perf_counter()
+    numbers = []
+    for offset in range(0, ITEMS, BATCH_SIZE):
+        response = await client.post('/api/tickets/batch', json={'tickets': [
+            {'licensePlate': f'B{i}', 'vehicleType': 'Standard Vehicle'}
+            for i in range(offset, min(offset + BATCH_SIZE, ITEMS))
+        ]})
+        numbers.extend(result['ticket']['ticketNumber'] for result in response.json()['results'])
+    entered = time.perf_counter()
+    for offset in range(0, ITEMS, BATCH_SIZE):
+        response = await client.put('/api/tickets/batch/exit', json={'exits': [
+            {'ticketNumber': number, 'paymentMethod': 'Credit Card'}
+            for number in numbers[offset:offset + BATCH_SIZE]
+        ]})
+        assert response.json()['failed'] == 0
+    return entered - started, time.perf_counter() - entered
+
+
+async def main():
+    from app import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            await make_room(client, ITEMS)
+            print(f'{ITEMS} entries and exits (batch size {BATCH_SIZE}, single-call concurrency {CONCURRENCY})')
+            for name, run in (('single calls', single_calls), ('batched', batched_calls)):
+                entries, exits = await run(client)
+                print(f'  {name:<13} entries {entries:6.2f}s ({ITEMS / entries:8.0f}/s)   '
+                      f'exits {exits:6.2f}s ({ITEMS / exits:8.0f}/s)')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""Compare request throughput of the blocking and async database layouts.
+
+Each request runs one query that takes DB_LATENCY_MS to answer (pg_sleep on
+Postgres, a registered sleep function on SQLite). With the old layout the
+blocking scoped_session stalls the event loop for every query, so concurrent
+requests are served one at a time; with the async layout they overlap.
+
+    DATABASE_URL=sqlite:///bench.db python benchmarks/bench_db_concurrency.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from database import async_database_url, engine_options
+
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///bench.db')
+REQUESTS = int(os.getenv('BENCH_REQUESTS', 200))
+CONCURRENCY = int(os.getenv('BENCH_CONCURRENCY', 50))
+DB_LATENCY_MS = int(os.getenv('DB_LATENCY_MS', 5))
+
+
+def register_sleep(sync_engine):
+    """Give SQLite a sleep_ms() function so it can mimic a network round-trip."""
+    if sync_engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(sync_engine, 'connect')
+    def _connect(dbapi_connection, _):
+        dbapi_connection.create_function(
+            'sleep_ms', 1, lambda ms: time.sleep(ms / 1000) or 0
+        )
+
+
+def slow_query(dialect_name):
+    if dialect_name == 'sqlite':
+        return text(f'SELECT sleep_ms({DB_LATENCY_MS})')
+    return text(f'SELECT pg_sleep({DB_LATENCY_MS / 1000})')
+
+
+def blocking_app():
+    """The previous layout: async handlers calling a thread-scoped session."""
+    engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+    register_sleep(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    query = slow_query(engine.dialect.name)
+    app = FastAPI()
+
+    @app.get('/query')
+    async def run_query():
+        try:
+            session.execute(query)
+        finally:
+            session.remove()
+        return {'ok': True}
+
+    return app, engine.dispose
+
+
+def async_app():
+    """The current layout: per-request AsyncSession from a pooled async engine."""
+    engine = create_async_engine(async_database_url(DATABASE_URL), **engine_options(DATABASE_URL))
+    register_sleep(engine.sync_engine)
+    sessions = async_sessionmaker(engine, class_=AsyncSession)
+    query = slow_query(engine.dialect.name)
+    app = FastAPI()
+
+    async def get_session():
+        async with sessions() as session:
+            yield session
+
+    @app.get('/query')
+    async def run_query(db: AsyncSession = Depends(get_session)):
+        await db.execute(query)
+        return {'ok': True}
+
+    return app, engine.dispose
+
+
+async def drive(app):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        async def one():
+            async with semaphore:
+                response = await client.get('/query')
+                response.raise_for_status()
+
+        await one()  # warm up the pool
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(REQUESTS)))
+        return time.perf_counter() - started
+
+
+async def main():
+    print(f'{REQUESTS} requests, concurrency {CONCURRENCY}, {DB_LATENCY_MS} ms per query')
+    for name, factory in (('blocking scoped_session', blocking_app), ('async session', async_app)):
+        app, dispose = factory()
+        elapsed = await drive(app)
+        result = dispose()
+        if asyncio.iscoroutine(result):
+            await result
+        print(f'  {name:<24} {REQUESTS / elapsed:8.1f} req/s  ({elapsed:.2f}s)')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
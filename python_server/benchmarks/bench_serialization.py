@@ -0,0 +1,132 @@
+"""Per-row cost of encoding ticket and activity responses.
+
+Serves the same rows through two in-process FastAPI routes: one returning
+dicts validated by a `response_model` (the old path), one returning
+`FastJSONResponse`. Checks both produce identical bytes, then reports the
+per-row cost of each from the difference between a small and a large page,
+so fixed per-request overhead cancels out.
+
+    python benchmarks/bench_serialization.py --rows 1000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# No database is touched; models only need a URL to import
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import httpx
+from fastapi import FastAPI
+
+from activities import ACTIVITY_COLUMNS, activity_to_dict
+from models import Ticket, DEFAULT_GARAGE_ID
+from schemas import ActivityResponse, TicketResponse
+from serializers import FastJSONResponse
+
+
+def make_tickets(count):
+    now = datetime(2024, 5, 1, 12, 0, 0, 123456)
+    tickets = []
+    for i in range(count):
+        entry_time = now - timedelta(minutes=7 * i, microseconds=i)
+        completed = i % 3 != 0
+        tickets.append(Ticket(
+            id=i + 1,
+            garage_id=DEFAULT_GARAGE_ID,
+            ticket_number=f'PS-{10000 + i}',
+            license_plate=f'BN{i:05d}',
+            vehicle_type='Standard Vehicle',
+            entry_time=entry_time,
+            exit_time=entry_time + timedelta(minutes=95) if completed else None,
+            duration_minutes=95 if completed else None,
+            amount_paid=2000 if completed else None,
+            status='completed' if completed else 'active',
+            payment_method='Credit Card' if completed else None,
+        ))
+    return tickets
+
+
+ActivityRow = namedtuple('ActivityRow', [column.key for column in ACTIVITY_COLUMNS])
+
+
+def make_activity_rows(tickets):
+    return [
+        ActivityRow(*(getattr(ticket, column.key) for column in ACTIVITY_COLUMNS))
+        for ticket in tickets
+    ]
+
+
+def legacy_activity_dict(row):
+    # Before the fast path, datetimes were left for the response model to encode
+    return {**activity_to_dict(row), 'entryTime': row.entry_time, 'exitTime': row.exit_time}
+
+
+def build_app(tickets, activity_rows):
+    app = FastAPI()
+
+    @app.get('/model/tickets', response_model=List[TicketResponse])
+    async def model_tickets(n: int):
+        return [ticket.to_dict() for ticket in tickets[:n]]
+
+    @app.get('/fast/tickets', response_model=List[TicketResponse])
+    async def fast_tickets(n: int):
+        return FastJSONResponse([ticket.to_dict() for ticket in tickets[:n]])
+
+    @app.get('/model/activities', response_model=List[ActivityResponse])
+    async def model_activities(n: int):
+        return [legacy_activity_dict(row) for row in activity_rows[:n]]
+
+    @app.get('/fast/activities', response_model=List[ActivityResponse])
+    async def fast_activities(n: int):
+        return FastJSONResponse([activity_to_dict(row) for row in activity_rows[:n]])
+
+    return app
+
+
+async def time_route(client, path, rows, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        response = await client.get(path, params={'n': rows})
+        response.raise_for_status()
+    return (time.perf_counter() - started) / repeat
+
+
+async def run(args):
+    tickets = make_tickets(args.rows)
+    app = build_app(tickets, make_activity_rows(tickets))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for kind in ('tickets', 'activities'):
+            model = (await client.get(f'/model/{kind}', params={'n': args.rows})).content
+            fast = (await client.get(f'/fast/{kind}', params={'n': args.rows})).content
+            if model != fast:
+                raise SystemExit(f'{kind}: fast path output differs from the response model output')
+
+        small = 10
+        print(f"{'endpoint':<14}{'path':<10}{'us/row':>10}{'ms/page':>10}")
+        for kind in ('tickets', 'activities'):
+            per_row = {}
+            for path in ('model', 'fast'):
+                base = await time_route(client, f'/{path}/{kind}', small, args.repeat)
+                full = await time_route(client, f'/{path}/{kind}', args.rows, args.repeat)
+                per_row[path] = (full - base) / (args.rows - small)
+                print(f"{kind:<14}{path:<10}{per_row[path] * 1e6:>10.2f}{full * 1000:>10.2f}")
+            print(f"{'':<14}{'speedup':<10}{per_row['model'] / per_row['fast']:>9.1f}x")
+    print('Output identical on both paths')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=1000, help='rows in the large page')
+    parser.add_argument('--repeat', type=int, default=50, help='requests timed per measurement')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Cold start benchmark: import time and time to first request.
+
+Measures how long `import app` takes (with a per-module breakdown from
+`python -X importtime`) and how long a fresh uvicorn process takes to answer
+its first request, with and without the startup schema check. Uses a
+scratch SQLite database unless DATABASE_URL is set.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 5 --budget-ms 3000   # exit 1 if slower
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def import_time(env=None, top=10):
+    """Return (total_ms, slowest modules) for `import app` in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=SERVER_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    total = next(cumulative for name, _, cumulative in modules if name == 'app')
+    slowest = sorted(modules, key=lambda module: module[1], reverse=True)[:top]
+    return total, slowest
+
+
+def wait_for(url, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.01)
+    raise RuntimeError(f'{url} did not answer in time')
+
+
+def time_to_first_request(env, port, timeout=60):
+    """Seconds from spawning uvicorn until /api/status and then /api/garage/stats answer."""
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=SERVER_DIR, env=env
+    )
+    try:
+        deadline = started + timeout
+        wait_for(f'http://127.0.0.1:{port}/api/status', deadline)
+        first = time.perf_counter() - started
+        wait_for(f'http://127.0.0.1:{port}/api/garage/stats', deadline)
+        return first, time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def run(database_url=None, runs=3, port=5098):
+    """Benchmark cold start; returns a JSON-serializable summary."""
+    env = dict(os.environ)
+    env['DATABASE_URL'] = database_url or os.getenv('DATABASE_URL') or \
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}"
+    env.pop('PARKING_DB_PREPARED', None)
+
+    # Importing the app must not need a database
+    import_env = {key: value for key, value in env.items() if key != 'DATABASE_URL'}
+    import_ms, slowest = import_time(import_env)
+    summary = {'import_ms': round(import_ms, 1), 'slowest_imports': [
+        {'module': name, 'self_ms': round(self_ms, 1), 'cumulative_ms': round(cumulative_ms, 1)}
+        for name, self_ms, cumulative_ms in slowest
+    ]}
+
+    for mode, skip in (('schema_check', '0'), ('skip_schema_check', '1')):
+        status, stats = [], []
+        for _ in range(runs):
+            first, first_db = time_to_first_request({**env, 'DB_SKIP_SCHEMA_CHECK': skip}, port)
+            status.append(first * 1000)
+            stats.append(first_db * 1000)
+        summary[mode] = {
+            'first_request_ms': round(statistics.median(status), 1),
+            'first_stats_request_ms': round(statistics.median(stats), 1),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database-url', help='database to start against (default: scratch SQLite)')
+    parser.add_argument('--runs', type=int, default=3, help='server starts per mode (median is reported)')
+    parser.add_argument('--port', type=int, default=5098)
+    parser.add_argument('--budget-ms', type=float, help='fail if the first request takes longer')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    summary = run(args.database_url, args.runs, args.port)
+    print(f"import app: {summary['import_ms']:.1f} ms")
+    for module in summary['slowest_imports']:
+        print(f"  {module['self_ms']:8.1f} ms  {module['module']}")
+    for mode in ('schema_check', 'skip_schema_check'):
+        print(f"{mode:<20} first request {summary[mode]['first_request_ms']:8.1f} ms"
+              f"   first stats request {summary[mode]['first_stats_request_ms']:8.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    if args.budget_ms and summary['schema_check']['first_request_ms'] > args.budget_ms:
+        print(f"First request took longer than the {args.budget_ms:.0f} ms budget")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
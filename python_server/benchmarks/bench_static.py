@@ -0,0 +1,111 @@
+"""Compare serving the frontend from disk with the in-memory asset table.
+
+Builds a synthetic `dist` directory (an index.html and a bundled script
+under assets/) unless --dist is given, then times the previous catch-all
+handler (filesystem checks and FileResponse per request) against the app's
+asset table, in-process. Reports requests per second and bytes sent per
+request, for a first visit and for a browser revalidating with If-None-Match.
+
+    python benchmarks/bench_static.py
+    python benchmarks/bench_static.py --dist ../client/dist --requests 5000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import httpx
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import FileResponse
+
+
+def build_dist(directory):
+    """Write an index.html and a ~450 KB script with a hashed name."""
+    os.makedirs(os.path.join(directory, 'assets'), exist_ok=True)
+    with open(os.path.join(directory, 'index.html'), 'w') as f:
+        f.write('<!doctype html><html><head><meta charset="utf-8"><title>Parking</title>'
+                '<script type="module" src="/assets/index-3f9a1c2b.js"></script></head>'
+                '<body><div id="root"></div></body></html>\n')
+    with open(os.path.join(directory, 'assets', 'index-3f9a1c2b.js'), 'w') as f:
+        for i in range(12_000):
+            f.write(f'export function component{i}(props) {{ return render("div", props, {i}); }}\n')
+    return directory
+
+
+def legacy_app(static_dir):
+    """The catch-all route as it was: checks the filesystem on every request."""
+    app = FastAPI()
+
+    @app.get("/{full_path:path}")
+    async def serve_frontend(full_path: str):
+        requested_path = os.path.join(static_dir, full_path)
+        if os.path.exists(requested_path) and os.path.isfile(requested_path):
+            return FileResponse(requested_path)
+        index_path = os.path.join(static_dir, "index.html")
+        if os.path.exists(index_path):
+            return FileResponse(index_path)
+        raise HTTPException(status_code=404, detail="File not found")
+
+    return app
+
+
+async def measure(client, path, requests, revalidate):
+    """Requests per second and bytes received per request for one path."""
+    headers = {'Accept-Encoding': 'br, gzip'}
+    if revalidate:
+        etag = (await client.get(path, headers=headers)).headers.get('etag')
+        if etag:
+            headers['If-None-Match'] = etag
+    received = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(path, headers=headers)
+        received += response.num_bytes_downloaded
+    elapsed = time.perf_counter() - started
+    return requests / elapsed, received / requests
+
+
+async def run(app, paths, requests):
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for path in paths:
+            for revalidate in (False, True):
+                results[path, revalidate] = await measure(client, path, requests, revalidate)
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--dist', help='built frontend to serve (default: a synthetic one)')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per path and mode')
+    args = parser.parse_args()
+
+    dist = os.path.abspath(args.dist) if args.dist else build_dist(tempfile.mkdtemp())
+    os.environ['STATIC_DIR'] = dist
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'static.db')}")
+    from app import app
+    import static_assets
+
+    script = next(path for path in static_assets.load_assets(dist) if path.endswith('.js'))
+    paths = ['/', f'/{script}']
+
+    before = await run(legacy_app(dist), paths, args.requests)
+    async with app.router.lifespan_context(app):
+        after = await run(app, paths, args.requests)
+
+    print(f"{'path':<34} {'request':<12} {'before req/s':>12} {'after req/s':>12} "
+          f"{'before bytes':>13} {'after bytes':>12}")
+    for path in paths:
+        for revalidate in (False, True):
+            (rps_before, bytes_before), (rps_after, bytes_after) = before[path, revalidate], after[path, revalidate]
+            print(f"{path:<34} {'revalidate' if revalidate else 'first visit':<12} {rps_before:12.0f} "
+                  f"{rps_after:12.0f} {bytes_before:13.0f} {bytes_after:12.0f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""Check the fee engine against the original formula and time it.
+
+Prices BENCH_STAYS random stays one at a time and as a NumPy batch under the
+default (flat hourly) tariff, fails if any result differs from the formula
+process_exit used before the tariff engine, and reports the cost per exit.
+
+    python benchmarks/bench_tariffs.py
+"""
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+from tariffs import Tariff, compile_tariff
+
+STAYS = int(os.getenv('BENCH_STAYS', 1_000_000))
+HOURLY_RATE = 1000
+
+
+def original_fee(entry_time, exit_time):
+    duration_minutes = math.ceil((exit_time - entry_time).total_seconds() / 60)
+    return duration_minutes, math.ceil(duration_minutes / 60) * HOURLY_RATE
+
+
+def random_stays(count):
+    rng = random.Random(7)
+    start = datetime(2024, 1, 1)
+    entries, exits = [], []
+    for _ in range(count):
+        entry = start + timedelta(microseconds=rng.randrange(365 * 86_400 * 10**6))
+        # Mix exact minute/hour boundaries with arbitrary stays of up to five days
+        stay_us = rng.choice([0, 1, 60 * 10**6, 60 * 10**6 + 1, 3_600 * 10**6, rng.randrange(5 * 86_400 * 10**6)])
+        entries.append(entry)
+        exits.append(entry + timedelta(microseconds=stay_us))
+    return entries, exits
+
+
+def main():
+    tariff = compile_tariff(Tariff(hourly_rate=HOURLY_RATE))
+    entries, exits = random_stays(STAYS)
+    expected = [original_fee(entry, exit) for entry, exit in zip(entries, exits)]
+
+    started = time.perf_counter()
+    single = [tariff.price(entry, exit) for entry, exit in zip(entries, exits)]
+    single_elapsed = time.perf_counter() - started
+
+    entry_array = np.array(entries, dtype='datetime64[us]')
+    exit_array = np.array(exits, dtype='datetime64[us]')
+    started = time.perf_counter()
+    durations, amounts = tariff.price_batch(entry_array, exit_array)
+    batch_elapsed = time.perf_counter() - started
+
+    mismatches = sum(result != fee for result, fee in zip(single, expected))
+    mismatches += sum(
+        (int(duration), int(amount)) != fee for duration, amount, fee in zip(durations, amounts, expected)
+    )
+    print(f'{STAYS:,} stays under the default tariff')
+    print(f'  single exit   {single_elapsed / STAYS * 1e6:6.2f} us per exit')
+    print(f'  NumPy batch   {batch_elapsed:6.3f} s total ({STAYS / batch_elapsed:,.0f} stays/s)')
+    print(f'  mismatches with the original formula: {mismatches}')
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Insert tickets from several worker processes and check for number collisions.
+
+Every process gets its own TicketNumberAllocator (as a uvicorn worker would)
+and bulk-inserts tickets with the numbers it is handed. Any duplicate number
+would fail the unique constraint on tickets.ticket_number.
+
+    DATABASE_URL=sqlite:///bench.db BENCH_TICKETS=1000000 python benchmarks/bench_ticket_numbers.py
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+TICKETS = int(os.getenv('BENCH_TICKETS', 1_000_000))
+WORKERS = int(os.getenv('BENCH_WORKERS', 4))
+INSERT_CHUNK = int(os.getenv('BENCH_INSERT_CHUNK', 5000))
+
+
+async def issue_tickets(count):
+    from sqlalchemy import insert
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+    from database import async_database_url, database_url
+    from models import Ticket
+    from ticket_numbers import TicketNumberAllocator
+
+    connect_args = {'timeout': 60} if database_url.startswith('sqlite') else {}
+    engine = create_async_engine(async_database_url(database_url), connect_args=connect_args)
+    sessions = async_sessionmaker(engine, class_=AsyncSession)
+    allocator = TicketNumberAllocator(sessions, block_size=INSERT_CHUNK)
+    now = datetime.now()
+
+    issued = 0
+    while issued < count:
+        chunk = min(INSERT_CHUNK, count - issued)
+        numbers = await allocator.allocate(chunk)
+        async with sessions() as session:
+            await session.execute(insert(Ticket), [
+                {
+                    'ticket_number': number,
+                    'license_plate': f'BENCH{number}',
+                    'vehicle_type': 'Standard Vehicle',
+                    'entry_time': now,
+                    'status': 'active',
+                }
+                for number in numbers
+            ])
+            await session.commit()
+        issued += chunk
+    await engine.dispose()
+
+
+def worker(count):
+    asyncio.run(issue_tickets(count))
+
+
+def main():
+    from sqlalchemy import func, select
+    from database import engine, init_db
+    from models import Ticket
+
+    init_db()
+    with engine.connect() as connection:
+        before = connection.execute(select(func.count(Ticket.id))).scalar()
+
+    per_worker = [TICKETS // WORKERS + (1 if i < TICKETS % WORKERS else 0) for i in range(WORKERS)]
+    started = time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(WORKERS) as pool:
+        pool.map(worker, per_worker)
+    elapsed = time.perf_counter() - started
+
+    with engine.connect() as connection:
+        total, distinct = connection.execute(
+            select(func.count(Ticket.id), func.count(func.distinct(Ticket.ticket_number)))
+        ).one()
+
+    print(f'{TICKETS} tickets from {WORKERS} workers in {elapsed:.1f}s ({TICKETS / elapsed:,.0f} tickets/s)')
+    print(f'rows inserted: {total - before}, duplicate numbers: {total - distinct}')
+    if total - before != TICKETS or total != distinct:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Compare entry latency with and without the write-behind journal.
+
+Runs the app in-process against a scratch SQLite database (or DATABASE_URL)
+once with ENTRY_WRITE_BEHIND off and once on, each in a fresh interpreter
+since the setting is read at import, and reports p50/p99 latency of
+BENCH_ITEMS entries made BENCH_CONCURRENCY at a time, plus how long the last
+pending entries took to reach the database.
+
+    python benchmarks/bench_write_behind.py
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+ITEMS = int(os.getenv('BENCH_ITEMS', 200))
+CONCURRENCY = int(os.getenv('BENCH_CONCURRENCY', 20))
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+async def measure():
+    import httpx
+    from app import app
+    from entry_journal import entry_journal
+    from seed import make_room
+
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def enter(client, i):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post('/api/tickets', json={'licensePlate': f'W{i}', 'vehicleType': 'Standard Vehicle'})
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            await make_room(client, ITEMS)
+            started = time.perf_counter()
+            await asyncio.gather(*(enter(client, i) for i in range(ITEMS)))
+            elapsed = time.perf_counter() - started
+            await entry_journal.flush()
+            drained = time.perf_counter() - started
+
+    return {
+        'p50': percentile(latencies, 0.5) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'rps': ITEMS / elapsed,
+        'drained': drained
+    }
+
+
+def run_mode(write_behind):
+    directory = tempfile.mkdtemp()
+    env = {
+        **os.environ,
+        'ENTRY_WRITE_BEHIND': '1' if write_behind else '0',
+        'ENTRY_JOURNAL_DIR': os.path.join(directory, 'journal'),
+    }
+    env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(directory, 'bench.db')}")
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child'],
+        env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    if '--child' in sys.argv:
+        print(json.dumps(asyncio.run(measure())))
+        return
+
+    print(f"{ITEMS} entries, {CONCURRENCY} concurrent")
+    print(f"{'mode':<14} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8} {'in db after s':>14}")
+    for write_behind in (False, True):
+        result = run_mode(write_behind)
+        print(f"{'write-behind' if write_behind else 'direct':<14} {result['p50']:8.2f} {result['p99']:8.2f} "
+              f"{result['rps']:8.0f} {result['drained']:14.2f}")
+
+
+if __name__ == '__main__':
+    main()
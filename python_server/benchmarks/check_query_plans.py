@@ -0,0 +1,90 @@
+"""Fail when a hot endpoint query falls back to a sequential scan.
+
+Seeds the tickets table up to BENCH_TICKETS rows (default one million), then
+runs EXPLAIN on the queries behind /api/garage/stats, /api/activities, the
+ticket lookups and plate search. Exits non-zero if any plan scans the tickets
+or tickets_archive table without an index. Works against SQLite and Postgres:
+
+    DATABASE_URL=sqlite:///plans.db python benchmarks/check_query_plans.py
+"""
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import func, select, text
+
+from activities import activities_query, encode_cursor
+from database import engine, init_db
+from models import ArchivedTicket, Ticket, DEFAULT_GARAGE_ID, TICKET_IS_ACTIVE
+from plates import plate_search_query
+from seed import seed_tickets
+
+TICKETS = int(os.getenv('BENCH_TICKETS', 1_000_000))
+
+
+def hot_queries():
+    # Revenue and stay times are read from the rollup tables, not tickets
+    return {
+        'stats: occupied spaces': select(func.count(Ticket.id)).where(
+            Ticket.garage_id == DEFAULT_GARAGE_ID, TICKET_IS_ACTIVE
+        ),
+        'activities: first page': activities_query().limit(11),
+        'activities: next page': activities_query(encode_cursor(datetime.now() - timedelta(days=30), 500_000)).limit(11),
+        'tickets: lookup by number': select(Ticket).filter_by(ticket_number='PS-10500'),
+        'tickets: archive lookup by number': select(ArchivedTicket).filter_by(ticket_number='PS-10500'),
+        'plates: exact search': plate_search_query('P4242').limit(20),
+        'plates: prefix search': plate_search_query('P42', 'prefix').limit(20),
+        'plates: parked check': plate_search_query('P4242', active_only=True).limit(1),
+    }
+
+
+def sequential_scans(connection, statement):
+    """Return the plan lines that scan the tickets or tickets_archive table without an index."""
+    sql = str(statement.compile(connection, compile_kwargs={'literal_binds': True}))
+    if connection.dialect.name == 'sqlite':
+        plan = connection.execute(text(f'EXPLAIN QUERY PLAN {sql}')).all()
+        lines = [row[-1] for row in plan]
+        return lines, [line for line in lines if line.startswith('SCAN tickets') and 'INDEX' not in line]
+
+    plan = connection.execute(text(f'EXPLAIN (FORMAT JSON) {sql}')).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    lines, scans = [], []
+
+    def walk(node):
+        line = f"{node['Node Type']} {node.get('Relation Name', '')} {node.get('Index Name', '')}".strip()
+        lines.append(line)
+        if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') in ('tickets', 'tickets_archive'):
+            scans.append(line)
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(plan[0]['Plan'])
+    return lines, scans
+
+
+def main():
+    init_db()
+    with engine.begin() as connection:
+        seeded = seed_tickets(connection, TICKETS)
+        if seeded:
+            print(f'Seeded {seeded:,} tickets')
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text('VACUUM ANALYZE tickets' if connection.dialect.name == 'postgresql' else 'ANALYZE'))
+
+        failures = 0
+        for name, statement in hot_queries().items():
+            lines, scans = sequential_scans(connection, statement)
+            print(f"{'FAIL' if scans else 'ok  '} {name}: {' / '.join(lines)}")
+            failures += bool(scans)
+
+    if failures:
+        print(f'{failures} quer{"y" if failures == 1 else "ies"} fell back to a sequential scan')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""Latency and throughput benchmark for the FastAPI server.
+
+Seeds a local database, then drives a realistic mix of entries, exits, ticket
+lookups, stats and activity requests at a fixed concurrency and reports
+p50/p95/p99 latency and requests per second for each endpoint. Results are
+written as JSON so runs from different commits can be compared.
+
+    # In-process (ASGI transport, no sockets) against a scratch SQLite database
+    python benchmarks/load_test.py
+
+    # Under uvicorn, 64 concurrent clients for 30 seconds
+    python benchmarks/load_test.py --mode uvicorn --concurrency 64 --duration 30
+
+    # Against a running server, compared with an earlier run
+    python benchmarks/load_test.py --mode url --url http://localhost:5001 --compare before.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+# Relative weights of each operation in the request mix
+DEFAULT_MIX = 'entry=20,exit=15,ticket=15,stats=35,activities=15'
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, weight = part.split('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, name, seconds, ok):
+        self.latencies[name].append(seconds)
+        if not ok:
+            self.errors[name] += 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for name, values in sorted(self.latencies.items()):
+            values.sort()
+            endpoints[name] = {
+                'requests': len(values),
+                'errors': self.errors[name],
+                'rps': round(len(values) / elapsed, 1),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+                'max_ms': round(values[-1] * 1000, 3),
+            }
+        total = sum(len(values) for values in self.latencies.values())
+        return {'total_requests': total, 'total_rps': round(total / elapsed, 1), 'endpoints': endpoints}
+
+
+class Workload:
+    """Picks operations by weight and keeps a pool of active ticket numbers."""
+
+    def __init__(self, client, mix, recorder, seed=1):
+        self.client = client
+        self.mix = mix
+        self.recorder = recorder
+        self.rng = random.Random(seed)
+        self.active = []
+        self.issued = []
+        # Plates must be unique among parked vehicles
+        self.plates = itertools.count(self.rng.randrange(10**6))
+
+    async def call(self, name, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.recorder.record(name, time.perf_counter() - started, ok)
+        return response if ok else None
+
+    async def entry(self):
+        response = await self.call('POST /api/tickets', 'POST', '/api/tickets', json={
+            'licensePlate': f'LT{next(self.plates):07d}', 'vehicleType': 'Standard Vehicle'
+        })
+        if response is not None:
+            number = response.json()['ticketNumber']
+            self.active.append(number)
+            self.issued.append(number)
+
+    async def exit(self):
+        if not self.active:
+            return await self.entry()
+        number = self.active.pop(self.rng.randrange(len(self.active)))
+        await self.call('PUT /api/tickets/{n}/exit', 'PUT', f'/api/tickets/{number}/exit',
+                        json={'paymentMethod': 'Credit Card'})
+
+    async def ticket(self):
+        if not self.issued:
+            return await self.entry()
+        number = self.rng.choice(self.issued)
+        await self.call('GET /api/tickets/{n}', 'GET', f'/api/tickets/{number}')
+
+    async def stats(self):
+        await self.call('GET /api/garage/stats', 'GET', '/api/garage/stats')
+
+    async def activities(self):
+        await self.call('GET /api/activities', 'GET', '/api/activities', params={'limit': 50})
+
+    async def step(self):
+        name = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        await getattr(self, name)()
+
+
+async def run_load(client, args):
+    from seed import make_room
+    await make_room(client, args.spaces)
+    recorder = Recorder()
+    workload = Workload(client, parse_mix(args.mix), recorder)
+    deadline = time.perf_counter() + args.duration
+    remaining = [args.requests] if args.requests else None
+
+    async def user():
+        while time.perf_counter() < deadline:
+            if remaining is not None:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            await workload.step()
+
+    # Warm up connections and caches before measuring
+    for _ in range(min(50, args.concurrency * 2)):
+        await workload.step()
+    recorder.__init__()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(args.concurrency)))
+    return recorder.summary(time.perf_counter() - started)
+
+
+def seed_database(database_url, tickets):
+    os.environ['DATABASE_URL'] = database_url
+    from database import engine, init_db
+    from seed import seed_tickets
+
+    init_db()
+    with engine.begin() as connection:
+        seeded = seed_tickets(connection, tickets)
+    engine.dispose()
+    if seeded:
+        print(f'Seeded {seeded:,} tickets')
+
+
+async def run_in_process(args):
+    from app import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            return await run_load(client, args)
+
+
+async def run_against_url(url, args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        return await run_load(client, args)
+
+
+async def wait_until_ready(url, timeout=30):
+    async with httpx.AsyncClient(base_url=url) as client:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get('/api/status')).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f'Server at {url} did not become ready')
+
+
+async def run_under_uvicorn(args):
+    port = args.port
+    command = [sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1',
+               '--port', str(port), '--log-level', 'warning', '--workers', str(args.workers)]
+    server = subprocess.Popen(command, cwd=SERVER_DIR, env=dict(os.environ))
+    try:
+        url = f'http://127.0.0.1:{port}'
+        await wait_until_ready(url)
+        return await run_against_url(url, args)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(results, baseline=None):
+    print(f"\n{'endpoint':<30}{'reqs':>8}{'err':>6}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, row in results['endpoints'].items():
+        line = (f"{name:<30}{row['requests']:>8}{row['errors']:>6}{row['rps']:>9.1f}"
+                f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}")
+        previous = (baseline or {}).get('endpoints', {}).get(name)
+        if previous:
+            change = (row['p99_ms'] - previous['p99_ms']) / previous['p99_ms'] * 100 if previous['p99_ms'] else 0
+            line += f"   p99 {change:+.0f}% vs {baseline['meta'].get('commit') or 'baseline'}"
+        print(line)
+    print(f"{'total':<30}{results['total_requests']:>8}{'':>6}{results['total_rps']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--mode', choices=['inprocess', 'uvicorn', 'url'], default='inprocess')
+    parser.add_argument('--url', default='http://localhost:5001', help='server to load in url mode')
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'),
+                        help='database to seed (default: a scratch SQLite file)')
+    parser.add_argument('--tickets', type=int, default=100_000, help='seeded ticket history')
+    parser.add_argument('--spaces', type=int, default=20_000, help='free spaces to make room for before the run')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run')
+    parser.add_argument('--requests', type=int, default=0, help='stop after this many requests')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='operation weights, e.g. "stats=50,entry=50"')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn workers in uvicorn mode')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--output', default=f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    parser.add_argument('--compare', help='earlier JSON result to compare p99 latency against')
+    args = parser.parse_args()
+
+    if args.mode != 'url':
+        database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}"
+        seed_database(database_url, args.tickets)
+
+    if args.mode == 'inprocess':
+        results = asyncio.run(run_in_process(args))
+    elif args.mode == 'uvicorn':
+        results = asyncio.run(run_under_uvicorn(args))
+    else:
+        results = asyncio.run(run_against_url(args.url, args))
+
+    results['meta'] = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'mix': parse_mix(args.mix),
+        'tickets': args.tickets,
+        'database': 'external' if args.mode == 'url' else os.environ['DATABASE_URL'].split(':', 1)[0],
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_summary(results, baseline)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nResults written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
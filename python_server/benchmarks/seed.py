@@ -0,0 +1,60 @@
+"""Seed the tickets table with synthetic history for benchmarks."""
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select
+
+from models import Ticket
+from rollups import backfill
+
+VEHICLE_TYPES = ('Standard Vehicle', 'Compact Car', 'SUV/Truck', 'Motorcycle')
+PAYMENT_METHODS = ('Credit Card', 'Cash', 'Mobile Payment')
+
+
+def seed_tickets(connection, total, active_share=0.02, days=365, chunk_size=50_000, hourly_rate=1000):
+    """Top the tickets table up to `total` rows spread over the last `days` days.
+
+    Returns the number of rows inserted. The rollup tables are rebuilt
+    afterwards so stats and reports agree with the seeded tickets.
+    """
+    existing = connection.execute(select(func.count(Ticket.id))).scalar()
+    if existing >= total:
+        return 0
+
+    rng = random.Random(42)
+    start = datetime.now() - timedelta(days=days)
+    span_minutes = days * 24 * 60
+    for offset in range(existing, total, chunk_size):
+        rows = []
+        for n in range(offset, min(offset + chunk_size, total)):
+            entry = start + timedelta(minutes=n * span_minutes // total)
+            row = {
+                'ticket_number': f'SEED-{n}', 'license_plate': f'P{n % 50_000}',
+                'vehicle_type': VEHICLE_TYPES[n % len(VEHICLE_TYPES)], 'entry_time': entry,
+                'status': 'active', 'exit_time': None, 'duration_minutes': None,
+                'amount_paid': None, 'payment_method': None,
+            }
+            if rng.random() < active_share:
+                # Active plates must be unique
+                row['license_plate'] = f'A{n}'
+            else:
+                duration = rng.randint(5, 600)
+                row.update({
+                    'exit_time': entry + timedelta(minutes=duration), 'duration_minutes': duration,
+                    'amount_paid': -(-duration // 60) * hourly_rate, 'status': 'completed',
+                    'payment_method': rng.choice(PAYMENT_METHODS),
+                })
+            rows.append(row)
+        connection.execute(insert(Ticket), rows)
+
+    backfill(connection)
+    return total - existing
+
+
+async def make_room(client, count):
+    """Raise the garage capacity over HTTP so `count` more vehicles can park."""
+    stats = (await client.get('/api/garage/stats')).json()
+    needed = stats['occupiedSpaces'] + count
+    if stats['totalSpaces'] < needed:
+        response = await client.put('/api/garage/settings', json={'totalSpaces': needed})
+        response.raise_for_status()
@@ -0,0 +1,162 @@
+"""Concurrent exit stress test: every ticket must be charged exactly once.
+
+Creates STRESS_TICKETS tickets, then for each one fires STRESS_ATTEMPTS exit
+requests at the same time, as a flaky gate would: some are retries sharing
+an Idempotency-Key, some carry no key, and the tickets are also included in
+concurrent batch exits. Checks that each ticket has exactly one charge, that
+keyed retries all received the same response, and that the daily report's
+exit count and revenue grew by exactly that much.
+
+    python benchmarks/stress_exits.py                                  # in-process, scratch SQLite
+    python benchmarks/stress_exits.py --url http://localhost:5001      # a running server (e.g. Postgres, N workers)
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+from seed import make_room
+
+
+async def report_totals(client):
+    response = await client.get('/api/reports/daily')
+    response.raise_for_status()
+    rows = response.json()
+    return sum(row['exits'] for row in rows), round(sum(row['revenue'] for row in rows) * 100)
+
+
+async def create_tickets(client, count):
+    numbers = []
+    for offset in range(0, count, 500):
+        response = await client.post('/api/tickets/batch', json={'tickets': [
+            {'licensePlate': f'ST{i:06d}', 'vehicleType': 'Standard Vehicle'}
+            for i in range(offset, min(offset + 500, count))
+        ]})
+        response.raise_for_status()
+        numbers.extend(result['ticket']['ticketNumber'] for result in response.json()['results'])
+    return numbers
+
+
+async def hammer(client, number, attempts, rng):
+    """Fire concurrent exits for one ticket; returns (charges, amount, keyed responses)."""
+    key = str(uuid.uuid4())
+    requests = []
+    for attempt in range(attempts):
+        kind = rng.choice(('keyed', 'keyed', 'plain', 'batch'))
+        if kind == 'batch':
+            requests.append((kind, client.put('/api/tickets/batch/exit', json={
+                'exits': [{'ticketNumber': number, 'paymentMethod': 'Credit Card'}]
+            })))
+        else:
+            headers = {'Idempotency-Key': key} if kind == 'keyed' else {}
+            requests.append((kind, client.put(f'/api/tickets/{number}/exit',
+                                              json={'paymentMethod': 'Credit Card'}, headers=headers)))
+    responses = await asyncio.gather(*(request for _, request in requests))
+
+    charges, amount, keyed = 0, 0, []
+    for (kind, _), response in zip(requests, responses):
+        if response.status_code >= 500:
+            raise RuntimeError(f'{number}: {response.status_code} {response.text}')
+        if kind == 'keyed':
+            keyed.append((response.status_code, response.content))
+            continue
+        if kind == 'batch':
+            result = response.json()['results'][0]
+            ticket = result['ticket'] if result['success'] else None
+        else:
+            ticket = response.json() if response.status_code == 200 else None
+        if ticket:
+            charges += 1
+            amount += ticket['amountPaid']
+
+    # All keyed retries share one outcome, which counts as a single charge
+    if keyed and keyed[0][0] == 200:
+        charges += 1
+        amount += httpx.Response(200, content=keyed[0][1]).json()['amountPaid']
+    return charges, amount, keyed
+
+
+async def run(client, args):
+    rng = random.Random(args.seed)
+    exits_before, revenue_before = await report_totals(client)
+    await make_room(client, args.tickets)
+    numbers = await create_tickets(client, args.tickets)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(number):
+        async with semaphore:
+            return await hammer(client, number, args.attempts, rng)
+
+    errors = []
+    try:
+        # A server error fails the run at once: the group cancels the other
+        # tickets' exits instead of leaving them running
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(one(number)) for number in numbers]
+    except* RuntimeError as group_errors:
+        errors = group_errors.exceptions
+    if errors:
+        for error in errors:
+            print(f'FAIL {error}')
+        return len(errors)
+    results = [task.result() for task in tasks]
+
+    failures = 0
+    total_amount = 0
+    for number, (charges, amount, keyed) in zip(numbers, results):
+        total_amount += amount
+        if charges != 1:
+            print(f'FAIL {number}: charged {charges} times')
+            failures += 1
+        if len(set(keyed)) > 1:
+            print(f'FAIL {number}: keyed retries got different responses')
+            failures += 1
+
+    exits_after, revenue_after = await report_totals(client)
+    if exits_after - exits_before != len(numbers):
+        print(f'FAIL report counts {exits_after - exits_before} exits for {len(numbers)} tickets')
+        failures += 1
+    if revenue_after - revenue_before != total_amount:
+        print(f'FAIL report revenue grew by {revenue_after - revenue_before} cents, charged {total_amount}')
+        failures += 1
+
+    print(f'{len(numbers)} tickets x {args.attempts} concurrent exit attempts: '
+          f'{"ok, every ticket charged exactly once" if not failures else f"{failures} failures"}')
+    return failures
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', help='server to test (default: the app in-process)')
+    parser.add_argument('--tickets', type=int, default=int(os.getenv('STRESS_TICKETS', 500)))
+    parser.add_argument('--attempts', type=int, default=int(os.getenv('STRESS_ATTEMPTS', 8)))
+    parser.add_argument('--concurrency', type=int, default=50, help='tickets hammered at once')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.url:
+        limits = httpx.Limits(max_connections=args.concurrency * args.attempts)
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+            failures = await run(client, args)
+    else:
+        os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'stress.db')}")
+        from app import app
+
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://stress', timeout=60) as client:
+                failures = await run(client, args)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
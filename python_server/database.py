@@ -1,36 +1,306 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker
+import json
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Get database URL from environment
-database_url = os.getenv("DATABASE_URL")
+# Set by the launcher once the database is prepared, so workers skip setup
+DB_PREPARED_ENV = "PARKING_DB_PREPARED"
 
-if not database_url:
-    raise ValueError("DATABASE_URL environment variable is not set")
+# Skip table creation, migrations and the settings check at startup, for
+# deployments that manage the schema separately (python migrations.py)
+DB_SKIP_SCHEMA_CHECK = os.getenv("DB_SKIP_SCHEMA_CHECK", "").lower() in ("1", "true", "yes")
 
-# Create engine
-engine = create_engine(database_url)
+# Seconds a SQLite connection waits for another connection's write to
+# commit before failing with "database is locked"
+DB_SQLITE_BUSY_TIMEOUT = float(os.getenv("DB_SQLITE_BUSY_TIMEOUT", 30))
 
-# Create session factory
+# Connection pool settings (ignored for SQLite)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+
+# Optional read-only replica for reads that tolerate some staleness
+# (activity feed, exports, reports); unset sends every read to the primary
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+# Seconds a client's reads stay on the primary after it writes, covering
+# the replica's lag (read-your-writes)
+DB_REPLICA_LAG_SECONDS = float(os.getenv("DB_REPLICA_LAG_SECONDS", 5))
+# Seconds reads go to the primary after the replica fails, before retrying it
+DB_REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", 30))
+
+# Cookie set on write responses while reads must stay on the primary
+READ_PRIMARY_COOKIE = "db_read_primary"
+
+# Garage served by the routes without a garage id (/api/tickets, ...), and
+# that every row from before multi-garage support belongs to
+DEFAULT_GARAGE_ID = 1
+
+# Garages kept in a database of their own (shard), as a JSON object of garage
+# id to database URL, e.g. {"2": "postgresql://db-east/parking"}; several
+# garages can share a shard. Other garages, and always the default garage,
+# are in DATABASE_URL
+GARAGE_DATABASE_URLS = {
+    int(garage_id): url
+    for garage_id, url in json.loads(os.getenv("GARAGE_DATABASE_URLS") or "{}").items()
+    if int(garage_id) != DEFAULT_GARAGE_ID
+}
+
+def async_database_url(url):
+    """Translate a sync database URL to its async driver equivalent."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg")
+        # asyncpg takes `ssl` instead of libpq's `sslmode`
+        if "sslmode" in url.query:
+            query = dict(url.query)
+            query["ssl"] = query.pop("sslmode")
+            url = url.set(query=query)
+    elif backend == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url
+
+def engine_options(url):
+    """Pool options for an engine, tuned through the DB_POOL_* variables."""
+    if make_url(url).get_backend_name() == "sqlite":
+        # Writers queue on the database lock instead of failing (WAL is set
+        # on connect, see _sqlite_connect)
+        return {"connect_args": {"timeout": DB_SQLITE_BUSY_TIMEOUT}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+@event.listens_for(Engine, "connect")
+def _sqlite_connect(dbapi_connection, connection_record):
+    # Write-ahead logging lets readers run while a write commits, so
+    # requests only ever wait on each other's writes
+    if "sqlite" in type(dbapi_connection).__module__:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+def get_database_url():
+    """The configured DATABASE_URL; raises if it is not set."""
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("DATABASE_URL environment variable is not set")
+    return database_url
+
+# Engines are created on first use, so importing this module (and the app)
+# neither needs DATABASE_URL nor loads a database driver
+_engine = None
+_async_engine = None
+_replica_engine = None
+_replica_down_until = 0.0
+_shard_engines = {}  # database URL -> async engine, for shards other than DATABASE_URL
+_shard_sessions = {}  # database URL -> async session factory
+_engine_lock = threading.Lock()
+
+# Create session factory (bound when the engine is created)
 db_session = scoped_session(
-    sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    sessionmaker(autocommit=False, autoflush=False)
+)
+
+# Create async session factory (bound when the async engine is created);
+# objects stay usable after commit so handlers can serialize them without
+# another round-trip
+AsyncSessionLocal = async_sessionmaker(
+    class_=AsyncSession, autoflush=False, expire_on_commit=False
 )
 
+# Async session factory for the replica (bound when its engine is created)
+ReplicaSessionLocal = async_sessionmaker(
+    class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+def get_engine():
+    """The sync engine (used for schema setup and offline scripts)."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(get_database_url())
+                db_session.configure(bind=_engine)
+    return _engine
+
+def get_async_engine():
+    """The async engine (used by the request handlers)."""
+    global _async_engine
+    if _async_engine is None:
+        with _engine_lock:
+            if _async_engine is None:
+                database_url = get_database_url()
+                _async_engine = create_async_engine(
+                    async_database_url(database_url), **engine_options(database_url)
+                )
+                AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
+
+def get_replica_engine():
+    """The async replica engine, or None when no replica is configured."""
+    global _replica_engine
+    if _replica_engine is None and DATABASE_REPLICA_URL:
+        with _engine_lock:
+            if _replica_engine is None:
+                _replica_engine = create_async_engine(
+                    async_database_url(DATABASE_REPLICA_URL), **engine_options(DATABASE_REPLICA_URL)
+                )
+                # A connection lost mid-query takes the replica out of rotation
+                event.listen(_replica_engine.sync_engine, "handle_error", _replica_error)
+                ReplicaSessionLocal.configure(bind=_replica_engine)
+    return _replica_engine
+
+def _replica_error(context):
+    if context.is_disconnect:
+        mark_replica_down(context.original_exception)
+
+def mark_replica_down(error):
+    """Send reads to the primary for the next DB_REPLICA_RETRY_SECONDS."""
+    global _replica_down_until
+    if time.monotonic() >= _replica_down_until:
+        print(f"Error connecting to the read replica, reading from the primary: {error}")
+    _replica_down_until = time.monotonic() + DB_REPLICA_RETRY_SECONDS
+
+def replica_available():
+    """Whether reads may currently go to the replica."""
+    return bool(DATABASE_REPLICA_URL) and time.monotonic() >= _replica_down_until
+
+def shard_urls():
+    """DATABASE_URL followed by every other database holding garages."""
+    urls = [get_database_url()]
+    for url in GARAGE_DATABASE_URLS.values():
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+def garage_sessionmaker(garage_id):
+    """Async session factory for the database holding `garage_id`."""
+    url = GARAGE_DATABASE_URLS.get(garage_id)
+    if url is None or url == get_database_url():
+        if _async_engine is None:
+            get_async_engine()
+        return AsyncSessionLocal
+    sessions = _shard_sessions.get(url)
+    if sessions is None:
+        with _engine_lock:
+            sessions = _shard_sessions.get(url)
+            if sessions is None:
+                engine = create_async_engine(async_database_url(url), **engine_options(url))
+                _shard_engines[url] = engine
+                sessions = _shard_sessions[url] = async_sessionmaker(
+                    bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+                )
+    return sessions
+
+def each_database():
+    """Yield a sync engine for DATABASE_URL and then for each shard (setup and scripts)."""
+    yield get_engine()
+    for url in shard_urls()[1:]:
+        engine = create_engine(url)
+        try:
+            yield engine
+        finally:
+            engine.dispose()
+
+def shard_engines():
+    """Async engines of the shards in GARAGE_DATABASE_URLS, creating them if needed."""
+    for garage_id in GARAGE_DATABASE_URLS:
+        garage_sessionmaker(garage_id)
+    return list(_shard_engines.values())
+
+def __getattr__(name):
+    # `from database import engine` keeps working for scripts and benchmarks
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    if name == "database_url":
+        return get_database_url()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # Create base for declarative models
 Base = declarative_base()
 Base.query = db_session.query_property()
 
-def init_db():
-    """Initialize the database - create all tables."""
+def init_db(engine=None):
+    """Initialize the database - create all tables and apply pending migrations."""
     # Import all models here to ensure they are registered
     import models
+    from migrations import run_migrations
+    engine = engine or get_engine()
     Base.metadata.create_all(bind=engine)
+    return run_migrations(engine)
+
+def initialize_garage_settings():
+    """Create the default garage settings if none exist."""
+    from models import GarageSetting
+    get_engine()
+    settings = db_session.query(GarageSetting).filter_by(garage_id=DEFAULT_GARAGE_ID).first()
+    if not settings:
+        new_settings = GarageSetting(
+            garage_id=DEFAULT_GARAGE_ID,
+            total_spaces=140,
+            hourly_rate=1000  # $10.00 in cents
+        )
+        db_session.add(new_settings)
+        db_session.commit()
+    db_session.remove()
+
+def prepare_database():
+    """One-time setup before serving: tables, migrations and default settings."""
+    # Shards get the same schema; their garages are created through the API
+    applied = [init_db(engine) for engine in each_database()][0]
+    initialize_garage_settings()
+    return applied
+
+async def open_read_session(prefer_primary=False, session_factory=None):
+    """A session on the replica when it can serve the read, else on the primary.
+
+    The replica is skipped when `prefer_primary` is set (the client has just
+    written) or while it is marked down; failing to connect to it marks it
+    down and falls back to the primary. Reads for a garage on a shard
+    (`session_factory` from `garage_sessionmaker`) always go to the shard.
+    """
+    if session_factory not in (None, AsyncSessionLocal):
+        return session_factory()
+    if not prefer_primary and replica_available():
+        get_replica_engine()
+        session = ReplicaSessionLocal()
+        try:
+            await session.connection()
+            return session
+        except Exception as e:
+            await session.close()
+            mark_replica_down(e)
+    if _async_engine is None:
+        get_async_engine()
+    return AsyncSessionLocal()
+
+async def dispose_engines():
+    """Close the connection pools of any engines that were created."""
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _replica_engine is not None:
+        await _replica_engine.dispose()
+    for engine in _shard_engines.values():
+        await engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
 
 def shutdown_session(exception=None):
     """Remove the session at the end of request."""
-    db_session.remove()
\ No newline at end of file
+    db_session.remove()
@@ -0,0 +1,306 @@
+"""Write-behind journal for vehicle entries.
+
+With ENTRY_WRITE_BEHIND=1 an entry is acknowledged as soon as it is durable
+in a local append-only journal, instead of after its INSERT commits. Each
+worker appends entries to its own file under ENTRY_JOURNAL_DIR; appends that
+arrive within ENTRY_FSYNC_INTERVAL share one fsync. A background task then
+writes the pending entries to `tickets` in group commits, every
+ENTRY_FLUSH_INTERVAL seconds or as soon as ENTRY_FLUSH_BATCH are waiting,
+and empties the journal once everything in it is in the database.
+
+Until it is flushed a ticket lives in the pending buffer, which ticket
+lookups and the parked-vehicle check read through. Exits flush first. A
+pending ticket has no database id yet, so it is returned with `id: null`.
+
+Entries for garages on different databases (see GARAGE_DATABASE_URLS) are
+committed per database.
+
+At startup every worker replays journals left behind by workers that are no
+longer running (each live worker holds a lock on its own file), inserting
+the entries that never reached the database. Entries that conflict once in
+the database (a space taken through another worker) lose their space; an
+entry for a vehicle parked through another worker in the meantime is
+dropped and logged.
+"""
+import asyncio
+import fcntl
+import glob
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from models import Ticket, DEFAULT_GARAGE_ID
+from rollups import record_entries
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+# Acknowledge entries once journaled and insert them in the background
+ENTRY_WRITE_BEHIND = os.getenv('ENTRY_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+# Directory holding one journal file per worker
+ENTRY_JOURNAL_DIR = os.getenv('ENTRY_JOURNAL_DIR', os.path.join(SERVER_DIR, 'journal'))
+# Seconds an append waits for others to share its fsync
+ENTRY_FSYNC_INTERVAL = float(os.getenv('ENTRY_FSYNC_INTERVAL', 0.002))
+# Seconds between group commits, and pending entries that trigger one early
+ENTRY_FLUSH_INTERVAL = float(os.getenv('ENTRY_FLUSH_INTERVAL', 0.2))
+ENTRY_FLUSH_BATCH = int(os.getenv('ENTRY_FLUSH_BATCH', 500))
+
+JOURNAL_FIELDS = ('garage_id', 'ticket_number', 'license_plate', 'normalized_plate', 'vehicle_type', 'space')
+
+
+def encode_entry(ticket):
+    record = {field: getattr(ticket, field) for field in JOURNAL_FIELDS}
+    record['entry_time'] = ticket.entry_time.isoformat()
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def decode_entry(line):
+    record = json.loads(line)
+    record['entry_time'] = datetime.fromisoformat(record['entry_time'])
+    return Ticket(status='active', **record)
+
+
+def read_journal(path):
+    """Entries in a journal file; a torn last line from a crash is skipped."""
+    entries = []
+    with open(path) as f:
+        for line in f:
+            try:
+                entries.append(decode_entry(line))
+            except (ValueError, KeyError, TypeError):
+                break
+    return entries
+
+
+def _ticket_row(ticket):
+    return {column.key: getattr(ticket, column.key) for column in Ticket.__table__.columns
+            if column.key != 'id'}
+
+
+class EntryJournal:
+    """Per-worker pending entries, their journal file and the flusher task."""
+
+    def __init__(self, enabled=ENTRY_WRITE_BEHIND, directory=ENTRY_JOURNAL_DIR,
+                 fsync_interval=ENTRY_FSYNC_INTERVAL, flush_interval=ENTRY_FLUSH_INTERVAL,
+                 flush_batch=ENTRY_FLUSH_BATCH):
+        self.enabled = enabled
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.pending = {}  # ticket number -> transient Ticket, in entry order
+        self._plates = {}  # (garage id, normalized plate) -> pending ticket number
+        self._sessionmaker_for = None
+        self._file = None
+        self._path = None
+        self._waiters = []
+        self._appending = 0  # appends written to the journal and not yet settled
+        self._sync_task = None
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+
+    def __len__(self):
+        return len(self.pending)
+
+    async def start(self, sessionmaker_for):
+        """Replay journals of stopped workers, then open this worker's journal.
+
+        `sessionmaker_for(garage_id)` returns the session factory for the
+        database holding a garage (`database.garage_sessionmaker`).
+        """
+        self._sessionmaker_for = sessionmaker_for
+        if os.path.isdir(self.directory):
+            await self.replay()
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Created and locked under a name replay does not look at, then
+        # renamed: another worker's replay only ever sees it locked
+        name = f'entries-{os.getpid()}-{time.time_ns()}.log'
+        staging = os.path.join(self.directory, f'.{name}.new')
+        self._file = open(staging, 'a')
+        fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._path = os.path.join(self.directory, name)
+        os.rename(staging, self._path)
+        self._flush_task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        """Flush what is pending and close the journal, removing it if empty."""
+        if self._flush_task is None:
+            return
+        self._flush_task.cancel()
+        try:
+            await self._flush_task
+        except asyncio.CancelledError:
+            pass
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error flushing pending entries: {e}")
+        if self._sync_task is not None:
+            await self._sync_task
+        self._file.close()
+        if not self.pending:
+            os.unlink(self._path)
+        self._file = None
+
+    async def replay(self):
+        """Insert the entries from journals whose worker is gone; returns how many."""
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self.directory, 'entries-*.log'))):
+            try:
+                # Read-only, so a journal another worker just replayed and
+                # removed is not recreated
+                f = open(path)
+            except FileNotFoundError:
+                continue
+            with f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # a running worker's journal
+                if os.fstat(f.fileno()).st_nlink == 0:
+                    continue  # replayed and removed by another worker meanwhile
+                for session_factory, entries in self._by_database(read_journal(path)).items():
+                    async with session_factory() as session:
+                        existing = set((await session.scalars(
+                            select(Ticket.ticket_number)
+                            .where(Ticket.ticket_number.in_([ticket.ticket_number for ticket in entries]))
+                        )).all())
+                    missing = [ticket for ticket in entries if ticket.ticket_number not in existing]
+                    await self._insert(session_factory, missing)
+                    replayed += len(missing)
+                os.unlink(path)
+        if replayed:
+            print(f"Replayed {replayed} journaled entries")
+        return replayed
+
+    async def append(self, ticket):
+        """Journal a new (transient) ticket; returns once the entry is on disk."""
+        # The plate is claimed right away, so a second entry for it is
+        # refused while this one is being synced
+        key = (ticket.garage_id, ticket.normalized_plate)
+        self._plates[key] = ticket.ticket_number
+        self._file.write(encode_entry(ticket))
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync())
+        self._appending += 1
+        try:
+            await waiter
+        except BaseException:
+            # Not acknowledged: the entry must neither be inserted nor block
+            # the plate's next entry
+            if self._plates.get(key) == ticket.ticket_number:
+                del self._plates[key]
+            raise
+        else:
+            # Only entries on disk are inserted by the flusher
+            self.pending[ticket.ticket_number] = ticket
+        finally:
+            self._appending -= 1
+        if len(self.pending) >= self.flush_batch:
+            self._wake.set()
+
+    async def _sync(self):
+        # Group fsync: every append that arrives while one is in progress
+        # waits for the next
+        await asyncio.sleep(self.fsync_interval)
+        while self._waiters:
+            waiters, self._waiters = self._waiters, []
+            try:
+                self._file.flush()
+                await asyncio.to_thread(os.fsync, self._file.fileno())
+            except Exception as e:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                continue
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+        self._sync_task = None
+
+    def get(self, ticket_number, garage_id=DEFAULT_GARAGE_ID):
+        """The garage's pending ticket with this number, if it is not in the database yet."""
+        ticket = self.pending.get(ticket_number)
+        return ticket if ticket is not None and ticket.garage_id == garage_id else None
+
+    def parked_ticket(self, plate, garage_id=DEFAULT_GARAGE_ID):
+        """Ticket number of a pending entry for `plate` in the garage, if any."""
+        return self._plates.get((garage_id, plate))
+
+    async def ensure_flushed(self, ticket_numbers):
+        """Flush now if any of `ticket_numbers` is still pending (e.g. before an exit)."""
+        if any(number in self.pending for number in ticket_numbers):
+            await self.flush()
+
+    async def _flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # Entries stay pending and journaled; retried next round
+                print(f"Error flushing pending entries: {e}")
+
+    async def flush(self):
+        """Insert every pending entry in one group commit."""
+        async with self._flush_lock:
+            batch = list(self.pending.values())
+            if not batch:
+                return
+            for session_factory, tickets in self._by_database(batch).items():
+                await self._insert(session_factory, tickets)
+                for ticket in tickets:
+                    self.pending.pop(ticket.ticket_number, None)
+                    key = (ticket.garage_id, ticket.normalized_plate)
+                    if self._plates.get(key) == ticket.ticket_number:
+                        del self._plates[key]
+            if not self.pending and not self._appending and self._file is not None:
+                # Everything journaled is in the database
+                self._file.truncate(0)
+
+    def _by_database(self, tickets):
+        groups = defaultdict(list)
+        for ticket in tickets:
+            groups[self._sessionmaker_for(ticket.garage_id)].append(ticket)
+        return groups
+
+    async def _insert(self, session_factory, tickets):
+        if not tickets:
+            return
+        async with session_factory() as session:
+            try:
+                await session.execute(insert(Ticket), [_ticket_row(ticket) for ticket in tickets])
+                record_entries(session, tickets)
+                await session.commit()
+                return
+            except IntegrityError:
+                await session.rollback()
+
+            # Somebody else took a plate or space; insert one at a time
+            for ticket in tickets:
+                row = _ticket_row(ticket)
+                for attempt in (row, {**row, 'space': None}):
+                    try:
+                        await session.execute(insert(Ticket), [attempt])
+                        record_entries(session, [ticket])
+                        await session.commit()
+                        break
+                    except IntegrityError:
+                        await session.rollback()
+                else:
+                    print(f"Error flushing entry {ticket.ticket_number}: vehicle {ticket.license_plate} is already parked")
+
+
+# Shared journal for this worker process
+entry_journal = EntryJournal()
@@ -0,0 +1,173 @@
+import asyncio
+import itertools
+import json
+import os
+from models import DEFAULT_GARAGE_ID
+
+# Set to e.g. redis://localhost:6379/0 to share events between worker processes
+EVENTS_BROKER_URL = os.getenv('EVENTS_BROKER_URL')
+EVENTS_CHANNEL = os.getenv('EVENTS_CHANNEL', 'garage-events')
+
+
+class Message:
+    """A garage event: the change that happened plus the resulting stats.
+
+    Because every message carries the full stats, a subscriber that falls
+    behind can skip intermediate messages without ending up out of date.
+    The JSON encoding is computed once and shared by all subscribers.
+    """
+
+    __slots__ = ('data', '_encoded')
+
+    def __init__(self, data):
+        self.data = data
+        self._encoded = None
+
+    @property
+    def encoded(self):
+        if self._encoded is None:
+            self._encoded = json.dumps(self.data, separators=(',', ':'))
+        return self._encoded
+
+    def merge(self, newer):
+        """Fold a newer message into this one, summing the deltas."""
+        delta = dict(self.data.get('delta', {}))
+        for key, value in newer.data.get('delta', {}).items():
+            delta[key] = delta.get(key, 0) + value
+        return Message({
+            **newer.data,
+            'delta': delta,
+            'coalesced': self.data.get('coalesced', 1) + newer.data.get('coalesced', 1),
+        })
+
+
+class Subscription:
+    """One subscriber's mailbox for a garage, holding at most one pending message.
+
+    Publishing never blocks on a slow consumer: a new message is merged into
+    the pending one instead of being queued behind it.
+    """
+
+    def __init__(self, broker, garage_id=DEFAULT_GARAGE_ID):
+        self.broker = broker
+        self.garage_id = garage_id
+        self._pending = None
+        self._ready = asyncio.Event()
+
+    def offer(self, message):
+        self._pending = self._pending.merge(message) if self._pending else message
+        self._ready.set()
+
+    async def get(self, timeout=None):
+        """Wait for the next message; returns None on timeout."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._ready.clear()
+        message, self._pending = self._pending, None
+        return message
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Fans events out to the subscribers of this worker process."""
+
+    def __init__(self):
+        self._subscribers = {}  # garage id -> subscriptions
+        self._sequence = itertools.count(1)
+
+    @property
+    def subscriber_count(self):
+        return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def subscribe(self, garage_id=DEFAULT_GARAGE_ID):
+        subscription = Subscription(self, garage_id)
+        self._subscribers.setdefault(garage_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self._subscribers.get(subscription.garage_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[subscription.garage_id]
+
+    def _deliver(self, message):
+        # Only the garage's own subscribers see its events
+        for subscription in self._subscribers.get(message.data.get('garageId', DEFAULT_GARAGE_ID), ()):
+            subscription.offer(message)
+
+    async def publish(self, event, delta, stats, garage_id=DEFAULT_GARAGE_ID):
+        """Send an event to every subscriber of the garage."""
+        self._deliver(Message({
+            'seq': next(self._sequence),
+            'garageId': garage_id,
+            'event': event,
+            'delta': delta,
+            'stats': stats,
+        }))
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class RedisBroker(InProcessBroker):
+    """Shares events between workers through Redis pub/sub.
+
+    Events are published to a Redis channel and every worker relays what it
+    receives to its own subscribers, so a subscriber sees changes made by any
+    worker. Requires the optional `redis` package.
+    """
+
+    def __init__(self, url, channel=EVENTS_CHANNEL):
+        super().__init__()
+        import redis.asyncio as redis
+        self._redis = redis.from_url(url)
+        self.channel = channel
+        self._listener = None
+
+    async def publish(self, event, delta, stats, garage_id=DEFAULT_GARAGE_ID):
+        await self._redis.publish(self.channel, json.dumps({
+            'garageId': garage_id,
+            'event': event,
+            'delta': delta,
+            'stats': stats,
+        }, separators=(',', ':')))
+
+    async def _listen(self):
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        try:
+            async for item in pubsub.listen():
+                if item.get('type') != 'message':
+                    continue
+                data = json.loads(item['data'])
+                data['seq'] = next(self._sequence)
+                self._deliver(Message(data))
+        finally:
+            await pubsub.unsubscribe(self.channel)
+
+    async def start(self):
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+        await self._redis.close()
+
+
+def create_broker(url=EVENTS_BROKER_URL):
+    """Pick the broker configured by EVENTS_BROKER_URL."""
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBroker(url)
+    return InProcessBroker()
+
+
+# Shared broker for this worker process
+broker = create_broker()
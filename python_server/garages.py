@@ -0,0 +1,107 @@
+"""Per-garage state for serving many garages from one process.
+
+Every garage gets its own stats counters, settings cache, space allocator,
+plate index and analytics cache, created on first use and loaded lazily, so
+a busy garage's locks and reloads never hold up another garage. State is
+only created for garages that have a settings row, so requests for made-up
+garage ids cannot grow the registry. Each garage's database comes from
+`database.garage_sessionmaker` (DATABASE_URL, or its shard in
+GARAGE_DATABASE_URLS); garages on the same database share a ticket number
+allocator, since ticket numbers are unique per database.
+
+The default garage reuses the module-level singletons (`garage_stats`,
+`settings_cache`, ...), which is what the routes without a garage id serve.
+"""
+import threading
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from analytics import OccupancyAnalytics
+from database import DEFAULT_GARAGE_ID, garage_sessionmaker
+from models import GarageSetting
+from plates import PlateIndex, plate_index
+from settings_cache import SettingsCache, settings_cache
+from spaces import SpaceAllocator, space_allocator
+from stats import GarageStats, garage_stats
+from ticket_numbers import TicketNumberAllocator
+
+# Settings of a garage created without them
+DEFAULT_TOTAL_SPACES = 140
+DEFAULT_HOURLY_RATE = 1000  # $10.00 in cents
+
+
+class Garage:
+    """Everything one worker caches about one garage."""
+
+    def __init__(self, garage_id, session_factory, ticket_numbers, stats=None, settings=None,
+                 spaces=None, plates=None):
+        self.id = garage_id
+        self.session_factory = session_factory
+        self.ticket_numbers = ticket_numbers
+        self.stats = stats or GarageStats(garage_id)
+        self.settings = settings or SettingsCache(garage_id)
+        self.spaces = spaces or SpaceAllocator(garage_id)
+        self.plates = plates or PlateIndex(garage_id)
+        self.analytics = OccupancyAnalytics(garage_id)
+
+
+class GarageRegistry:
+    """Per-worker map of garage id -> Garage, filled on first use."""
+
+    def __init__(self):
+        self._garages = {}
+        self._ticket_numbers = {}  # session factory -> allocator
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._garages)
+
+    async def find(self, garage_id):
+        """The garage's state, or None when the garage has no settings row."""
+        garage = self._garages.get(garage_id)
+        if garage is not None:
+            return garage
+        async with garage_sessionmaker(garage_id)() as session:
+            exists = (await session.execute(
+                select(GarageSetting.id).where(GarageSetting.garage_id == garage_id)
+            )).scalar() is not None
+        return self.get(garage_id) if exists else None
+
+    def get(self, garage_id):
+        """The garage's state, created if needed (for garages known to exist)."""
+        garage = self._garages.get(garage_id)
+        if garage is None:
+            with self._lock:
+                garage = self._garages.get(garage_id)
+                if garage is None:
+                    garage = self._garages[garage_id] = self._create(garage_id)
+        return garage
+
+    def _create(self, garage_id):
+        session_factory = garage_sessionmaker(garage_id)
+        ticket_numbers = self._ticket_numbers.get(session_factory)
+        if ticket_numbers is None:
+            ticket_numbers = self._ticket_numbers[session_factory] = TicketNumberAllocator(session_factory)
+        if garage_id == DEFAULT_GARAGE_ID:
+            return Garage(garage_id, session_factory, ticket_numbers, garage_stats, settings_cache,
+                          space_allocator, plate_index)
+        return Garage(garage_id, session_factory, ticket_numbers)
+
+
+async def create_garage_settings(db, garage_id, total_spaces=DEFAULT_TOTAL_SPACES,
+                                 hourly_rate=DEFAULT_HOURLY_RATE):
+    """Create a garage's settings row unless it exists; returns the row id."""
+    try:
+        await db.execute(insert(GarageSetting).values(
+            garage_id=garage_id, total_spaces=total_spaces, hourly_rate=hourly_rate
+        ))
+        await db.commit()
+    except IntegrityError:
+        # Created through another worker in the meantime
+        await db.rollback()
+    return (await db.execute(
+        select(GarageSetting.id).where(GarageSetting.garage_id == garage_id)
+    )).scalar()
+
+
+# Garages served by this worker process
+garages = GarageRegistry()
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+from fastapi import HTTPException
+from starlette.responses import Response
+from serializers import dumps
+
+# Most recent results kept per worker, and how long a key stays valid
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000))
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', 24 * 3600))
+
+
+class StoredResult(NamedTuple):
+    scope: str  # the request the key was first used for
+    status_code: int
+    body: bytes
+    stored_at: float
+
+
+class IdempotencyKeyReused(Exception):
+    """Raised when a key is presented for a different request than before."""
+
+
+class IdempotencyCache:
+    """Per-worker LRU of recent responses, keyed by the Idempotency-Key header.
+
+    A retry with the same key gets the stored response without the request
+    being run again. A retry that arrives while the first attempt is still in
+    flight waits for it rather than racing it.
+    """
+
+    def __init__(self, max_entries=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._results = OrderedDict()
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._results)
+
+    def _lookup(self, key, scope):
+        result = self._results.get(key)
+        if result is None:
+            return None
+        if time.monotonic() - result.stored_at >= self.ttl:
+            del self._results[key]
+            return None
+        if result.scope != scope:
+            raise IdempotencyKeyReused(key)
+        self._results.move_to_end(key)
+        return result
+
+    async def begin(self, key, scope):
+        """Return the stored result for `key`, or None if the caller should run the request.
+
+        When None is returned the caller owns the key and must call `store`
+        or `release` when done.
+        """
+        while True:
+            result = self._lookup(key, scope)
+            if result is not None:
+                return result
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = asyncio.Event()
+                return None
+            await pending.wait()
+
+    def store(self, key, scope, status_code, body):
+        """Record the response for `key` and wake any retries waiting on it."""
+        self._results[key] = StoredResult(scope, status_code, body, time.monotonic())
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+        self.release(key)
+
+    def release(self, key):
+        """Give up a key without storing a result (e.g. after a server error)."""
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            pending.set()
+
+
+# Shared cache for this worker process
+idempotency_cache = IdempotencyCache()
+
+
+async def idempotent(key, scope, handler, cache=idempotency_cache):
+    """Run `handler()` at most once per key, replaying its response on retries.
+
+    Successful responses and client errors are stored; server errors are not,
+    so a retry after a 5xx runs the request again.
+    """
+    if not key:
+        return await handler()
+    try:
+        stored = await cache.begin(key, scope)
+    except IdempotencyKeyReused:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    if stored is not None:
+        return Response(stored.body, status_code=stored.status_code, media_type='application/json',
+                        headers={'Idempotent-Replayed': 'true'})
+
+    try:
+        response = await handler()
+    except HTTPException as e:
+        if e.status_code < 500:
+            cache.store(key, scope, e.status_code, dumps({'message': str(e.detail)}))
+        else:
+            cache.release(key)
+        raise
+    except BaseException:
+        cache.release(key)
+        raise
+    cache.store(key, scope, response.status_code, response.body)
+    return response
@@ -0,0 +1,221 @@
+"""Per-request timing and query instrumentation.
+
+Each HTTP request gets a `RequestMetrics` record (held in a context variable)
+that SQLAlchemy engine events fill with the statements it runs, and that the
+JSON response class fills with its encoding time. When the request finishes
+the totals are folded into per-route histograms, exposed in the Prometheus
+text format by `render_prometheus`.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from sqlalchemy import event
+from starlette.responses import JSONResponse
+
+# Requests slower than this are logged with their queries (0 disables)
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 0))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+slow_request_log = logging.getLogger('parking.slow_requests')
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """What one request spent its time on."""
+
+    __slots__ = ('started', 'queries', 'sql_seconds', 'serialize_seconds')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []
+        self.sql_seconds = 0.0
+        self.serialize_seconds = 0.0
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Metric families keyed by label tuples."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_seconds = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.request_queries = defaultdict(lambda: Histogram(QUERY_COUNT_BUCKETS))
+        self.request_sql_seconds = defaultdict(float)
+        self.request_serialize_seconds = defaultdict(float)
+        self.sql_seconds = Histogram(LATENCY_BUCKETS)
+
+    def observe_request(self, method, route, status_code, metrics, elapsed):
+        with self._lock:
+            self.request_seconds[(method, route, str(status_code))].observe(elapsed)
+            self.request_queries[(method, route)].observe(len(metrics.queries))
+            self.request_sql_seconds[(method, route)] += metrics.sql_seconds
+            self.request_serialize_seconds[(method, route)] += metrics.serialize_seconds
+
+    def observe_query(self, seconds):
+        with self._lock:
+            self.sql_seconds.observe(seconds)
+
+
+registry = Registry()
+
+
+def start_request():
+    """Begin collecting metrics for the current request."""
+    metrics = RequestMetrics()
+    _current.set(metrics)
+    return metrics
+
+
+def record_serialization(seconds):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.serialize_seconds += seconds
+
+
+def route_label(request):
+    """Path template of the route that served a request, including its mount.
+
+    A route included through an APIRouter only knows its own path (`/stats`),
+    so the prefix it was mounted under is taken from the request path, with
+    the prefix's path parameters (`garage_id`) put back as placeholders.
+    """
+    route = request.scope.get('route')
+    path = getattr(route, 'path', None)
+    if not path:
+        return 'unmatched'
+    full_path = request.url.path
+    for split in range(len(full_path)):
+        if full_path[split] == '/' and route.path_regex.match(full_path[split:]):
+            break
+    else:
+        return path
+    segments = full_path[:split].split('/')
+    for name, value in request.path_params.items():
+        if name not in route.param_convertors and str(value) in segments:
+            segments[segments.index(str(value))] = f'{{{name}}}'
+    return '/'.join(segments) + path
+
+
+def finish_request(request, status_code, metrics):
+    """Fold a finished request into the registry and log it if it was slow."""
+    elapsed = time.perf_counter() - metrics.started
+    registry.observe_request(request.method, route_label(request), status_code, metrics, elapsed)
+
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        queries = ''.join(
+            f"\n    {seconds * 1000:8.2f} ms  {' '.join(statement.split())[:500]}"
+            for statement, seconds in metrics.queries
+        )
+        slow_request_log.warning(
+            "Slow request %s %s -> %s: %.1f ms total, %d queries in %.1f ms, serialization %.1f ms%s",
+            request.method, request.url.path, status_code, elapsed * 1000,
+            len(metrics.queries), metrics.sql_seconds * 1000, metrics.serialize_seconds * 1000, queries
+        )
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that records how long encoding the body took."""
+
+    def render(self, content):
+        started = time.perf_counter()
+        body = super().render(content)
+        record_serialization(time.perf_counter() - started)
+        return body
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_started'].pop()
+    registry.observe_query(seconds)
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.queries.append((statement, seconds))
+        metrics.sql_seconds += seconds
+
+
+def instrument_engine(engine):
+    """Time every statement run through a (sync) engine; safe to call twice."""
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+
+
+def _histogram_lines(name, labels, histogram):
+    lines = []
+    cumulative = 0
+    prefix = f'{labels},' if labels else ''
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+    suffix = f'{{{labels}}}' if labels else ''
+    lines.append(f'{name}_sum{suffix} {histogram.sum}')
+    lines.append(f'{name}_count{suffix} {histogram.count}')
+    return lines
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    with registry._lock:
+        lines = [
+            '# HELP parking_http_request_duration_seconds Request latency by route.',
+            '# TYPE parking_http_request_duration_seconds histogram',
+        ]
+        for key, histogram in sorted(registry.request_seconds.items()):
+            lines += _histogram_lines('parking_http_request_duration_seconds',
+                                      _labels(('method', 'route', 'status'), key), histogram)
+
+        lines += [
+            '# HELP parking_http_request_sql_queries SQL statements run per request.',
+            '# TYPE parking_http_request_sql_queries histogram',
+        ]
+        for key, histogram in sorted(registry.request_queries.items()):
+            lines += _histogram_lines('parking_http_request_sql_queries',
+                                      _labels(('method', 'route'), key), histogram)
+
+        lines += [
+            '# HELP parking_http_request_sql_seconds_total Time spent in SQL by route.',
+            '# TYPE parking_http_request_sql_seconds_total counter',
+        ]
+        for key, seconds in sorted(registry.request_sql_seconds.items()):
+            lines.append(f'parking_http_request_sql_seconds_total{{{_labels(("method", "route"), key)}}} {seconds}')
+
+        lines += [
+            '# HELP parking_http_request_serialize_seconds_total Time spent encoding JSON responses by route.',
+            '# TYPE parking_http_request_serialize_seconds_total counter',
+        ]
+        for key, seconds in sorted(registry.request_serialize_seconds.items()):
+            lines.append(f'parking_http_request_serialize_seconds_total{{{_labels(("method", "route"), key)}}} {seconds}')
+
+        lines += [
+            '# HELP parking_sql_query_duration_seconds Duration of individual SQL statements.',
+            '# TYPE parking_sql_query_duration_seconds histogram',
+        ]
+        lines += _histogram_lines('parking_sql_query_duration_seconds', '', registry.sql_seconds)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,172 @@
+"""Schema migrations that `create_all` cannot apply to an existing database.
+
+Migrations are plain functions taking a SQLAlchemy connection, applied in
+order and recorded in the `schema_migrations` table. They must work on both
+Postgres and SQLite.
+
+    python migrations.py
+"""
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, bindparam, func, inspect, select, text, update
+
+
+migration_metadata = MetaData()
+
+schema_migrations = Table(
+    'schema_migrations', migration_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String, nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def create_ticket_indexes(connection):
+    """Add the indexes used by the stats, activity and ticket lookups."""
+    from models import Ticket
+    for index in Ticket.__table__.indexes:
+        # Plate, space and garage indexes need the columns added by later migrations
+        if not {'normalized_plate', 'space', 'garage_id'} & set(index.columns.keys()):
+            index.create(connection, checkfirst=True)
+
+
+def add_garage_settings_version(connection):
+    """Add the version stamp used by the settings cache."""
+    columns = {column['name'] for column in inspect(connection).get_columns('garage_settings')}
+    if 'version' not in columns:
+        connection.execute(text(
+            "ALTER TABLE garage_settings ADD COLUMN version INTEGER NOT NULL DEFAULT 1"
+        ))
+
+
+def backfill_rollups(connection):
+    """Fill the new rollup tables from the existing tickets."""
+    from rollups import backfill
+    # Rollups are per garage; tickets from before add_garage_id are counted there
+    columns = {column['name'] for column in inspect(connection).get_columns('tickets')}
+    if 'garage_id' in columns:
+        backfill(connection)
+
+
+def add_normalized_plate(connection, chunk_size=10_000):
+    """Add, backfill and index the normalized plate used by plate search."""
+    from models import Ticket, normalize_plate
+    columns = {column['name'] for column in inspect(connection).get_columns('tickets')}
+    if 'normalized_plate' not in columns:
+        connection.execute(text("ALTER TABLE tickets ADD COLUMN normalized_plate VARCHAR"))
+
+    # Normalization is done in Python so every database gets the same
+    # result; walk the table by id in chunks to keep memory bounded
+    statement = (
+        update(Ticket.__table__)
+        .where(Ticket.__table__.c.id == bindparam('ticket_id'))
+        .values(normalized_plate=bindparam('plate'))
+    )
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(Ticket.id, Ticket.license_plate)
+            .where(Ticket.id > last_id, Ticket.normalized_plate.is_(None))
+            .order_by(Ticket.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        connection.execute(statement, [
+            {'ticket_id': ticket_id, 'plate': normalize_plate(plate)} for ticket_id, plate in rows
+        ])
+        last_id = rows[-1].id
+    # The plate indexes are per garage, created by add_garage_id
+
+
+def _create_garage_indexes(connection, table):
+    from models import Ticket, TICKET_IS_ACTIVE
+    duplicates = []
+    if table is Ticket.__table__:
+        duplicates = connection.execute(
+            select(Ticket.normalized_plate).where(TICKET_IS_ACTIVE)
+            .group_by(Ticket.garage_id, Ticket.normalized_plate).having(func.count() > 1)
+        ).scalars().all()
+    for index in table.indexes:
+        if 'garage_id' not in index.columns:
+            continue
+        if index.unique and 'normalized_plate' in index.columns and duplicates:
+            print(f"Not enforcing one active ticket per plate; plates parked twice: {', '.join(duplicates[:10])}")
+            continue
+        index.create(connection, checkfirst=True)
+
+
+def add_ticket_space(connection):
+    """Add the assigned parking space and its one-active-ticket-per-space index."""
+    from models import Ticket
+    for table in ('tickets', 'tickets_archive'):
+        columns = {column['name'] for column in inspect(connection).get_columns(table)}
+        if 'space' not in columns:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN space VARCHAR"))
+    # Existing active tickets keep no space; the allocator counts them
+    # against capacity until they exit
+    for index in Ticket.__table__.indexes:
+        if 'space' in index.columns and 'garage_id' not in index.columns:
+            index.create(connection, checkfirst=True)
+
+
+def add_garage_id(connection):
+    """Scope tickets, settings and rollups to a garage; existing rows go to garage 1."""
+    from models import ArchivedTicket, GarageSetting, Ticket, HourlyRollup, DailyRollup
+    added = set()
+    for table in ('tickets', 'tickets_archive', 'garage_settings'):
+        columns = {column['name'] for column in inspect(connection).get_columns(table)}
+        if 'garage_id' not in columns:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN garage_id INTEGER NOT NULL DEFAULT 1"))
+            added.add(table)
+    # Replaced by the per-garage indexes
+    for name in ('ix_tickets_entry_time_id', 'ix_tickets_active_entry_time',
+                 'ix_tickets_normalized_plate_entry_time', 'ux_tickets_active_plate', 'ux_tickets_active_space',
+                 'ix_tickets_archive_entry_time_id', 'ix_tickets_archive_normalized_plate_entry_time'):
+        connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    for model in (Ticket, ArchivedTicket, GarageSetting):
+        _create_garage_indexes(connection, model.__table__)
+
+    # The garage is part of the rollups' primary key, which cannot be
+    # altered in place; they only hold derived counts, so rebuild them
+    columns = {column['name'] for column in inspect(connection).get_columns('rollups_daily')}
+    if 'garage_id' not in columns:
+        for model in (HourlyRollup, DailyRollup):
+            model.__table__.drop(connection)
+            model.__table__.create(connection)
+    if 'garage_id' not in columns or 'tickets' in added:
+        backfill_rollups(connection)
+
+
+# (version, name, function) in the order they must be applied
+MIGRATIONS = [
+    (1, 'create_ticket_indexes', create_ticket_indexes),
+    (2, 'add_garage_settings_version', add_garage_settings_version),
+    (3, 'backfill_rollups', backfill_rollups),
+    (4, 'add_normalized_plate', add_normalized_plate),
+    (5, 'add_ticket_space', add_ticket_space),
+    (6, 'add_garage_id', add_garage_id),
+]
+
+
+def run_migrations(engine):
+    """Apply all pending migrations; returns the names of those applied."""
+    migration_metadata.create_all(bind=engine)
+    applied = []
+    with engine.begin() as connection:
+        done = set(connection.execute(select(schema_migrations.c.version)).scalars())
+        for version, name, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            migrate(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=version, name=name, applied_at=datetime.now()
+            ))
+            applied.append(name)
+    return applied
+
+
+if __name__ == '__main__':
+    from database import each_database, init_db
+    for engine in each_database():
+        applied = init_db(engine)
+        print(f"{engine.url.render_as_string()}: "
+              + (f"applied migrations: {', '.join(applied)}" if applied else "database schema is up to date"))
@@ -1,8 +1,15 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Index, literal_column, text
 from sqlalchemy.ext.declarative import declarative_base
-from database import Base
+from database import Base, DEFAULT_GARAGE_ID
 from datetime import datetime
 
+def normalize_plate(plate):
+    """Canonical form of a license plate for lookups: 'ab-123 c' -> 'AB123C'."""
+    return ''.join(char for char in plate.upper() if char.isalnum())
+
+def _default_normalized_plate(context):
+    return normalize_plate(context.get_current_parameters()['license_plate'])
+
 class User(Base):
     __tablename__ = 'users'
     
@@ -16,12 +23,13 @@ class User(Base):
             'username': self.username
         }
 
-class Ticket(Base):
-    __tablename__ = 'tickets'
-    
+class TicketColumns:
+    """Columns shared by the live tickets table and its archive."""
     id = Column(Integer, primary_key=True)
+    garage_id = Column(Integer, nullable=False, default=DEFAULT_GARAGE_ID, server_default='1')
     ticket_number = Column(String, unique=True, nullable=False)
     license_plate = Column(String, nullable=False)
+    normalized_plate = Column(String, nullable=True, default=_default_normalized_plate)  # see normalize_plate
     vehicle_type = Column(String, nullable=False)
     entry_time = Column(DateTime, nullable=False, default=datetime.now)
     exit_time = Column(DateTime, nullable=True)
@@ -29,10 +37,12 @@ class Ticket(Base):
     amount_paid = Column(Integer, nullable=True)  # stored in cents
     status = Column(String, nullable=False)  # 'active' or 'completed'
     payment_method = Column(String, nullable=True)
+    space = Column(String, nullable=True)  # assigned parking space, see spaces.py
     
     def to_dict(self):
         return {
             'id': self.id,
+            'garageId': self.garage_id,
             'ticketNumber': self.ticket_number,
             'licensePlate': self.license_plate,
             'vehicleType': self.vehicle_type,
@@ -41,19 +51,95 @@ class Ticket(Base):
             'durationMinutes': self.duration_minutes,
             'amountPaid': self.amount_paid,
             'status': self.status,
-            'paymentMethod': self.payment_method
+            'paymentMethod': self.payment_method,
+            'space': self.space
         }
 
+class Ticket(TicketColumns, Base):
+    __tablename__ = 'tickets'
+    __table_args__ = (
+        # Recent activity feed of a garage (ORDER BY entry_time DESC)
+        Index('ix_tickets_garage_entry_time_id', 'garage_id', 'entry_time', 'id'),
+        Index('ix_tickets_license_plate', 'license_plate'),
+        # Partial indexes for the stats queries; only the matching rows are indexed
+        Index('ix_tickets_active_garage_entry_time', 'garage_id', 'entry_time',
+              postgresql_where=text("status = 'active'"),
+              sqlite_where=text("status = 'active'")),
+        Index('ix_tickets_completed_exit_time', 'exit_time', 'amount_paid',
+              postgresql_where=text("status = 'completed'"),
+              sqlite_where=text("status = 'completed'")),
+        # Covering index for the average stay; most rows are completed, so a
+        # partial index would still be planned as a full scan
+        Index('ix_tickets_status_duration', 'status', 'duration_minutes'),
+        # Plate search (exact and prefix), newest first within a plate
+        Index('ix_tickets_garage_plate_entry_time', 'garage_id', 'normalized_plate', 'entry_time'),
+        # At most one active ticket per plate in a garage
+        Index('ux_tickets_active_garage_plate', 'garage_id', 'normalized_plate', unique=True,
+              postgresql_where=text("status = 'active'"),
+              sqlite_where=text("status = 'active'")),
+        # At most one active ticket per space, across workers
+        Index('ux_tickets_active_garage_space', 'garage_id', 'space', unique=True,
+              postgresql_where=text("status = 'active'"),
+              sqlite_where=text("status = 'active'")),
+    )
+
+class ArchivedTicket(TicketColumns, Base):
+    """A completed ticket moved out of the live table (see archive.py)."""
+    __tablename__ = 'tickets_archive'
+    __table_args__ = (
+        Index('ix_tickets_archive_garage_entry_time_id', 'garage_id', 'entry_time', 'id'),
+        Index('ix_tickets_archive_garage_plate_entry_time', 'garage_id', 'normalized_plate', 'entry_time'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)  # kept from the live table
+
+# Status filters use inline literals rather than bound parameters so the query
+# planner (SQLite, and Postgres generic plans) can match the partial indexes
+TICKET_IS_ACTIVE = Ticket.status == literal_column("'active'")
+TICKET_IS_COMPLETED = Ticket.status == literal_column("'completed'")
+
 class GarageSetting(Base):
     __tablename__ = 'garage_settings'
+    __table_args__ = (
+        # One settings row per garage; a garage exists once it has one
+        Index('ux_garage_settings_garage_id', 'garage_id', unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
+    garage_id = Column(Integer, nullable=False, default=DEFAULT_GARAGE_ID, server_default='1')
     total_spaces = Column(Integer, nullable=False)
     hourly_rate = Column(Integer, nullable=False)  # stored in cents
+    version = Column(Integer, nullable=False, default=1, server_default='1')  # bumped on every update
     
     def to_dict(self):
         return {
             'id': self.id,
+            'garageId': self.garage_id,
             'totalSpaces': self.total_spaces,
-            'hourlyRate': self.hourly_rate
-        }
\ No newline at end of file
+            'hourlyRate': self.hourly_rate,
+            'version': self.version
+        }
+
+class TicketSequence(Base):
+    __tablename__ = 'ticket_sequences'
+    
+    name = Column(String, primary_key=True)
+    next_value = Column(BigInteger, nullable=False)  # first number not yet handed out
+
+class RollupColumns:
+    """Counters shared by the hourly and daily rollup tables."""
+    garage_id = Column(Integer, primary_key=True, default=DEFAULT_GARAGE_ID)
+    bucket_start = Column(DateTime, primary_key=True)
+    vehicle_type = Column(String, primary_key=True)
+    payment_method = Column(String, primary_key=True)  # '' for entries
+    entries = Column(Integer, nullable=False, default=0)
+    exits = Column(Integer, nullable=False, default=0)
+    revenue = Column(BigInteger, nullable=False, default=0)  # stored in cents
+    duration_sum = Column(BigInteger, nullable=False, default=0)  # minutes
+    duration_count = Column(Integer, nullable=False, default=0)
+
+class HourlyRollup(RollupColumns, Base):
+    __tablename__ = 'rollups_hourly'
+
+class DailyRollup(RollupColumns, Base):
+    __tablename__ = 'rollups_daily'
@@ -0,0 +1,188 @@
+"""License plate lookups.
+
+Plates are compared in normalized form (see `models.normalize_plate`).
+Exact and prefix searches run against the (normalized_plate, entry_time)
+index. `PlateIndex` keeps, per worker and garage, the plates currently
+parked (plate -> ticket number), used to reject a second entry for the same
+vehicle without a query, and a trigram index over every plate seen for fuzzy
+search.
+"""
+import asyncio
+import os
+import time
+from array import array
+from sqlalchemy import and_, desc, func, select
+from models import Ticket, DEFAULT_GARAGE_ID, TICKET_IS_ACTIVE
+
+# Largest result list served by GET /api/tickets/search
+PLATE_SEARCH_MAX_LIMIT = 100
+# Minimum trigram similarity (0-1) for a fuzzy match
+PLATE_FUZZY_THRESHOLD = float(os.getenv('PLATE_FUZZY_THRESHOLD', 0.3))
+# Seconds between reloads, picking up plates entered through other workers
+# (0 only reloads on restart)
+PLATE_INDEX_RELOAD_SECONDS = float(os.getenv('PLATE_INDEX_RELOAD_SECONDS', 300))
+
+
+def trigrams(plate):
+    """Trigrams of a normalized plate, padded like Postgres pg_trgm."""
+    padded = f'  {plate} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def prefix_upper_bound(prefix):
+    """Smallest string greater than every string starting with `prefix`."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def plate_search_query(plate, match='exact', active_only=False, garage_id=DEFAULT_GARAGE_ID):
+    """A garage's tickets whose normalized plate equals (or starts with) `plate`."""
+    query = select(Ticket).where(Ticket.garage_id == garage_id)
+    if match == 'prefix':
+        # A range on the index instead of LIKE, which SQLite and non-C
+        # collations on Postgres cannot answer from a b-tree
+        query = query.where(
+            Ticket.normalized_plate >= plate,
+            Ticket.normalized_plate < prefix_upper_bound(plate)
+        )
+    else:
+        query = query.where(Ticket.normalized_plate == plate)
+    if active_only:
+        query = query.where(TICKET_IS_ACTIVE)
+    # Both descending so the index is scanned backwards instead of sorting
+    return query.order_by(desc(Ticket.normalized_plate), desc(Ticket.entry_time))
+
+
+def latest_tickets_query(plates, active_only=False, garage_id=DEFAULT_GARAGE_ID):
+    """The most recent ticket for each of `plates`, one index probe per plate."""
+    latest = select(
+        Ticket.normalized_plate, func.max(Ticket.entry_time).label('entry_time')
+    ).where(Ticket.garage_id == garage_id, Ticket.normalized_plate.in_(plates))
+    if active_only:
+        latest = latest.where(TICKET_IS_ACTIVE)
+    latest = latest.group_by(Ticket.normalized_plate).subquery()
+    query = select(Ticket).join(latest, and_(
+        Ticket.garage_id == garage_id,
+        Ticket.normalized_plate == latest.c.normalized_plate,
+        Ticket.entry_time == latest.c.entry_time
+    ))
+    if active_only:
+        query = query.where(TICKET_IS_ACTIVE)
+    return query
+
+
+class PlateIndex:
+    """Per-worker plate state of a garage: who is parked, and trigram postings for fuzzy search."""
+
+    def __init__(self, garage_id=DEFAULT_GARAGE_ID, fuzzy_threshold=PLATE_FUZZY_THRESHOLD,
+                 reload_seconds=PLATE_INDEX_RELOAD_SECONDS):
+        self.garage_id = garage_id
+        self.fuzzy_threshold = fuzzy_threshold
+        self.reload_seconds = reload_seconds
+        self.loaded = False
+        self.last_loaded = 0.0
+        self.active = {}  # normalized plate -> ticket number
+        self._plate_ids = {}
+        self._plates = []
+        self._sizes = array('H')  # trigram count per plate id
+        self._postings = {}  # trigram -> array of plate ids
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._plates)
+
+    async def load(self, session):
+        """(Re)build the index from the database."""
+        active = dict((await session.execute(
+            select(Ticket.normalized_plate, Ticket.ticket_number)
+            .where(Ticket.garage_id == self.garage_id, TICKET_IS_ACTIVE)
+        )).all())
+        plates = (await session.execute(
+            select(Ticket.normalized_plate).distinct()
+            .where(Ticket.garage_id == self.garage_id, Ticket.normalized_plate.is_not(None))
+        )).scalars().all()
+
+        self._plate_ids, self._plates, self._sizes, self._postings = {}, [], array('H'), {}
+        for plate in plates:
+            self.add_plate(plate)
+        self.active = active
+        self.loaded = True
+        self.last_loaded = time.monotonic()
+
+    def _stale(self):
+        if not self.loaded:
+            return True
+        return self.reload_seconds > 0 and time.monotonic() - self.last_loaded >= self.reload_seconds
+
+    async def ensure_loaded(self, session):
+        """Load the index if it is missing or due for a reload."""
+        if self._stale():
+            async with self._lock:
+                if self._stale():
+                    await self.load(session)
+
+    def add_plate(self, plate):
+        if plate in self._plate_ids:
+            return
+        plate_id = len(self._plates)
+        self._plate_ids[plate] = plate_id
+        self._plates.append(plate)
+        plate_trigrams = trigrams(plate)
+        self._sizes.append(len(plate_trigrams))
+        for trigram in plate_trigrams:
+            postings = self._postings.get(trigram)
+            if postings is None:
+                postings = self._postings[trigram] = array('I')
+            postings.append(plate_id)
+
+    def record_entry(self, plate, ticket_number):
+        self.active[plate] = ticket_number
+        self.add_plate(plate)
+
+    def record_exit(self, plate):
+        self.active.pop(plate, None)
+
+    async def parked_ticket(self, session, plate):
+        """Ticket number of the active ticket for `plate`, if any.
+
+        The map is only a hint: another worker may have processed the exit,
+        so a hit is confirmed by looking the ticket up. Entries made by other
+        workers are caught by the unique index on active plates instead.
+        """
+        ticket_number = self.active.get(plate)
+        if ticket_number is None:
+            return None
+        status = (await session.execute(
+            select(Ticket.status).filter_by(ticket_number=ticket_number)
+        )).scalar()
+        if status == 'active':
+            return ticket_number
+        self.active.pop(plate, None)
+        return None
+
+    def fuzzy(self, plate, limit):
+        """The `limit` known plates most similar to `plate`, as (similarity, plate)."""
+        import numpy as np
+        query_trigrams = trigrams(plate)
+        postings = [
+            np.frombuffer(self._postings[trigram], dtype=np.uint32)
+            for trigram in query_trigrams if trigram in self._postings
+        ]
+        if not postings:
+            return []
+
+        # Shared trigram counts for every plate at once; similarity is
+        # shared / union, as in pg_trgm
+        shared = np.bincount(np.concatenate(postings), minlength=len(self._plates))
+        sizes = np.frombuffer(self._sizes, dtype=np.uint16)
+        similarity = shared / (len(query_trigrams) + sizes - shared)
+        candidates = np.flatnonzero(similarity >= self.fuzzy_threshold)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-similarity[candidates], limit - 1)[:limit]]
+        return sorted(
+            ((float(similarity[plate_id]), self._plates[plate_id]) for plate_id in candidates),
+            reverse=True
+        )
+
+
+# Index of the default garage in this worker process (see garages.py)
+plate_index = PlateIndex()
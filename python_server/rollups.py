@@ -0,0 +1,202 @@
+"""Hourly and daily rollups of ticket activity.
+
+The rollup tables hold entries, exits, revenue and stay durations per garage,
+time bucket, vehicle type and payment method. They are updated in the same
+transaction as every entry and exit, so reports and stats can read a few
+small rows instead of aggregating the tickets table.
+
+`record_entries` and `record_exits` only queue their increments on the
+session; they are applied as one upsert per table when the session commits
+(and dropped when it rolls back). The request's own statements therefore
+run without touching the rollups, and the current hour's and day's rows,
+which every entry and exit of a garage updates, are locked (on Postgres) or
+written (on SQLite, one writer at a time) only for the commit itself.
+Increments are applied in key order, so two transactions touching the same
+rows always lock them in the same order and cannot deadlock.
+
+    python rollups.py backfill
+"""
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import case, delete, event, func, literal, literal_column, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import ArchivedTicket, Ticket, HourlyRollup, DailyRollup, DEFAULT_GARAGE_ID
+
+ROLLUPS = {'hourly': HourlyRollup, 'daily': DailyRollup}
+COUNTERS = ('entries', 'exits', 'revenue', 'duration_sum', 'duration_count')
+# Session.info key of the increments waiting for the session's commit
+PENDING_KEY = 'rollup_increments'
+
+
+def bucket_start(moment, period):
+    """Start of the hour or day that `moment` falls in."""
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if period == 'daily' else moment
+
+
+def _upsert(dialect_name, model):
+    dialect_insert = postgresql.insert if dialect_name == 'postgresql' else sqlite.insert
+    statement = dialect_insert(model)
+    return statement.on_conflict_do_update(
+        index_elements=['garage_id', 'bucket_start', 'vehicle_type', 'payment_method'],
+        set_={name: getattr(model, name) + getattr(statement.excluded, name) for name in COUNTERS}
+    )
+
+
+def _apply(session, increments):
+    """Add counter increments keyed by (period, garage, bucket, vehicle_type, payment_method)."""
+    dialect_name = session.bind.dialect.name
+    by_period = defaultdict(list)
+    # Sorted so concurrent transactions take the row locks in the same order
+    for (period, garage_id, bucket, vehicle_type, payment_method), counters in sorted(increments.items()):
+        by_period[period].append({
+            'garage_id': garage_id,
+            'bucket_start': bucket,
+            'vehicle_type': vehicle_type,
+            'payment_method': payment_method,
+            **{name: counters.get(name, 0) for name in COUNTERS}
+        })
+    for period, rows in sorted(by_period.items()):
+        session.execute(_upsert(dialect_name, ROLLUPS[period]), rows)
+
+
+def _pending(db):
+    return db.info.setdefault(PENDING_KEY, defaultdict(lambda: defaultdict(int)))
+
+
+@event.listens_for(Session, 'before_commit')
+def _apply_pending(session):
+    increments = session.info.pop(PENDING_KEY, None)
+    if increments:
+        _apply(session, increments)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _drop_pending(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+
+def record_entries(db, tickets):
+    """Count new tickets in the rollups when `db` commits."""
+    increments = _pending(db)
+    for ticket in tickets:
+        for period in ROLLUPS:
+            key = (period, ticket.garage_id or DEFAULT_GARAGE_ID, bucket_start(ticket.entry_time, period),
+                   ticket.vehicle_type, '')
+            increments[key]['entries'] += 1
+
+
+def record_exits(db, tickets):
+    """Count completed tickets in the rollups when `db` commits."""
+    increments = _pending(db)
+    for ticket in tickets:
+        for period in ROLLUPS:
+            key = (period, ticket.garage_id or DEFAULT_GARAGE_ID, bucket_start(ticket.exit_time, period),
+                   ticket.vehicle_type, ticket.payment_method or '')
+            counters = increments[key]
+            counters['exits'] += 1
+            counters['revenue'] += ticket.amount_paid or 0
+            if ticket.duration_minutes is not None:
+                counters['duration_sum'] += ticket.duration_minutes
+                counters['duration_count'] += 1
+
+
+def report_query(period, start=None, end=None, group_by=None, garage_id=DEFAULT_GARAGE_ID):
+    """A garage's rollup totals per bucket, optionally split by vehicleType or paymentMethod."""
+    model = ROLLUPS[period]
+    columns = [model.bucket_start]
+    if group_by == 'vehicleType':
+        columns.append(model.vehicle_type)
+    elif group_by == 'paymentMethod':
+        columns.append(model.payment_method)
+    query = select(
+        *columns,
+        *(func.sum(getattr(model, name)).label(name) for name in COUNTERS)
+    ).where(model.garage_id == garage_id).group_by(*columns).order_by(*columns)
+    if start is not None:
+        query = query.where(model.bucket_start >= bucket_start(start, period))
+    if end is not None:
+        query = query.where(model.bucket_start < end)
+    return query
+
+
+def report_row_to_dict(row):
+    return {
+        'bucketStart': row.bucket_start,
+        'vehicleType': getattr(row, 'vehicle_type', None),
+        'paymentMethod': getattr(row, 'payment_method', None) or None,
+        'entries': row.entries,
+        'exits': row.exits,
+        'revenue': row.revenue / 100,  # Convert to dollars
+        'averageStayMinutes': round(row.duration_sum / row.duration_count, 1) if row.duration_count else None
+    }
+
+
+def _truncate(column, period, dialect_name):
+    # Bucket a timestamp in SQL; SQLite buckets must match how SQLAlchemy
+    # stores DateTime values so incremental upserts hit the same rows
+    if dialect_name == 'postgresql':
+        return func.date_trunc('day' if period == 'daily' else 'hour', column)
+    fmt = '%Y-%m-%d 00:00:00.000000' if period == 'daily' else '%Y-%m-%d %H:00:00.000000'
+    return func.strftime(fmt, column)
+
+
+def backfill(connection, sources=(Ticket, ArchivedTicket)):
+    """Rebuild both rollup tables from live and archived tickets with INSERT ... SELECT."""
+    dialect_name = connection.dialect.name
+    for period, model in ROLLUPS.items():
+        parts = []
+        for source in sources:
+            entry_bucket = _truncate(source.entry_time, period, dialect_name)
+            parts.append(select(
+                source.garage_id.label('garage_id'),
+                entry_bucket.label('bucket_start'),
+                source.vehicle_type.label('vehicle_type'),
+                literal('').label('payment_method'),
+                literal(1).label('entries'),
+                literal(0).label('exits'),
+                literal(0).label('revenue'),
+                literal(0).label('duration_sum'),
+                literal(0).label('duration_count'),
+            ))
+            exit_bucket = _truncate(source.exit_time, period, dialect_name)
+            parts.append(select(
+                source.garage_id,
+                exit_bucket,
+                source.vehicle_type,
+                func.coalesce(source.payment_method, ''),
+                literal(0),
+                literal(1),
+                func.coalesce(source.amount_paid, 0),
+                func.coalesce(source.duration_minutes, 0),
+                case((source.duration_minutes.is_not(None), 1), else_=0),
+            ).where(source.status == literal_column("'completed'")))
+        events = union_all(*parts).subquery()
+        connection.execute(delete(model))
+        connection.execute(model.__table__.insert().from_select(
+            ['garage_id', 'bucket_start', 'vehicle_type', 'payment_method', *COUNTERS],
+            select(
+                events.c.garage_id,
+                events.c.bucket_start,
+                events.c.vehicle_type,
+                events.c.payment_method,
+                *(func.sum(events.c[name]) for name in COUNTERS)
+            ).group_by(events.c.garage_id, events.c.bucket_start, events.c.vehicle_type, events.c.payment_method)
+        ))
+
+
+if __name__ == '__main__':
+    import sys
+    from database import each_database, init_db
+
+    if sys.argv[1:] != ['backfill']:
+        print("usage: python rollups.py backfill")
+        sys.exit(2)
+
+    started = datetime.now()
+    for engine in each_database():
+        init_db(engine)
+        with engine.begin() as connection:
+            backfill(connection)
+    print(f"Rollups rebuilt in {(datetime.now() - started).total_seconds():.1f}s")
@@ -1,7 +1,107 @@
-import uvicorn
+"""Start the FastAPI server.
+
+    python run.py                                   # development: one process with auto-reload
+    python run.py --production                      # WEB_CONCURRENCY uvicorn workers
+    python run.py --production --server gunicorn    # gunicorn managing uvicorn workers
+
+In production mode the database is prepared once (tables, migrations,
+default settings) before any worker starts, the event loop and HTTP parser
+are uvloop and httptools when installed, and SIGTERM drains in-flight
+requests for up to GRACEFUL_TIMEOUT seconds before the workers exit.
+"""
+import argparse
+import importlib.util
 import os
+import uvicorn
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Defaults for production mode, overridable on the command line
+SERVER_MODE = os.getenv('SERVER_MODE', 'development')
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', os.cpu_count() or 1))
+GRACEFUL_TIMEOUT = int(os.getenv('GRACEFUL_TIMEOUT', 30))
+# gunicorn restarts a worker that stops heartbeating for this many seconds
+WORKER_TIMEOUT = int(os.getenv('WORKER_TIMEOUT', 60))
+# Recycle each worker after this many requests (0 disables)
+MAX_REQUESTS = int(os.getenv('MAX_REQUESTS', 0))
+
+
+def installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def prepare():
+    """Run the one-time database setup and tell the workers it is done."""
+    from database import DB_PREPARED_ENV, DB_SKIP_SCHEMA_CHECK, get_engine, prepare_database
+
+    if DB_SKIP_SCHEMA_CHECK:
+        return
+    applied = prepare_database()
+    if applied:
+        print(f"Applied migrations: {', '.join(applied)}")
+    # Workers open their own connections
+    get_engine().dispose()
+    os.environ[DB_PREPARED_ENV] = '1'
+
+
+def run_uvicorn(host, port, workers):
+    uvicorn.run(
+        "app:app",
+        host=host,
+        port=port,
+        app_dir=SERVER_DIR,
+        workers=workers,
+        loop='uvloop' if installed('uvloop') else 'asyncio',
+        http='httptools' if installed('httptools') else 'h11',
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        limit_max_requests=MAX_REQUESTS or None,
+        proxy_headers=True,
+    )
+
+
+def run_gunicorn(host, port, workers):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('worker_class', 'uvicorn.workers.UvicornWorker')
+            self.cfg.set('graceful_timeout', GRACEFUL_TIMEOUT)
+            self.cfg.set('timeout', WORKER_TIMEOUT)
+            self.cfg.set('max_requests', MAX_REQUESTS)
+            self.cfg.set('max_requests_jitter', MAX_REQUESTS // 10)
+
+        def load(self):
+            from app import app
+            return app
+
+    Server().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start the parking garage API server.")
+    parser.add_argument('--production', action='store_true', default=SERVER_MODE == 'production',
+                        help='multiple workers, no reload (default from SERVER_MODE)')
+    parser.add_argument('--workers', type=int, default=WEB_CONCURRENCY)
+    parser.add_argument('--server', choices=['uvicorn', 'gunicorn'], default=os.getenv('SERVER', 'uvicorn'))
+    args = parser.parse_args()
 
-if __name__ == '__main__':
     host = os.getenv('HOST', '0.0.0.0')
     port = int(os.getenv('PORT', 5001))  # Using 5001 to avoid conflict with existing server
-    uvicorn.run("app:app", host=host, port=port, reload=True)
\ No newline at end of file
+    # Static files and .env are resolved relative to the server directory
+    os.chdir(SERVER_DIR)
+
+    if not args.production:
+        uvicorn.run("app:app", host=host, port=port, app_dir=SERVER_DIR, reload=True)
+        return
+
+    prepare()
+    if args.server == 'gunicorn':
+        run_gunicorn(host, port, args.workers)
+    else:
+        run_uvicorn(host, port, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,30 +3,92 @@ import sys
 import subprocess
 import signal
 import time
+import urllib.request
+
+# Seconds between health checks of the running server
+HEALTH_INTERVAL = float(os.getenv('HEALTH_INTERVAL', 10))
+# Consecutive failed checks before the server is restarted
+HEALTH_FAILURES = int(os.getenv('HEALTH_FAILURES', 3))
+# Seconds a freshly started server gets before it is checked
+STARTUP_GRACE = float(os.getenv('STARTUP_GRACE', 30))
+# Seconds to wait for in-flight requests to drain on shutdown
+GRACEFUL_TIMEOUT = int(os.getenv('GRACEFUL_TIMEOUT', 30))
+
+HEALTH_URL = f"http://127.0.0.1:{os.getenv('PORT', 5001)}/api/status"
+
+stopping = False
+
 
 def start_server():
-    """Start the Flask server."""
-    print("Starting Flask server...")
-    return subprocess.Popen(['python', 'run.py'], cwd='python_server')
+    """Start the FastAPI server, passing through any launcher arguments."""
+    print("Starting FastAPI server...")
+    server_dir = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.Popen([sys.executable, 'run.py', *sys.argv[1:]], cwd=server_dir)
+
+
+def stop_server(server_process):
+    """Ask the server to drain, killing it if it does not exit in time."""
+    if server_process.poll() is not None:
+        return
+    print("Stopping FastAPI server...")
+    server_process.send_signal(signal.SIGTERM)
+    try:
+        server_process.wait(timeout=GRACEFUL_TIMEOUT + 5)
+    except subprocess.TimeoutExpired:
+        print("Server did not stop in time, killing it")
+        server_process.kill()
+        server_process.wait()
+
+
+def healthy():
+    try:
+        with urllib.request.urlopen(HEALTH_URL, timeout=5) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def handle_sigterm(signum, frame):
+    global stopping
+    stopping = True
+
 
 def main():
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
     # Start the server
     server_process = start_server()
-    
+    started = time.monotonic()
+    failures = 0
+    next_check = started + STARTUP_GRACE
+
     try:
-        # Keep the main process running
-        while True:
+        # Keep the server running, restarting it if it exits or stops answering
+        while not stopping:
             time.sleep(1)
+            if server_process.poll() is not None:
+                print(f"Server exited with code {server_process.returncode}, restarting...")
+            elif time.monotonic() >= next_check:
+                next_check = time.monotonic() + HEALTH_INTERVAL
+                failures = 0 if healthy() else failures + 1
+                if failures < HEALTH_FAILURES:
+                    continue
+                print(f"Server failed {failures} health checks, restarting...")
+                stop_server(server_process)
+            else:
+                continue
+
+            server_process = start_server()
+            failures = 0
+            next_check = time.monotonic() + STARTUP_GRACE
     except KeyboardInterrupt:
         print("\nReceived keyboard interrupt. Shutting down...")
     finally:
         # Clean up
         if server_process:
-            print("Stopping Flask server...")
-            server_process.send_signal(signal.SIGTERM)
-            server_process.wait()
-        
+            stop_server(server_process)
+
         print("Server shutdown complete")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -7,7 +7,8 @@ class TicketCreate(BaseModel):
     vehicleType: str
 
 class TicketResponse(BaseModel):
-    id: int
+    id: Optional[int] = None  # null until a write-behind entry is flushed
+    garageId: int
     ticketNumber: str
     licensePlate: str
     vehicleType: str
@@ -17,10 +18,35 @@ class TicketResponse(BaseModel):
     amountPaid: Optional[int] = None
     status: str
     paymentMethod: Optional[str] = None
+    space: Optional[str] = None
 
 class ExitRequest(BaseModel):
     paymentMethod: str
 
+# Upper bound on the number of items in one batch request
+BATCH_MAX_ITEMS = 1000
+
+class BatchTicketCreate(BaseModel):
+    tickets: List[TicketCreate] = Field(min_length=1, max_length=BATCH_MAX_ITEMS)
+
+class BatchExitItem(BaseModel):
+    ticketNumber: str
+    paymentMethod: str
+
+class BatchExitRequest(BaseModel):
+    exits: List[BatchExitItem] = Field(min_length=1, max_length=BATCH_MAX_ITEMS)
+
+class BatchItemResult(BaseModel):
+    index: int
+    success: bool
+    ticket: Optional[TicketResponse] = None
+    message: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    results: List[BatchItemResult]
+    succeeded: int
+    failed: int
+
 class ActivityResponse(BaseModel):
     id: int
     ticketNumber: str
@@ -42,6 +68,72 @@ class GarageStatsResponse(BaseModel):
     vehiclesProcessedToday: int
     averageStayTime: float
 
+class GarageSettingsUpdate(BaseModel):
+    totalSpaces: Optional[int] = Field(default=None, gt=0)
+    hourlyRate: Optional[int] = Field(default=None, ge=0)  # cents
+
+class GarageSettingsResponse(BaseModel):
+    id: int
+    garageId: int
+    totalSpaces: int
+    hourlyRate: int  # cents
+    version: int
+
+class SpaceSectionResponse(BaseModel):
+    zone: str
+    level: int
+    spaces: int
+    vehicleTypes: Optional[List[str]] = None
+    free: int
+
+class ReportRow(BaseModel):
+    bucketStart: datetime
+    vehicleType: Optional[str] = None
+    paymentMethod: Optional[str] = None
+    entries: int
+    exits: int
+    revenue: float
+    averageStayMinutes: Optional[float] = None
+
+class OccupancyBucket(BaseModel):
+    bucketStart: datetime
+    averageOccupancy: float
+    peakOccupancy: int
+    entries: int
+    exits: int
+
+class DwellBin(BaseModel):
+    minMinutes: int
+    maxMinutes: Optional[int] = None  # None for the open last bin
+    count: int
+
+class DwellSummary(BaseModel):
+    count: int
+    averageMinutes: Optional[float] = None
+    p50Minutes: Optional[float] = None
+    p90Minutes: Optional[float] = None
+    histogram: List[DwellBin]
+
+class OccupancyHeatmap(BaseModel):
+    # 7 rows (Monday first) of 24 hours; None where the window has no such hour
+    averageOccupancy: List[List[Optional[float]]]
+    averageEntries: List[List[Optional[float]]]
+
+class ForecastHour(BaseModel):
+    hourStart: datetime
+    averageOccupancy: Optional[float] = None
+    weeks: int  # past weeks averaged into this hour
+
+class AnalyticsResponse(BaseModel):
+    start: datetime
+    end: datetime
+    bucketMinutes: int
+    stays: int
+    occupancy: List[OccupancyBucket]
+    dwell: DwellSummary
+    heatmap: OccupancyHeatmap
+    forecast: List[ForecastHour]
+
 class StatusResponse(BaseModel):
     status: str = "ok"
 
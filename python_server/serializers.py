@@ -0,0 +1,51 @@
+"""Fast JSON responses for the hot endpoints.
+
+Handlers on the ticket, activity and stats routes already build their
+payloads as plain JSON-ready dicts (datetimes as ISO strings, amounts in the
+documented units). Returning them through `FastJSONResponse` skips FastAPI's
+response-model pass, which would parse those strings back into datetimes,
+validate every field and encode them again. The `response_model` on each
+route still documents the schema; `benchmarks/bench_serialization.py` checks
+the two paths produce the same bytes.
+
+orjson is used when installed, with the standard library as a fallback.
+"""
+import json
+import time
+from starlette.responses import Response
+import metrics
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+def dumps(content):
+    """Encode content exactly like Starlette's JSONResponse, as bytes."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONResponse(Response):
+    """JSON response for payloads that are already JSON-ready dicts and lists."""
+
+    media_type = 'application/json'
+
+    def render(self, content):
+        started = time.perf_counter()
+        body = dumps(content)
+        metrics.record_serialization(time.perf_counter() - started)
+        return body
+
+
+def batch_result(index, ticket=None, message=None):
+    """One entry of a BatchResponse, with every field present."""
+    return {
+        'index': index,
+        'success': ticket is not None,
+        'ticket': ticket.to_dict() if ticket is not None else None,
+        'message': message
+    }
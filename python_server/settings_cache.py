@@ -0,0 +1,90 @@
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+from sqlalchemy import select
+from models import GarageSetting, DEFAULT_GARAGE_ID
+
+# Seconds a cached snapshot is trusted before its version is re-checked
+# against the database (0 keeps it until it is invalidated)
+SETTINGS_CACHE_TTL = float(os.getenv('SETTINGS_CACHE_TTL', 30))
+
+
+@dataclass(frozen=True)
+class SettingsSnapshot:
+    """Immutable copy of the garage settings row."""
+    id: int
+    garage_id: int
+    total_spaces: int
+    hourly_rate: int  # cents
+    version: int
+
+    @classmethod
+    def from_model(cls, settings):
+        return cls(
+            id=settings.id,
+            garage_id=settings.garage_id,
+            total_spaces=settings.total_spaces,
+            hourly_rate=settings.hourly_rate,
+            version=settings.version,
+        )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'garageId': self.garage_id,
+            'totalSpaces': self.total_spaces,
+            'hourlyRate': self.hourly_rate,
+            'version': self.version
+        }
+
+
+class SettingsCache:
+    """Per-worker cache of one garage's settings.
+
+    Handlers get an immutable snapshot without querying the database. Once the
+    TTL expires the cache only compares the row's version stamp, and reloads
+    the row when another worker has updated it.
+    """
+
+    def __init__(self, garage_id=DEFAULT_GARAGE_ID, ttl=SETTINGS_CACHE_TTL):
+        self.garage_id = garage_id
+        self.ttl = ttl
+        self._snapshot = None
+        self._checked_at = 0.0
+
+    def _fresh(self):
+        return self.ttl <= 0 or time.monotonic() - self._checked_at < self.ttl
+
+    async def get(self, session) -> Optional[SettingsSnapshot]:
+        """Return the current settings, hitting the database only when stale."""
+        snapshot = self._snapshot
+        if snapshot is not None and self._fresh():
+            return snapshot
+
+        if snapshot is not None:
+            version = (await session.execute(
+                select(GarageSetting.version).where(GarageSetting.id == snapshot.id)
+            )).scalar()
+            if version == snapshot.version:
+                self._checked_at = time.monotonic()
+                return snapshot
+
+        settings = (await session.execute(
+            select(GarageSetting).where(GarageSetting.garage_id == self.garage_id)
+        )).scalar()
+        self.set(SettingsSnapshot.from_model(settings) if settings else None)
+        return self._snapshot
+
+    def set(self, snapshot):
+        """Replace the cached snapshot (e.g. right after this worker updated it)."""
+        self._snapshot = snapshot
+        self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        """Drop the cached snapshot so the next read reloads it."""
+        self._snapshot = None
+
+
+# Settings of the default garage in this worker process (see garages.py)
+settings_cache = SettingsCache()
@@ -0,0 +1,305 @@
+"""Parking space allocation.
+
+The garage is a list of sections, nearest to the entrance first, each a run
+of spaces in one zone and level, optionally reserved for some vehicle types.
+`GARAGE_LAYOUT_FILE` points to a JSON layout such as:
+
+    {"sections": [
+        {"zone": "A", "level": 1, "spaces": 6, "vehicleTypes": ["Motorcycle"]},
+        {"zone": "A", "level": 1, "spaces": 40},
+        {"zone": "B", "level": 2, "spaces": 80, "vehicleTypes": ["Standard Vehicle", "Compact Car", "SUV"]}
+    ]}
+
+A layout file can also describe several garages, keyed by garage id:
+`{"garages": {"1": {"sections": [...]}, "2": {"sections": [...]}}}`. Without
+a layout for it, a garage is one section of `total_spaces` spaces open to
+every vehicle type. Spaces are labelled zone, level and bay (`A1-007`);
+bays are numbered on across the sections of a level.
+
+Each worker keeps a `SpaceAllocator` per garage: a bitset of occupied spaces and, per
+section, a heap of free spaces ordered nearest first, so assigning or
+releasing a space is O(log n). The assigned space is stored on the ticket and
+the allocator is rebuilt from the active tickets at startup; the
+`ux_tickets_active_garage_space` unique index stops two workers from handing out the
+same space. A rebuild keeps the spaces this worker has handed out to entries
+that are not committed yet, so it cannot give them out a second time.
+"""
+import asyncio
+import bisect
+import heapq
+import json
+import os
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import FrozenSet, Optional, Tuple
+from sqlalchemy import select
+from models import Ticket, DEFAULT_GARAGE_ID, TICKET_IS_ACTIVE
+from entry_journal import entry_journal
+
+# Optional JSON file with the garage layout (defaults to `total_spaces` spaces)
+GARAGE_LAYOUT_FILE = os.getenv('GARAGE_LAYOUT_FILE')
+# Seconds between rebuilds from the database, picking up spaces freed through
+# other workers (0 only rebuilds on restart or when the garage looks full)
+SPACE_RELOAD_SECONDS = float(os.getenv('SPACE_RELOAD_SECONDS', 60))
+# Seconds a handed-out space stays taken across rebuilds while its entry is
+# not committed (entries settle their space sooner, once committed)
+SPACE_HOLD_SECONDS = float(os.getenv('SPACE_HOLD_SECONDS', 120))
+
+
+@dataclass(frozen=True)
+class Section:
+    zone: str
+    level: int
+    spaces: int
+    vehicle_types: Optional[FrozenSet[str]] = None  # None accepts every type
+
+    def accepts(self, vehicle_type):
+        return self.vehicle_types is None or vehicle_type in self.vehicle_types
+
+    def label(self, bay):
+        return f"{self.zone}{self.level}-{bay:03d}"
+
+    def to_dict(self):
+        return {
+            'zone': self.zone,
+            'level': self.level,
+            'spaces': self.spaces,
+            'vehicleTypes': sorted(self.vehicle_types) if self.vehicle_types is not None else None
+        }
+
+
+@dataclass(frozen=True)
+class Layout:
+    sections: Tuple[Section, ...]
+
+    @property
+    def total_spaces(self):
+        return sum(section.spaces for section in self.sections)
+
+    @classmethod
+    def from_dict(cls, data):
+        sections = []
+        for item in data['sections']:
+            vehicle_types = item.get('vehicleTypes')
+            sections.append(Section(
+                zone=str(item['zone']),
+                level=int(item.get('level', 1)),
+                spaces=int(item['spaces']),
+                vehicle_types=frozenset(vehicle_types) if vehicle_types is not None else None
+            ))
+        return cls(tuple(sections))
+
+    @classmethod
+    def single(cls, total_spaces):
+        return cls((Section(zone='A', level=1, spaces=total_spaces),))
+
+
+@lru_cache(maxsize=1)
+def _load_layout_file(path):
+    """Garage id -> Layout from a layout file, read once per process."""
+    with open(path) as f:
+        data = json.load(f)
+    if 'garages' in data:
+        return {int(garage_id): Layout.from_dict(layout) for garage_id, layout in data['garages'].items()}
+    # A single-garage layout describes the default garage
+    return {DEFAULT_GARAGE_ID: Layout.from_dict(data)}
+
+
+def layout_for_settings(settings):
+    """The garage layout in force for the given garage settings, and whether it came from the layout file."""
+    if GARAGE_LAYOUT_FILE:
+        layout = _load_layout_file(GARAGE_LAYOUT_FILE).get(settings.garage_id)
+        if layout is not None:
+            return layout, True
+    return Layout.single(settings.total_spaces), False
+
+
+class SpaceAllocator:
+    """Per-worker map of a garage's free and occupied spaces."""
+
+    def __init__(self, garage_id=DEFAULT_GARAGE_ID, reload_seconds=SPACE_RELOAD_SECONDS):
+        self.garage_id = garage_id
+        self.reload_seconds = reload_seconds
+        self.layout = None
+        self.layout_from_file = False
+        self.loaded = False
+        self.last_loaded = 0.0
+        self.unplaced = 0  # active tickets without a space in the layout
+        self._labels = []  # space index (nearest first) -> label
+        self._indexes = {}  # label -> space index
+        self._sections = []  # section index -> (first space index, spaces)
+        self._starts = []  # first space index per section, for bisect
+        self._occupied = bytearray()  # one bit per space
+        self._free = []  # section index -> heap of free space indexes
+        self._free_count = 0
+        self._pools = {}  # vehicle type -> section indexes that accept it
+        self._handed_out = {}  # label -> when it was handed out, until its entry settles
+        self._settled = set()  # labels settled while a rebuild was reading the tickets
+        self._loads = 0  # rebuilds reading the tickets
+        self._lock = asyncio.Lock()
+
+    def _is_occupied(self, index):
+        return self._occupied[index >> 3] & (1 << (index & 7))
+
+    def _configure(self, layout, occupied_labels):
+        labels, sections = [], []
+        last_bay = {}  # bays are numbered on through sections on the same level
+        for section in layout.sections:
+            first = last_bay.get((section.zone, section.level), 0) + 1
+            sections.append((len(labels), section.spaces))
+            labels.extend(section.label(bay) for bay in range(first, first + section.spaces))
+            last_bay[(section.zone, section.level)] = first + section.spaces - 1
+        self._labels = labels
+        self._indexes = {label: index for index, label in enumerate(labels)}
+        self._sections = sections
+        self._starts = [start for start, _ in sections]
+        self._occupied = bytearray((len(labels) + 7) // 8)
+        self._pools = {}
+
+        unplaced = 0
+        for label in occupied_labels:
+            index = self._indexes.get(label)
+            if index is None or self._is_occupied(index):
+                unplaced += 1
+            else:
+                self._occupied[index >> 3] |= 1 << (index & 7)
+
+        # Space indexes are already in nearest-first order, so the free lists
+        # are valid heaps as built
+        self._free = [
+            [index for index in range(start, start + count) if not self._is_occupied(index)]
+            for start, count in sections
+        ]
+        self._free_count = sum(len(free) for free in self._free)
+        self.unplaced = unplaced
+        self.layout = layout
+
+    def _journaled_spaces(self):
+        return {
+            ticket.space for ticket in entry_journal.pending.values()
+            if ticket.garage_id == self.garage_id and ticket.space
+        }
+
+    async def load(self, session, settings):
+        """(Re)build the allocator from the active tickets."""
+        # Entries journaled but not yet written to the database hold spaces
+        # too; the journal may write them while the query below runs
+        held = self._journaled_spaces()
+        self._loads += 1
+        try:
+            occupied = (await session.execute(
+                select(Ticket.space).where(Ticket.garage_id == self.garage_id, TICKET_IS_ACTIVE)
+            )).scalars().all()
+        finally:
+            self._loads -= 1
+        held |= self._journaled_spaces()
+        # So do spaces handed out to entries that have not committed yet, or
+        # that committed after the query read the tickets
+        now = time.monotonic()
+        self._handed_out = {
+            label: handed_out_at for label, handed_out_at in self._handed_out.items()
+            if now - handed_out_at < SPACE_HOLD_SECONDS
+        }
+        held |= self._handed_out.keys() | self._settled
+        if not self._loads:
+            self._settled = set()
+        known = set(occupied)
+        occupied += [label for label in held if label not in known]
+        layout, self.layout_from_file = layout_for_settings(settings)
+        self._configure(layout, occupied)
+        self.loaded = True
+        self.last_loaded = time.monotonic()
+
+    def invalidate(self):
+        """Rebuild from the database before the next assignment."""
+        self.loaded = False
+
+    def _stale(self, settings):
+        if not self.loaded:
+            return True
+        if not self.layout_from_file and self.layout.total_spaces != settings.total_spaces:
+            return True
+        return self.reload_seconds > 0 and time.monotonic() - self.last_loaded >= self.reload_seconds
+
+    async def ensure_loaded(self, session, settings):
+        """Load the allocator if it is missing, outdated or due for a rebuild."""
+        if self._stale(settings):
+            async with self._lock:
+                if self._stale(settings):
+                    await self.load(session, settings)
+
+    def _pool(self, vehicle_type):
+        pool = self._pools.get(vehicle_type)
+        if pool is None:
+            pool = self._pools[vehicle_type] = [
+                index for index, section in enumerate(self.layout.sections) if section.accepts(vehicle_type)
+            ]
+        return pool
+
+    def allocate(self, vehicle_type):
+        """Take the nearest free space for `vehicle_type`; None when there is none."""
+        # Active tickets from before spaces were assigned still take up room
+        if self._free_count <= self.unplaced:
+            return None
+        best = None
+        for section_index in self._pool(vehicle_type):
+            free = self._free[section_index]
+            if free and (best is None or free[0] < self._free[best][0]):
+                best = section_index
+        if best is None:
+            return None
+        index = heapq.heappop(self._free[best])
+        self._occupied[index >> 3] |= 1 << (index & 7)
+        self._free_count -= 1
+        label = self._labels[index]
+        self._handed_out[label] = time.monotonic()
+        return label
+
+    def settle(self, label):
+        """Stop holding a handed-out space across rebuilds: its entry committed, or lost it."""
+        self._handed_out.pop(label, None)
+        if self._loads:
+            # A rebuild reading right now may not see the committed entry
+            self._settled.add(label)
+
+    def release(self, label):
+        """Return a space to the free lists once its ticket has exited."""
+        self._handed_out.pop(label, None)
+        index = self._indexes.get(label) if label else None
+        if index is None:
+            self.unplaced = max(self.unplaced - 1, 0)
+            return
+        if not self._is_occupied(index):
+            return
+        self._occupied[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+        self._free_count += 1
+        heapq.heappush(self._free[bisect.bisect_right(self._starts, index) - 1], index)
+
+    async def assign(self, session, settings, vehicle_type):
+        """Nearest free space for `vehicle_type`, rebuilding once before giving up.
+
+        Settle (or release) the space once its entry is committed (or fails).
+        """
+        await self.ensure_loaded(session, settings)
+        space = self.allocate(vehicle_type)
+        if space is None:
+            # Spaces freed through other workers only show up after a rebuild
+            async with self._lock:
+                await self.load(session, settings)
+            space = self.allocate(vehicle_type)
+        return space
+
+    def summary(self):
+        """Free and total spaces per section, nearest first."""
+        return [
+            {
+                **section.to_dict(),
+                'free': sum(1 for index in range(start, start + count) if not self._is_occupied(index))
+            }
+            for section, (start, count) in zip(self.layout.sections, self._sections)
+        ]
+
+
+# Allocator of the default garage in this worker process (see garages.py)
+space_allocator = SpaceAllocator()
@@ -0,0 +1,171 @@
+"""In-memory table of the built frontend.
+
+`client/dist` is read once per worker at startup. Every file becomes an
+immutable `Asset` holding its bytes, a strong ETag derived from a content
+hash, its cache policy and any precompressed variants, so serving a request
+is a dict lookup with no filesystem access.
+
+Vite emits content-hashed file names under `assets/` (`index-3f9a1c2b.js`);
+those are cached by browsers for a year. Everything else, `index.html` in
+particular, must be revalidated on each use, which the ETag turns into a
+`304 Not Modified`. Precompressed `.br` and `.gz` files next to an asset are
+picked by `Accept-Encoding`; text assets without a `.gz` get one built at
+load time.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+from starlette.responses import Response
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+# Built frontend to serve
+STATIC_DIR = os.getenv('STATIC_DIR', os.path.join(SERVER_DIR, '..', 'client', 'dist'))
+# Text assets smaller than this are not worth compressing
+STATIC_GZIP_MIN_BYTES = int(os.getenv('STATIC_GZIP_MIN_BYTES', 1024))
+
+HASHED_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+# Content-hashed names from the bundler, e.g. assets/index-3f9a1c2b.js
+HASHED_NAME = re.compile(r'[-.][A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$')
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+# Content-Encoding for each precompressed suffix, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class Variant(NamedTuple):
+    body: bytes
+    etag: str
+
+
+class Asset(NamedTuple):
+    media_type: str
+    cache_control: str
+    variants: Mapping[str, Variant]  # content-encoding ('identity', 'br', 'gzip') -> variant
+
+
+def accepted_encodings(header):
+    """Content codings the client accepts, from an Accept-Encoding header."""
+    accepted = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    if '*' in accepted:
+        accepted.update(coding for coding, _ in ENCODINGS)
+    return accepted
+
+
+def _matches(if_none_match, etag):
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in tags or etag in tags
+
+
+def _etag(body, encoding):
+    digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+    return f'"{digest}"' if encoding == 'identity' else f'"{digest}-{encoding}"'
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def build_asset(path, relative_path):
+    """Read one file and its precompressed siblings into an Asset."""
+    body = _read(path)
+    media_type = mimetypes.guess_type(relative_path)[0] or 'application/octet-stream'
+    if media_type.startswith('text/') or media_type == 'application/javascript':
+        media_type += '; charset=utf-8'
+    hashed = relative_path.startswith('assets/') and HASHED_NAME.search(relative_path)
+
+    variants = {'identity': Variant(body, _etag(body, 'identity'))}
+    for encoding, suffix in ENCODINGS:
+        if os.path.isfile(path + suffix):
+            compressed = _read(path + suffix)
+            variants[encoding] = Variant(compressed, _etag(body, encoding))
+    if ('gzip' not in variants and len(body) >= STATIC_GZIP_MIN_BYTES
+            and media_type.startswith(COMPRESSIBLE_TYPES)):
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            variants['gzip'] = Variant(compressed, _etag(body, 'gzip'))
+
+    return Asset(
+        media_type=media_type,
+        cache_control=HASHED_CACHE_CONTROL if hashed else REVALIDATE_CACHE_CONTROL,
+        variants=MappingProxyType(variants)
+    )
+
+
+def load_assets(directory):
+    """Index every file under `directory` by its URL path; empty if it is missing."""
+    assets = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                base = os.path.join(root, name.rsplit('.', 1)[0])
+                if os.path.isfile(base):
+                    continue  # served as a variant of `base`
+            path = os.path.join(root, name)
+            relative_path = os.path.relpath(path, directory).replace(os.sep, '/')
+            assets[relative_path] = build_asset(path, relative_path)
+    return MappingProxyType(assets)
+
+
+class StaticAssets:
+    """Per-worker frontend table; `load` swaps in a new immutable table."""
+
+    def __init__(self, directory=STATIC_DIR):
+        self.directory = directory
+        self.assets = MappingProxyType({})
+
+    def __len__(self):
+        return len(self.assets)
+
+    def load(self):
+        self.assets = load_assets(self.directory)
+
+    def get(self, path):
+        """Asset for a URL path, falling back to index.html for client-side routes.
+
+        Returns None for unknown API paths and missing files under assets/,
+        which must be a 404 rather than the app shell.
+        """
+        asset = self.assets.get(path)
+        if asset is not None:
+            return asset
+        if path.startswith(('api/', 'assets/')) or path == 'api':
+            return None
+        return self.assets.get('index.html')
+
+    def response(self, asset, accept_encoding, if_none_match):
+        """Response for `asset`, compressed if the client allows and 304 if unchanged."""
+        accepted = accepted_encodings(accept_encoding)
+        encoding = next(
+            (coding for coding, _ in ENCODINGS if coding in accepted and coding in asset.variants),
+            'identity'
+        )
+        variant = asset.variants[encoding]
+        headers = {'ETag': variant.etag, 'Cache-Control': asset.cache_control}
+        if len(asset.variants) > 1:
+            headers['Vary'] = 'Accept-Encoding'
+        if if_none_match and _matches(if_none_match, variant.etag):
+            return Response(status_code=304, headers=headers)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(variant.body, media_type=asset.media_type, headers=headers)
+
+
+# Shared table for this worker process
+static_assets = StaticAssets()
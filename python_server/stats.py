@@ -0,0 +1,127 @@
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import func, select
+from models import Ticket, DailyRollup, DEFAULT_GARAGE_ID, TICKET_IS_ACTIVE
+
+# Seconds between automatic reconciliations against the database (0 disables)
+STATS_RECONCILE_SECONDS = float(os.getenv('STATS_RECONCILE_SECONDS', 300))
+
+
+def _start_of_day(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class GarageStats:
+    """In-memory occupancy and revenue counters for one garage.
+
+    The counters are loaded from the database once and then kept up to date by
+    the ticket endpoints, so the stats endpoint can answer without querying the
+    tickets table. `load` can be called again at any time to reconcile drift
+    (e.g. writes made by another worker process).
+    """
+
+    def __init__(self, garage_id=DEFAULT_GARAGE_ID, reconcile_seconds=STATS_RECONCILE_SECONDS):
+        self._lock = threading.Lock()
+        self.garage_id = garage_id
+        self.reconcile_seconds = reconcile_seconds
+        self.loaded = False
+        self.last_loaded = 0.0
+        self.occupied_spaces = 0
+        self.day = None
+        self.todays_revenue = 0
+        self.vehicles_processed_today = 0
+        self.completed_count = 0
+        self.completed_duration_sum = 0
+
+    async def load(self, session, now=None):
+        """Load all counters from the database."""
+        now = now or datetime.now()
+        today = _start_of_day(now)
+
+        occupied = (await session.execute(
+            select(func.count(Ticket.id)).where(Ticket.garage_id == self.garage_id, TICKET_IS_ACTIVE)
+        )).scalar() or 0
+        # Revenue and stay times come from the small daily rollup table
+        revenue, processed = (await session.execute(
+            select(func.sum(DailyRollup.revenue), func.sum(DailyRollup.exits)).where(
+                DailyRollup.garage_id == self.garage_id, DailyRollup.bucket_start == today
+            )
+        )).one()
+        duration_sum, duration_count = (await session.execute(
+            select(func.sum(DailyRollup.duration_sum), func.sum(DailyRollup.duration_count))
+            .where(DailyRollup.garage_id == self.garage_id)
+        )).one()
+
+        with self._lock:
+            self.occupied_spaces = occupied
+            self.day = today
+            self.todays_revenue = revenue or 0
+            self.vehicles_processed_today = processed or 0
+            self.completed_duration_sum = duration_sum or 0
+            self.completed_count = duration_count or 0
+            self.loaded = True
+            self.last_loaded = time.monotonic()
+
+    def needs_reconcile(self):
+        """Whether the counters are missing or older than the reconcile interval."""
+        if not self.loaded:
+            return True
+        if self.reconcile_seconds <= 0:
+            return False
+        return time.monotonic() - self.last_loaded >= self.reconcile_seconds
+
+    def _roll_day(self, now):
+        # Reset the daily counters when the day changes
+        today = _start_of_day(now)
+        if self.day != today:
+            self.day = today
+            self.todays_revenue = 0
+            self.vehicles_processed_today = 0
+
+    def record_entry(self):
+        """Count a newly issued ticket."""
+        with self._lock:
+            self.occupied_spaces += 1
+
+    def record_exit(self, amount_paid, duration_minutes, exit_time):
+        """Count a completed ticket."""
+        with self._lock:
+            self._roll_day(datetime.now())
+            self.occupied_spaces = max(self.occupied_spaces - 1, 0)
+            if exit_time >= self.day:
+                self.todays_revenue += amount_paid or 0
+                self.vehicles_processed_today += 1
+            if duration_minutes is not None:
+                self.completed_duration_sum += duration_minutes
+                self.completed_count += 1
+
+    def to_response(self, settings, now=None):
+        """Build the GET /api/garage/stats payload from the counters."""
+        with self._lock:
+            self._roll_day(now or datetime.now())
+            total_spaces = settings.total_spaces
+            occupied_spaces = self.occupied_spaces
+            avg_stay = (
+                self.completed_duration_sum / self.completed_count
+                if self.completed_count else 0
+            )
+
+            occupied_percentage = math.floor((occupied_spaces / total_spaces) * 100)
+            return {
+                'totalSpaces': total_spaces,
+                'occupiedSpaces': occupied_spaces,
+                'availableSpaces': total_spaces - occupied_spaces,
+                'occupiedSpacesPercentage': occupied_percentage,
+                'availableSpacesPercentage': 100 - occupied_percentage,
+                'hourlyRate': settings.hourly_rate / 100,  # Convert to dollars
+                'todaysRevenue': self.todays_revenue / 100,  # Convert to dollars
+                'vehiclesProcessedToday': self.vehicles_processed_today,
+                'averageStayTime': round(avg_stay / 60, 1) if avg_stay else 0.0  # Convert to hours and round to 1 decimal place
+            }
+
+
+# Counters of the default garage in this worker process (see garages.py)
+garage_stats = GarageStats()
@@ -0,0 +1,232 @@
+"""Parking tariffs and the fee engine.
+
+A `Tariff` describes how a stay is priced; `compile_tariff` turns it into
+lookup tables so that pricing one exit is a couple of table reads, and pricing
+millions of historical tickets is a handful of NumPy array operations.
+
+Stays are billed per started hour. Billing restarts every 24 hours from the
+entry time: within each 24-hour block the hourly price depends on the hour's
+position in the block (tiers) and on the hour of day it starts at (night
+rate), and the block total is capped at `daily_cap`.
+
+    python tariffs.py reprice tariff.json
+"""
+import json
+import math
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from database import DEFAULT_GARAGE_ID
+
+# Optional JSON file with the tariff to charge (defaults to the flat hourly rate)
+TARIFF_FILE = os.getenv('TARIFF_FILE')
+
+HOURS_PER_BLOCK = 24
+
+
+@dataclass(frozen=True)
+class Tariff:
+    hourly_rate: int  # cents per hour
+    vehicle_rates: Dict[str, int] = field(default_factory=dict)  # cents per hour by vehicle_type
+    # (from_hour, multiplier) pairs applied to the hours of each 24-hour block,
+    # e.g. ((0, 1.0), (3, 0.5)) halves the rate from the fourth hour on
+    tiers: Tuple[Tuple[int, float], ...] = ()
+    night_rate: Optional[int] = None  # cents per hour for hours starting at night
+    night_start: int = 22
+    night_end: int = 6
+    daily_cap: Optional[int] = None  # cents per 24-hour block
+    grace_minutes: int = 0  # stays this short are free
+
+    def __hash__(self):
+        return hash((self.hourly_rate, tuple(sorted(self.vehicle_rates.items())), self.tiers,
+                     self.night_rate, self.night_start, self.night_end, self.daily_cap,
+                     self.grace_minutes))
+
+    @classmethod
+    def from_dict(cls, data, hourly_rate=None):
+        """Build a tariff from its JSON form; `hourly_rate` fills in a missing rate."""
+        return cls(
+            hourly_rate=data.get('hourlyRate', hourly_rate),
+            vehicle_rates=dict(data.get('vehicleRates', {})),
+            tiers=tuple((int(start), float(multiplier)) for start, multiplier in data.get('tiers', [])),
+            night_rate=data.get('nightRate'),
+            night_start=data.get('nightStart', 22),
+            night_end=data.get('nightEnd', 6),
+            daily_cap=data.get('dailyCap'),
+            grace_minutes=data.get('graceMinutes', 0),
+        )
+
+    def is_night(self, hour_of_day):
+        if self.night_start <= self.night_end:
+            return self.night_start <= hour_of_day < self.night_end
+        return hour_of_day >= self.night_start or hour_of_day < self.night_end
+
+    def hour_price(self, vehicle_rate, hour_of_day, hour_in_block):
+        """Price in cents of one hour of a stay."""
+        if self.night_rate is not None and self.is_night(hour_of_day):
+            return self.night_rate
+        multiplier = 1.0
+        for start, tier_multiplier in self.tiers:
+            if hour_in_block >= start:
+                multiplier = tier_multiplier
+        return round(vehicle_rate * multiplier)
+
+
+class CompiledTariff:
+    """Precomputed price tables for a tariff.
+
+    `block_totals[v][s][h]` is the (capped) price of the first `h` hours of a
+    24-hour block starting at hour-of-day `s` for vehicle class `v`; class 0
+    is the default rate.
+    """
+
+    def __init__(self, tariff):
+        self.tariff = tariff
+        self.vehicle_classes = {vehicle_type: index + 1 for index, vehicle_type in enumerate(tariff.vehicle_rates)}
+        rates = [tariff.hourly_rate] + list(tariff.vehicle_rates.values())
+
+        self.block_totals = []
+        for rate in rates:
+            by_start_hour = []
+            for start_hour in range(24):
+                totals = [0]
+                for hour in range(HOURS_PER_BLOCK):
+                    total = totals[-1] + tariff.hour_price(rate, (start_hour + hour) % 24, hour)
+                    if tariff.daily_cap is not None:
+                        total = min(total, tariff.daily_cap)
+                    totals.append(total)
+                by_start_hour.append(totals)
+            self.block_totals.append(by_start_hour)
+        self._table = None
+
+    def price(self, entry_time, exit_time, vehicle_type=None):
+        """Return (duration_minutes, amount_paid) for a single stay."""
+        # Calculate duration in minutes
+        duration_minutes = math.ceil((exit_time - entry_time).total_seconds() / 60)
+        if duration_minutes <= self.tariff.grace_minutes:
+            return duration_minutes, 0
+
+        # Bill per started hour, in 24-hour blocks from the entry time
+        hours = math.ceil(duration_minutes / 60)
+        days, remaining_hours = divmod(hours, HOURS_PER_BLOCK)
+        totals = self.block_totals[self.vehicle_classes.get(vehicle_type, 0)][entry_time.hour]
+        return duration_minutes, days * totals[HOURS_PER_BLOCK] + totals[remaining_hours]
+
+    def vehicle_class_codes(self, vehicle_types):
+        """Map an array of vehicle_type strings to vehicle class indexes."""
+        import numpy as np
+        vehicle_types = np.asarray(vehicle_types, dtype=object)
+        codes = np.zeros(len(vehicle_types), dtype=np.int64)
+        for vehicle_type, code in self.vehicle_classes.items():
+            codes[vehicle_types == vehicle_type] = code
+        return codes
+
+    def price_batch(self, entry_times, exit_times, vehicle_types=None):
+        """Vectorized `price` over arrays of stays.
+
+        Takes datetime64 arrays (or anything NumPy converts to them) and an
+        optional array of vehicle_type strings; returns (duration_minutes,
+        amount_paid) as int64 arrays.
+        """
+        import numpy as np
+        if self._table is None:
+            self._table = np.asarray(self.block_totals, dtype=np.int64)
+
+        entry_times = np.asarray(entry_times, dtype='datetime64[us]')
+        exit_times = np.asarray(exit_times, dtype='datetime64[us]')
+        elapsed_us = (exit_times - entry_times).astype(np.int64)
+
+        # Same float arithmetic as timedelta.total_seconds() / 60 so results match `price`
+        duration_minutes = np.ceil(elapsed_us.astype(np.float64) / 1e6 / 60).astype(np.int64)
+        hours = -(-duration_minutes // 60)
+        days, remaining_hours = np.divmod(hours, HOURS_PER_BLOCK)
+        start_hours = entry_times.astype('datetime64[h]').astype(np.int64) % 24
+
+        if vehicle_types is None:
+            classes = np.zeros(len(entry_times), dtype=np.int64)
+        else:
+            classes = self.vehicle_class_codes(vehicle_types)
+
+        totals = self._table[classes, start_hours]
+        amounts = days * totals[:, HOURS_PER_BLOCK] + np.take_along_axis(
+            totals, remaining_hours[:, None], axis=1
+        )[:, 0]
+        amounts[duration_minutes <= self.tariff.grace_minutes] = 0
+        return duration_minutes, amounts
+
+
+@lru_cache(maxsize=32)
+def compile_tariff(tariff):
+    return CompiledTariff(tariff)
+
+
+@lru_cache(maxsize=1)
+def _load_tariff_file(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def tariff_for_settings(settings):
+    """The compiled tariff in force for the given garage settings."""
+    if TARIFF_FILE:
+        return compile_tariff(Tariff.from_dict(_load_tariff_file(TARIFF_FILE), settings.hourly_rate))
+    return compile_tariff(Tariff(hourly_rate=settings.hourly_rate))
+
+
+def reprice_tickets(connection, tariff, chunk_size=100_000, garage_id=DEFAULT_GARAGE_ID):
+    """Price a garage's completed tickets under `tariff` and compare with what was paid.
+
+    Rows are streamed from the database in chunks and priced with NumPy, so
+    memory stays bounded regardless of table size.
+    """
+    import numpy as np
+    from sqlalchemy import select
+    from models import Ticket, TICKET_IS_COMPLETED
+
+    compiled = compile_tariff(tariff)
+    summary = {'tickets': 0, 'changed': 0, 'currentRevenue': 0, 'proposedRevenue': 0}
+    result = connection.execution_options(yield_per=chunk_size).execute(
+        select(Ticket.entry_time, Ticket.exit_time, Ticket.vehicle_type, Ticket.amount_paid)
+        .where(Ticket.garage_id == garage_id, TICKET_IS_COMPLETED)
+    )
+    for rows in result.partitions():
+        entry_times, exit_times, vehicle_types, paid = zip(*rows)
+        _, amounts = compiled.price_batch(
+            np.array(entry_times, dtype='datetime64[us]'),
+            np.array(exit_times, dtype='datetime64[us]'),
+            vehicle_types,
+        )
+        paid = np.array([amount or 0 for amount in paid], dtype=np.int64)
+        summary['tickets'] += len(rows)
+        summary['changed'] += int(np.count_nonzero(amounts != paid))
+        summary['currentRevenue'] += int(paid.sum())
+        summary['proposedRevenue'] += int(amounts.sum())
+    return summary
+
+
+if __name__ == '__main__':
+    import argparse
+    from database import each_database
+    from models import GarageSetting
+    from sqlalchemy import select
+
+    parser = argparse.ArgumentParser(description='Price completed tickets under a tariff file.')
+    parser.add_argument('command', choices=['reprice'])
+    parser.add_argument('tariff', help='tariff JSON file')
+    parser.add_argument('--garage', type=int, help='only this garage (default every garage)')
+    args = parser.parse_args()
+
+    with open(args.tariff) as f:
+        tariff_data = json.load(f)
+    summaries = []
+    # Every garage, on DATABASE_URL and on each shard, priced with its own rate
+    for engine in each_database():
+        with engine.connect() as connection:
+            query = select(GarageSetting.garage_id, GarageSetting.hourly_rate).order_by(GarageSetting.garage_id)
+            if args.garage is not None:
+                query = query.where(GarageSetting.garage_id == args.garage)
+            for garage_id, hourly_rate in connection.execute(query).all():
+                tariff = Tariff.from_dict(tariff_data, hourly_rate)
+                summaries.append({'garageId': garage_id, **reprice_tickets(connection, tariff, garage_id=garage_id)})
+    print(json.dumps(summaries, indent=2))
@@ -1,12 +1,16 @@
 import requests
 import json
 import os
+import time
 
 # Base URL for API requests
 # Set API_PORT environment variable to switch between Node.js (5000) and Python (5001) servers
 API_PORT = os.getenv('API_PORT', '5000')
 BASE_URL = f'http://localhost:{API_PORT}/api'
 
+# Cold start budget for a fresh FastAPI process to answer its first request
+STARTUP_BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', 5000))
+
 def test_api_connection():
     """Test the API connection to ensure the server is running."""
     api_url = f'{BASE_URL}/status'
@@ -39,6 +43,25 @@ def test_garage_stats():
         print(f"✗ Garage Stats Test Failed: {e}")
         return False
 
+def test_garage_settings():
+    """Test reading and updating the garage settings."""
+    try:
+        response = requests.get(f'{BASE_URL}/garage/settings')
+        assert response.status_code == 200
+        settings = response.json()
+        
+        response = requests.put(f'{BASE_URL}/garage/settings', json={'hourlyRate': settings['hourlyRate']})
+        assert response.status_code == 200
+        data = response.json()
+        assert data['hourlyRate'] == settings['hourlyRate']
+        assert data['version'] == settings['version'] + 1
+        print("✓ Garage Settings Test Successful")
+        print(f"  Settings version: {data['version']}")
+        return True
+    except Exception as e:
+        print(f"✗ Garage Settings Test Failed: {e}")
+        return False
+
 def test_create_ticket():
     """Test creating a new parking ticket."""
     try:
@@ -73,6 +96,250 @@ def test_get_ticket(ticket_number):
         print(f"✗ Get Ticket Test Failed: {e}")
         return False
 
+def test_search_tickets():
+    """Test finding the ticket created above by (differently formatted) plate."""
+    try:
+        response = requests.get(f'{BASE_URL}/tickets/search', params={'plate': 'test-123', 'active': 'true'})
+        assert response.status_code == 200
+        data = response.json()
+        assert data and data[0]['licensePlate'] == 'TEST123'
+        
+        response = requests.get(f'{BASE_URL}/tickets/search', params={'plate': 'TEST12', 'match': 'prefix'})
+        assert response.status_code == 200
+        assert any(ticket['licensePlate'] == 'TEST123' for ticket in response.json())
+        
+        response = requests.get(f'{BASE_URL}/tickets/search', params={'plate': 'TEST128', 'match': 'fuzzy'})
+        assert response.status_code == 200
+        
+        response = requests.post(f'{BASE_URL}/tickets', json={'licensePlate': 'TEST 123', 'vehicleType': 'Car'})
+        assert response.status_code == 409
+        print("✓ Search Tickets Test Successful")
+        return True
+    except Exception as e:
+        print(f"✗ Search Tickets Test Failed: {e}")
+        return False
+
+def test_garage_spaces():
+    """Test the per-section space summary."""
+    try:
+        response = requests.get(f'{BASE_URL}/garage/spaces')
+        assert response.status_code == 200
+        data = response.json()
+        assert data and all(0 <= section['free'] <= section['spaces'] for section in data)
+        print("✓ Garage Spaces Test Successful")
+        for section in data:
+            print(f"  {section['zone']}{section['level']}: {section['free']}/{section['spaces']} free")
+        return True
+    except Exception as e:
+        print(f"✗ Garage Spaces Test Failed: {e}")
+        return False
+
+def test_garage_analytics():
+    """Test the occupancy analytics of the default window."""
+    try:
+        response = requests.get(f'{BASE_URL}/garage/analytics', params={'bucketMinutes': 60, 'horizonHours': 24})
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data['occupancy']) > 0
+        assert len(data['heatmap']['averageOccupancy']) == 7
+        assert len(data['forecast']) == 24
+        print("✓ Garage Analytics Test Successful")
+        print(f"  Stays: {data['stays']}, buckets: {len(data['occupancy'])}")
+        return True
+    except Exception as e:
+        print(f"✗ Garage Analytics Test Failed: {e}")
+        return False
+
+def test_garages():
+    """Test that a second garage keeps its own tickets and stats."""
+    try:
+        garage_url = f'{BASE_URL}/garages/2'
+        response = requests.put(f'{garage_url}/settings', json={'totalSpaces': 20})
+        assert response.status_code == 200
+        assert response.json()['garageId'] == 2
+        before = requests.get(f'{garage_url}/stats').json()
+        response = requests.post(f'{garage_url}/tickets', json={
+            'licensePlate': 'GARAGE-2',
+            'vehicleType': 'Compact Car'
+        })
+        assert response.status_code == 201
+        ticket = response.json()
+        assert ticket['garageId'] == 2
+        response = requests.get(f'{BASE_URL}/tickets/{ticket["ticketNumber"]}')
+        assert response.status_code == 404 or response.json()['garageId'] == 1
+        after = requests.get(f'{garage_url}/stats').json()
+        assert after['availableSpaces'] == before['availableSpaces'] - 1
+        response = requests.put(f'{garage_url}/tickets/{ticket["ticketNumber"]}/exit', json={
+            'paymentMethod': 'Cash'
+        })
+        assert response.status_code == 200
+        # Garages without settings are not served (nor remembered)
+        unknown_url = f'{BASE_URL}/garages/987654'
+        for response in (
+            requests.get(f'{unknown_url}/stats'),
+            requests.get(f'{unknown_url}/activities'),
+            requests.get(f'{unknown_url}/reports/daily'),
+            requests.post(f'{unknown_url}/tickets', json={'licensePlate': 'NOWHERE', 'vehicleType': 'Compact Car'}),
+        ):
+            assert response.status_code == 404
+            assert response.json()['message'] == 'Garage not found'
+        print("✓ Garages Test Successful")
+        print(f"  Garage 2: {after['availableSpaces']}/{after['totalSpaces']} available")
+        return True
+    except Exception as e:
+        print(f"✗ Garages Test Failed: {e}")
+        return False
+
+def test_ticket_number_blocks():
+    """Test that two allocators sharing a database never hand out the same number."""
+    try:
+        import asyncio
+        import tempfile
+        from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+        from models import TicketSequence
+        from ticket_numbers import TicketNumberAllocator
+
+        async def allocate_concurrently():
+            path = os.path.join(tempfile.mkdtemp(), 'numbers.db')
+            engine = create_async_engine(f'sqlite+aiosqlite:///{path}')
+            try:
+                async with engine.begin() as connection:
+                    await connection.run_sync(TicketSequence.__table__.create)
+                sessions = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+                # Small blocks so the two allocators reserve many times each
+                allocators = [TicketNumberAllocator(sessions, block_size=7) for _ in range(2)]
+                batches = await asyncio.gather(
+                    *(allocator.allocate(3) for allocator in allocators for _ in range(20))
+                )
+                return [number for batch in batches for number in batch]
+            finally:
+                await engine.dispose()
+
+        numbers = asyncio.run(allocate_concurrently())
+        assert len(numbers) == 120
+        assert len(set(numbers)) == len(numbers), "duplicate ticket numbers"
+        print("✓ Ticket Number Blocks Test Successful")
+        print(f"  {len(numbers)} numbers from two allocators, all unique")
+        return True
+    except Exception as e:
+        print(f"✗ Ticket Number Blocks Test Failed: {e}")
+        return False
+
+def test_entry_journal_startup(rounds=50):
+    """Test that workers starting together never replay (and remove) each other's live journal."""
+    import fcntl
+    import entry_journal
+
+    class SlowLocks:
+        # Widens the gap between a worker creating its journal and locking it
+        def __getattr__(self, name):
+            return getattr(fcntl, name)
+
+        @staticmethod
+        def flock(file, operation):
+            time.sleep(0.005)
+            fcntl.flock(file, operation)
+
+    try:
+        import asyncio
+        import tempfile
+        import threading
+        from database import garage_sessionmaker
+        from entry_journal import EntryJournal
+
+        entry_journal.fcntl = SlowLocks()
+        for _ in range(rounds):
+            directory = tempfile.mkdtemp()
+            started = threading.Barrier(2)
+            opened = threading.Barrier(2)
+            outcomes = []
+
+            def worker():
+                # Each thread stands in for a worker process with its own loop
+                async def run():
+                    journal = EntryJournal(enabled=True, directory=directory)
+                    started.wait()
+                    await journal.start(garage_sessionmaker)
+                    opened.wait()
+                    outcomes.append(os.path.exists(journal._path))
+                    await journal.stop()
+                try:
+                    asyncio.run(run())
+                except Exception as e:
+                    opened.abort()
+                    outcomes.append(e)
+
+            threads = [threading.Thread(target=worker) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert outcomes == [True, True], f"journal startup: {outcomes}"
+        print("✓ Entry Journal Startup Test Successful")
+        print(f"  {rounds} rounds of two workers starting at once")
+        return True
+    except Exception as e:
+        print(f"✗ Entry Journal Startup Test Failed: {e}")
+        return False
+    finally:
+        entry_journal.fcntl = fcntl
+
+def test_entry_journal_sync_failure():
+    """Test that an entry whose fsync failed is neither kept pending nor blocks its plate."""
+    import entry_journal
+
+    class FailingSync:
+        def __getattr__(self, name):
+            return getattr(os, name)
+
+        @staticmethod
+        def fsync(fd):
+            raise OSError("disk full")
+
+    try:
+        import asyncio
+        import tempfile
+        from datetime import datetime
+        from database import garage_sessionmaker
+        from entry_journal import EntryJournal
+        from models import Ticket
+
+        def entry(ticket_number):
+            return Ticket(garage_id=1, ticket_number=ticket_number, license_plate='SYNC 1',
+                          normalized_plate='SYNC1', vehicle_type='Car', entry_time=datetime.now(),
+                          status='active', space='A1-001')
+
+        async def run():
+            # Flushed by hand only, so nothing reaches the database
+            journal = EntryJournal(enabled=True, directory=tempfile.mkdtemp(), flush_interval=3600)
+            await journal.start(garage_sessionmaker)
+            try:
+                entry_journal.os = FailingSync()
+                try:
+                    await journal.append(entry('SYNC-1'))
+                    raise AssertionError("append succeeded without fsync")
+                except OSError:
+                    pass
+                finally:
+                    entry_journal.os = os
+                assert not journal.pending, "failed entry left pending"
+                assert journal.parked_ticket('SYNC1') is None, "failed entry blocks its plate"
+                await journal.append(entry('SYNC-2'))
+                assert list(journal.pending) == ['SYNC-2']
+                assert journal.parked_ticket('SYNC1') == 'SYNC-2'
+            finally:
+                journal.pending.clear()
+                await journal.stop()
+
+        asyncio.run(run())
+        print("✓ Entry Journal Sync Failure Test Successful")
+        return True
+    except Exception as e:
+        print(f"✗ Entry Journal Sync Failure Test Failed: {e}")
+        return False
+    finally:
+        entry_journal.os = os
+
 def test_process_exit(ticket_number):
     """Test processing a vehicle exit."""
     try:
@@ -94,6 +361,30 @@ def test_process_exit(ticket_number):
         print(f"✗ Process Exit Test Failed: {e}")
         return False
 
+def test_batch_tickets():
+    """Test creating and exiting tickets in batches."""
+    try:
+        payload = {'tickets': [{'licensePlate': f'BATCH{i}', 'vehicleType': 'Car'} for i in range(3)]}
+        response = requests.post(f'{BASE_URL}/tickets/batch', json=payload)
+        assert response.status_code == 201
+        data = response.json()
+        assert data['succeeded'] == 3
+        ticket_numbers = [result['ticket']['ticketNumber'] for result in data['results']]
+        
+        payload = {'exits': [{'ticketNumber': n, 'paymentMethod': 'Credit Card'} for n in ticket_numbers]}
+        payload['exits'].append({'ticketNumber': ticket_numbers[0], 'paymentMethod': 'Credit Card'})
+        response = requests.put(f'{BASE_URL}/tickets/batch/exit', json=payload)
+        assert response.status_code == 200
+        data = response.json()
+        assert data['succeeded'] == 3
+        assert data['failed'] == 1
+        assert data['results'][3]['success'] is False
+        print("✓ Batch Tickets Test Successful")
+        return True
+    except Exception as e:
+        print(f"✗ Batch Tickets Test Failed: {e}")
+        return False
+
 def test_get_activities():
     """Test retrieving recent activities."""
     try:
@@ -108,6 +399,28 @@ def test_get_activities():
         print(f"✗ Get Activities Test Failed: {e}")
         return False
 
+def test_metrics():
+    """Test that routes mounted for the default and for any garage get their own series."""
+    try:
+        requests.get(f'{BASE_URL}/garage/stats')
+        requests.get(f'{BASE_URL}/garages/2/stats')
+        response = requests.get(f'http://localhost:{API_PORT}/metrics')
+        assert response.status_code == 200
+        routes = {
+            line.split('route="')[1].split('"')[0]
+            for line in response.text.splitlines()
+            if line.startswith('parking_http_request_sql_queries_count')
+        }
+        assert '/api/garage/stats' in routes
+        assert '/api/garages/{garage_id}/stats' in routes
+        assert '/stats' not in routes
+        print("✓ Metrics Test Successful")
+        print(f"  {len(routes)} routes")
+        return True
+    except Exception as e:
+        print(f"✗ Metrics Test Failed: {e}")
+        return False
+
 def test_api_docs():
     """Test accessing API documentation (FastAPI specific)."""
     if API_PORT == '5001':  # Only test for FastAPI
@@ -127,6 +440,20 @@ def test_api_docs():
             return False
     return None  # Skip for non-FastAPI
 
+def test_startup_time():
+    """Test that a fresh FastAPI process starts within the budget (FastAPI specific)."""
+    try:
+        from benchmarks.bench_startup import run
+        summary = run(runs=1)
+        first_request_ms = summary['schema_check']['first_request_ms']
+        assert first_request_ms <= STARTUP_BUDGET_MS, f"{first_request_ms:.0f} ms > {STARTUP_BUDGET_MS:.0f} ms"
+        print("✓ Startup Time Test Successful")
+        print(f"  import app: {summary['import_ms']:.0f} ms, first request: {first_request_ms:.0f} ms")
+        return True
+    except Exception as e:
+        print(f"✗ Startup Time Test Failed: {e}")
+        return False
+
 def run_all_tests():
     """Run all API tests sequentially."""
     print(f"\n=== Running API Tests on port {API_PORT} ===\n")
@@ -140,18 +467,36 @@ def run_all_tests():
     # Test garage stats
     test_garage_stats()
     
+    # Test garage settings (FastAPI only)
+    if API_PORT == '5001':
+        test_garage_settings()
+    
     # Test ticket operations
     ticket_number = test_create_ticket()
     if ticket_number:
         test_get_ticket(ticket_number)
+        if API_PORT == '5001':
+            test_search_tickets()
+            test_garage_spaces()
+            test_garages()
+            test_garage_analytics()
         test_process_exit(ticket_number)
     
+    # Test batch operations (FastAPI only)
+    if API_PORT == '5001':
+        test_batch_tickets()
+    
     # Test activities
     test_get_activities()
     
     # Test FastAPI-specific features
     if API_PORT == '5001':
+        test_ticket_number_blocks()
+        test_entry_journal_startup()
+        test_entry_journal_sync_failure()
+        test_metrics()
         test_api_docs()
+        test_startup_time()
     
     print(f"\n=== API Tests Complete (port {API_PORT}) ===\n")
 
@@ -0,0 +1,73 @@
+import asyncio
+import os
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from models import TicketSequence
+
+# Ticket numbers look like PS-10000; the old random scheme used PS-1000..PS-9999,
+# so the sequence starts above that range
+TICKET_NUMBER_PREFIX = os.getenv('TICKET_NUMBER_PREFIX', 'PS-')
+TICKET_NUMBER_START = int(os.getenv('TICKET_NUMBER_START', 10000))
+# How many numbers a worker reserves from the database at a time
+TICKET_NUMBER_BLOCK_SIZE = int(os.getenv('TICKET_NUMBER_BLOCK_SIZE', 100))
+
+
+class TicketNumberAllocator:
+    """Hands out unique ticket numbers from blocks reserved in the database.
+
+    Each worker process atomically bumps the `ticket_sequences` row by
+    `block_size` and then issues numbers from its reserved range in memory, so
+    ticket creation never has to retry against the unique constraint. Numbers
+    left in a block when a worker stops are simply skipped.
+    """
+
+    def __init__(self, session_factory, name='tickets', prefix=TICKET_NUMBER_PREFIX,
+                 start=TICKET_NUMBER_START, block_size=TICKET_NUMBER_BLOCK_SIZE):
+        self.session_factory = session_factory
+        self.name = name
+        self.prefix = prefix
+        self.start = start
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def _reserve_block(self, size):
+        # Reserve in a separate transaction so the block stays taken even if
+        # the request that triggered it rolls back
+        async with self.session_factory() as session:
+            while True:
+                end = (await session.execute(
+                    update(TicketSequence)
+                    .where(TicketSequence.name == self.name)
+                    .values(next_value=TicketSequence.next_value + size)
+                    .returning(TicketSequence.next_value)
+                )).scalar()
+                if end is not None:
+                    await session.commit()
+                    return end - size, end
+                try:
+                    await session.execute(
+                        insert(TicketSequence).values(name=self.name, next_value=self.start)
+                    )
+                    await session.commit()
+                except IntegrityError:
+                    # Another worker created the sequence row first
+                    await session.rollback()
+
+    async def allocate(self, count=1):
+        """Return `count` unique ticket numbers."""
+        numbers = []
+        async with self._lock:
+            while len(numbers) < count:
+                if self._next >= self._end:
+                    size = max(self.block_size, count - len(numbers))
+                    self._next, self._end = await self._reserve_block(size)
+                take = min(self._end - self._next, count - len(numbers))
+                numbers.extend(range(self._next, self._next + take))
+                self._next += take
+        return [f"{self.prefix}{number}" for number in numbers]
+
+    async def next_number(self):
+        """Return a single unique ticket number."""
+        return (await self.allocate(1))[0]